@@ -1,73 +1,534 @@
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, url_for, stream_with_context
 from argparse import Namespace
+from dataclasses import asdict
+import threading
+import time
 
-from .scraper import run_scraper
+from .scraper import OptcgScraper, run_scraper, configure_logging
+from .concurrency import OrderedFetcher
+from .downloader import ImageDownloader
+from .images import ImageVariant
+from .archive import ArchiveWriter, iter_archive
+from .catalog import CardCatalog, DEFAULT_CATALOG_PATH
+from .card import CardFormatter
+from .search import SharedSearchIndex
+from .lookup import CardLookup
+from .reprints import SharedReprintIndex
+from .selection import CardSelection
+from .changes import ChangeLog
+from .response_cache import ResponseCache
+from .jobs import JobManager, JobStore
+from .metrics import REGISTRY, Registry
+from .profiling import SlowRequestProfiler
 
 app = Flask(__name__)
 
+# Requests reuse the process-wide scraper, so logging is configured once here rather than per call
+configure_logging(Namespace(debug=False, verbose=True))
 
-@app.route('/packs', defaults={'action': None})
-@app.route('/packs/<action>')
-def get_packs(action):
+# Serialized /packs and /cards/<series_id> responses, keyed by endpoint, series and format.
+response_cache = ResponseCache()
+
+# Background 'packs all' scrapes started through /packs/all, recorded in the catalog
+# database so that every gunicorn worker can report and join them
+job_manager = JobManager(store=JobStore(DEFAULT_CATALOG_PATH))
+
+# Guards the creation of the lazily created catalog and indexes below, so concurrent first
+# requests share one instance. Reentrant, as the indexes are created over the shared catalog.
+indexes_lock = threading.RLock()
+
+# The local catalog, created (with its schema) on the first request that reads it
+card_catalog = None
+
+# In-memory search index over the local catalog, created on the first /search request
+search_index = None
+
+# Card ID and card code index over the local catalog, created on the first /cards/lookup request
+card_lookup = None
+
+# Unique cards and their printings, created on the first /cards/unique or /printings request
+reprint_index = None
+
+# Opt-in: set OPTCG_PROFILE_DIR to keep cProfile dumps of the slowest requests
+profiler = SlowRequestProfiler.from_env()
+if profiler:
+    profiler.install(app, skip=('get_metrics',))
+
+
+def scrape(args, progress=None):
+    """
+    Run the scraper for a request on the process-wide scraper and its pooled session.
+    """
+    return run_scraper(args, progress=progress, scraper=OptcgScraper.shared())
+
+
+MIMETYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/plain',
+    'text': 'text/plain',
+}
+
+
+def serialize(result, format_type):
+    """
+    Return `(body, mimetype)` for a formatted scraper result, as the handlers send it.
+    JSON output is sent as the document itself, the same body `send_stream` produces.
+    """
+    return result.encode('utf-8'), MIMETYPES.get(format_type, 'text/plain')
+
+
+def wants_stream(format_type):
+    """
+    NDJSON is always streamed; other formats are streamed when `stream=1` is given.
+    """
+    return format_type == 'ndjson' or request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def send_stream(chunks, format_type):
+    """
+    Send formatted output chunk by chunk as it is produced, without buffering the body.
+    """
+    return Response(stream_with_context(chunks), mimetype=MIMETYPES.get(format_type, 'text/plain'))
+
+
+def send_cached(entry):
+    """
+    Send a cached response, answering If-None-Match with 304 and picking the stored
+    pre-compressed body that the client accepts.
+    """
+    encoding = None
+    for candidate in ('br', 'gzip'):
+        if candidate in entry.encoded and request.accept_encodings[candidate]:
+            encoding = candidate
+            break
+    etag = entry.etag_for(encoding)
+
+    if any(request.if_none_match.contains(tag) for tag in entry.etags()):
+        response = Response(status=304)
+    else:
+        response = Response(entry.encoded[encoding] if encoding else entry.body, mimetype=entry.mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.headers.update(entry.headers)
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+@app.route('/packs')
+def get_packs():
     """
     Handles requests for packs.
     - /packs?format=json -> Lists all packs.
-    - /packs/all?format=csv -> Scrapes all cards from all packs and saves them.
+    - /packs?format=ndjson -> Streams one pack per line (see `wants_stream`).
+    Scraping every pack is handled by `start_scrape_all`.
     """
     format_type = request.args.get('format', 'json')  # Default to json for API calls
 
-    # Create a mock 'args' object to pass to the scraper logic
-    args = Namespace(
-        command='packs',
-        action=action,
-        format=format_type,
-        verbose=True,
-        debug=False
-    )
+    try:
+        # Create a mock 'args' object to pass to the scraper logic
+        args = Namespace(
+            command='packs',
+            action=None,
+            format=format_type,
+            stream=wants_stream(format_type),
+            verbose=True,
+            debug=False
+        )
+
+        if args.stream:
+            return send_stream(scrape(args), format_type)
+        # For a simple 'packs' list, return the formatted data
+        entry = response_cache.get_or_create(
+            ('packs', format_type), lambda: serialize(scrape(args), format_type))
+        return send_cached(entry)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"An unexpected error occurred: {str(e)}"}), 500
+
+
+@app.route('/packs/all', methods=['GET', 'POST'])
+def start_scrape_all():
+    """
+    Starts scraping all cards from all packs in the background and returns at once.
+    - POST /packs/all?format=csv -> 202 with the job ID and its status URL.
+    - POST /packs/all?format=csv&workers=8&rate_limit=4 -> Same, fetching up to 8 packs at once
+      and sending at most 4 requests per second upstream.
+    - POST /packs/all?format=csv&workers=8&parse_workers=16 -> Same, parsing pages on 16
+      processes while 8 threads keep downloading.
+    - POST /packs/all?format=csv&incremental=1 -> Only rewrite packs whose page changed.
+    - POST /packs/all?format=ndjson -> One card per line in every pack file, as the CLI writes.
+    - POST /packs/all?format=img&thumb_sizes=200,400&image_formats=webp,avif -> Also make
+      thumbnails and variants of the downloaded images.
+    A request for a format that is already being scraped joins the running job; when its
+    settings differ, the answer names them and gives the running job's values.
+    """
+    format_type = request.args.get('format', 'json')
 
     try:
-        result = run_scraper(args)
-        if action == 'all':
-            # For 'packs all', the result is a confirmation message
-            return jsonify({"status": "success", "message": result})
-        else:
-            # For a simple 'packs' list, return the formatted data
-            if format_type == 'json':
-                return jsonify(result)
-            # For csv/text, return as plain text response
-            return Response(result, mimetype='text/plain')
+        args = Namespace(
+            command='packs',
+            action='all',
+            format=format_type,
+            max_workers=int(request.args.get('workers', OrderedFetcher.DEFAULT_WORKERS)),
+            parse_workers=int(request.args.get('parse_workers', 0)),
+            rate_limit=float(request.args['rate_limit']) if 'rate_limit' in request.args else None,
+            download_workers=int(request.args.get('download_workers', ImageDownloader.DEFAULT_WORKERS)),
+            thumb_sizes=request.args.get('thumb_sizes'),
+            image_formats=request.args.get('image_formats'),
+            incremental=request.args.get('incremental', '').lower() in ('1', 'true', 'yes'),
+            verbose=True,
+            debug=False
+        )
+        if format_type not in (*CardFormatter.STREAM_FORMATS, 'img'):
+            raise ValueError(f"Invalid format type specified: '{format_type}'.")
+        if args.parse_workers < 0:
+            raise ValueError(f"'parse_workers' must not be negative, got {args.parse_workers}.")
+        if args.thumb_sizes or args.image_formats:
+            ImageVariant.parse(args.thumb_sizes, args.image_formats)
+
+        def body(job):
+            result = scrape(args, progress=job)
+            response_cache.clear()
+            return result
+
+        # One run per format, as runs of the same format write the same output files
+        job, created = job_manager.submit(('packs', 'all', format_type), vars(args), body)
+        response = {
+            "status": "accepted" if created else "joined",
+            "job_id": job.job_id,
+            "status_url": url_for('get_job', job_id=job.job_id),
+        }
+        differing = {name: job.params.get(name) for name, value in vars(args).items() if job.params.get(name) != value}
+        if differing:
+            response["message"] = (f"A scrape of format '{format_type}' is already running and was joined; its "
+                                   f"settings differ from this request's ({', '.join(differing)}).")
+            response["running_settings"] = differing
+        return jsonify(response), 202
     except ValueError as e:
         return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": f"An unexpected error occurred: {str(e)}"}), 500
 
 
+@app.route('/jobs')
+def list_jobs():
+    """
+    Lists running and recently finished background jobs, newest last.
+    """
+    return jsonify([job.to_dict() for job in job_manager.list()])
+
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """
+    Reports the status of a background job, with progress for every pack.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Unknown job '{job_id}'."}), 404
+    return jsonify(job.to_dict())
+
+
+# Query parameters of /cards/<series_id> read by `CardSelection`; any others (e.g. cache busters) are ignored
+SELECTION_PARAMS = frozenset(CardSelection.PARAMS + tuple(CardCatalog.available_filters()))
+
+
+def page_headers(series_id, selection):
+    """
+    `X-Total-Count` with the number of matching cards, and a `Link` to the next page when
+    `limit` left cards out.
+    """
+    if selection.matched is None:
+        return {}
+    headers = {'X-Total-Count': str(selection.matched)}
+    if selection.limit is not None and selection.offset + selection.limit < selection.matched:
+        params = dict(request.args.items(), offset=selection.offset + selection.limit)
+        headers['Link'] = f'<{url_for("get_cards", series_id=series_id, **params)}>; rel="next"'
+    return headers
+
+
 @app.route('/cards/<series_id>')
 def get_cards(series_id):
     """
     Handles requests for cards from a specific series.
     - /cards/556101?format=json -> Lists all cards in pack OP-01.
+    - /cards/556101?format=csv&stream=1 -> Streams the CSV rows as they are formatted.
+    - /cards/556101?fields=card_code,name,img_url&rarity=SR&limit=20&offset=40&compact=1
+      -> Only those fields of one page of the matching cards, as compact JSON. See `CardSelection`;
+      `X-Total-Count` and `Link` headers describe the pages.
+    Responses are cached per series, format and selection, see `send_cached`.
+    """
+    format_type = request.args.get('format', 'json')
+
+    try:
+        selection = CardSelection.from_params({k: v for k, v in request.args.items() if k in SELECTION_PARAMS})
+        args = Namespace(
+            command='cards',
+            series_id=series_id,
+            format=format_type,
+            download_workers=int(request.args.get('download_workers', ImageDownloader.DEFAULT_WORKERS)),
+            thumb_sizes=request.args.get('thumb_sizes'),
+            image_formats=request.args.get('image_formats'),
+            stream=wants_stream(format_type),
+            selection=selection,
+            verbose=True,
+            debug=False
+        )
+
+        if format_type == 'img':
+            # Image downloads are a side effect, never served from the cache
+            return Response(scrape(args), mimetype='text/plain')
+        if args.stream:
+            return send_stream(scrape(args), format_type)
+        key = ('cards', series_id, format_type)
+        if not selection.is_default():
+            key += (selection.key(),)
+
+        def build():
+            return (*serialize(scrape(args), format_type), page_headers(series_id, selection))
+
+        return send_cached(response_cache.get_or_create(key, build))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"An unexpected error occurred: {str(e)}"}), 500
+
+
+MAX_LOOKUP_KEYS = 1000
+
+
+def shared_catalog() -> CardCatalog:
+    global card_catalog
+    with indexes_lock:
+        if card_catalog is None:
+            card_catalog = CardCatalog(DEFAULT_CATALOG_PATH)
+    return card_catalog
+
+
+def shared_card_lookup() -> CardLookup:
+    global card_lookup
+    with indexes_lock:
+        if card_lookup is None:
+            card_lookup = CardLookup(shared_catalog())
+    return card_lookup
+
+
+@app.route('/cards/lookup', methods=['GET', 'POST'])
+def lookup_cards():
+    """
+    Resolves a whole decklist from the local catalog in one call.
+    - POST /cards/lookup with `["OP01-006", "OP01-006_p1", "OP01-025"]` or
+      `{"cards": [...]}` -> The card for every card code or card ID, in request order,
+      and the keys that were not found.
+    - GET /cards/lookup -> 405, instead of being taken for a series by `get_cards`.
+    """
+    if request.method != 'POST':
+        return jsonify({"status": "error", "message": "Look up cards with POST /cards/lookup."}), 405, {'Allow': 'POST'}
+    payload = request.get_json(silent=True)
+    keys = payload.get('cards') if isinstance(payload, dict) else payload
+    if not isinstance(keys, list) or not all(isinstance(key, str) for key in keys):
+        return jsonify({"status": "error",
+                        "message": "Expected a JSON list of card codes or card IDs, or {\"cards\": [...]}."}), 400
+    if len(keys) > MAX_LOOKUP_KEYS:
+        return jsonify({"status": "error", "message": f"At most {MAX_LOOKUP_KEYS} cards can be looked up at once."}), 400
+
+    try:
+        found, missing = shared_card_lookup().lookup(keys)
+        return jsonify({
+            "cards": [dict(asdict(card), query=key, series=series) for key, series, card in found],
+            "missing": missing,
+        })
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"An unexpected error occurred: {str(e)}"}), 500
+
+
+def shared_reprint_index() -> SharedReprintIndex:
+    global reprint_index
+    with indexes_lock:
+        if reprint_index is None:
+            reprint_index = SharedReprintIndex(shared_catalog())
+    return reprint_index
+
+
+@app.route('/cards/unique')
+def unique_cards():
+    """
+    Lists every card of the local catalog once, with the packs and card IDs it is printed as.
+    - /cards/unique?format=json -> One record per card code, with its `printings`.
+    - /cards/unique?format=ndjson -> Streams one unique card per line.
     """
     format_type = request.args.get('format', 'json')
 
-    args = Namespace(
-        command='cards',
-        series_id=series_id,
-        format=format_type,
-        verbose=True,
-        debug=False
-    )
+    try:
+        chunks = shared_reprint_index().get().stream(format_type)
+        if wants_stream(format_type):
+            return send_stream(chunks, format_type)
+        return Response("".join(chunks), mimetype=MIMETYPES[format_type])
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"An unexpected error occurred: {str(e)}"}), 500
+
+
+@app.route('/printings/<card>')
+def get_printings(card):
+    """
+    Answers "where is this card printed" from the local catalog.
+    - /printings/OP01-006 or /printings/OP01-006_p1 -> The card and every pack and card ID
+      it is printed as.
+    """
+    try:
+        match = shared_reprint_index().get().printings_of(card)
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"An unexpected error occurred: {str(e)}"}), 500
+    if match is None:
+        return jsonify({"status": "error", "message": f"Card '{card}' is not in the catalog."}), 404
+    unique, printings = match
+    return jsonify(dict(asdict(unique), printings=[printing.to_dict() for printing in printings]))
+
+
+@app.route('/cards')
+def query_cards():
+    """
+    Answers card queries from the local catalog, without contacting the card site.
+    - /cards?color=Red&cost_lte=3&category=CHARACTER&format=json
+    - /cards?format=ndjson -> Streams the whole catalog, one card per line.
+    """
+    format_type = request.args.get('format', 'json')
+
+    try:
+        args = Namespace(
+            command='query',
+            format=format_type,
+            stream=wants_stream(format_type),
+            verbose=True,
+            debug=False,
+            **CardCatalog.parse_filters({k: v for k, v in request.args.items() if k not in ('format', 'stream')})
+        )
+
+        result = scrape(args)
+        if args.stream:
+            return send_stream(result, format_type)
+        body, mimetype = serialize(result, format_type)
+        return Response(body, mimetype=mimetype)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"An unexpected error occurred: {str(e)}"}), 500
+
+
+def shared_search_index() -> SharedSearchIndex:
+    global search_index
+    with indexes_lock:
+        if search_index is None:
+            search_index = SharedSearchIndex(shared_catalog())
+    return search_index
+
+
+@app.route('/search')
+def search_cards():
+    """
+    Searches the effects, triggers, keywords and types of the cards in the local catalog,
+    best matches first. Catalog filters narrow the results.
+    - /search?q=[Blocker] "Straw Hat Crew"&color=Red&cost_lte=3 -> JSON with a score per card.
+    - /search?q=rush OR blocker&limit=20&format=csv
+    """
+    format_type = request.args.get('format', 'json')
+    query = request.args.get('q', '')
 
     try:
-        result = run_scraper(args)
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+        filters = CardCatalog.parse_filters(
+            {k: v for k, v in request.args.items() if k not in ('q', 'limit', 'format')})
+        if format_type not in ('json', 'csv', 'text', 'ndjson'):
+            raise ValueError(f"Invalid format type specified: '{format_type}'.")
+
+        started = time.perf_counter()
+        results = shared_search_index().get().search(query, limit=limit, **filters)
+        elapsed_ms = (time.perf_counter() - started) * 1000
         if format_type == 'json':
-            return jsonify(result)
-        return Response(result, mimetype='text/plain')
+            return jsonify({
+                "query": query,
+                "count": len(results),
+                "took_ms": round(elapsed_ms, 3),
+                "results": [dict(asdict(card), series=series, score=score) for series, card, score in results],
+            })
+        return Response(CardFormatter.format([card for _, card, _ in results], format_type), mimetype='text/plain')
     except ValueError as e:
         return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": f"An unexpected error occurred: {str(e)}"}), 500
 
 
+@app.route('/changes')
+def get_changes():
+    """
+    Feed of the pack and card changes recorded whenever scraped results differ from the catalog.
+    - /changes?since=0 -> The oldest changes, with the cursor to poll with next.
+    - /changes?since=1234&limit=100 -> Only changes recorded after cursor 1234.
+    `has_more` is true when more changes are waiting beyond `limit`.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+        limit = int(request.args.get('limit', ChangeLog.DEFAULT_LIMIT))
+        if since < 0 or limit < 1:
+            raise ValueError("'since' must not be negative and 'limit' must be positive.")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    try:
+        # Ask for one more than the limit to learn whether the consumer must poll again right away
+        changes = shared_catalog().changes.since(since, limit + 1)
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"An unexpected error occurred: {str(e)}"}), 500
+    page = changes[:limit]
+    return jsonify({
+        "changes": [change.to_dict() for change in page],
+        "cursor": page[-1].cursor if page else since,
+        "has_more": len(changes) > limit,
+    })
+
+
+ARCHIVE_MIMETYPES = {
+    'tar.gz': 'application/gzip',
+    'zip': 'application/zip',
+    'ndjson.gz': 'application/gzip',
+}
+
+
+@app.route('/export')
+def export_catalog():
+    """
+    Streams the whole local catalog as a single archive download, one pack at a time.
+    - /export?archive=tar.gz&format=json -> One JSON file per pack plus manifest.json.
+    - /export?archive=zip&format=csv
+    - /export?archive=ndjson.gz -> One card per line, ending with a manifest line.
+    """
+    archive_format = request.args.get('archive', 'tar.gz')
+    format_type = request.args.get('format', 'json')
+
+    try:
+        # Validate before the response starts, errors cannot be reported mid-stream
+        ArchiveWriter.validate(archive_format, format_type)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    response = Response(stream_with_context(iter_archive(shared_catalog().iter_pack_cards(), archive_format, format_type)),
+                        mimetype=ARCHIVE_MIMETYPES[archive_format])
+    response.headers['Content-Disposition'] = f'attachment; filename="optcg_catalog.{archive_format}"'
+    return response
+
+
+@app.route('/metrics')
+def get_metrics():
+    """
+    Per-stage timings and counters of this process in the Prometheus text format.
+    """
+    return Response(REGISTRY.render(), content_type=Registry.CONTENT_TYPE)
+
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,294 @@
+from typing import Iterable, Iterator, List, Tuple
+import tempfile
+import tarfile
+import zipfile
+import hashlib
+import logging
+import json
+import gzip
+import time
+import io
+import os
+import unittest
+
+from .card import Card, CardFormatter
+from .pack import Pack
+
+
+class ChunkBuffer:
+    """
+    Write-only file object that collects what is written until it is drained. It has no
+    `tell` or `seek`, so tarfile and zipfile write to it in their streaming modes.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ArchiveWriter:
+    """
+    Writes the cards of many packs into one archive as the packs arrive, followed by a
+    manifest with every pack's card count, file name, size and sha256.
+
+    - tar.gz and zip hold one `<pack code>.<format>` file per pack and a `manifest.json`.
+    - ndjson.gz is a single gzip NDJSON stream of cards; its last line is
+      `{"manifest": {...}}`, and each pack's checksum covers that pack's lines.
+    """
+
+    FORMATS = ('tar.gz', 'zip', 'ndjson.gz')
+    MEMBER_FORMATS = ('json', 'csv', 'text', 'ndjson')
+    MANIFEST_NAME = 'manifest.json'
+
+    def __init__(self, fileobj, archive_format, member_format='json'):
+        self.archive_format = archive_format
+        self.member_format = self.validate(archive_format, member_format)
+        self.created = time.time()
+        self.packs = []
+        if archive_format == 'tar.gz':
+            self._archive = tarfile.open(fileobj=fileobj, mode='w|gz')
+        elif archive_format == 'zip':
+            self._archive = zipfile.ZipFile(fileobj, mode='w', compression=zipfile.ZIP_DEFLATED)
+        else:
+            self._archive = gzip.GzipFile(fileobj=fileobj, mode='wb', mtime=0)
+
+    @classmethod
+    def validate(cls, archive_format, member_format) -> str:
+        """
+        Check the archive and per-pack formats; returns the per-pack format that is used.
+        """
+        if archive_format not in cls.FORMATS:
+            raise ValueError(f"Invalid archive format '{archive_format}'. Available formats: {list(cls.FORMATS)}")
+        if archive_format == 'ndjson.gz':
+            return 'ndjson'
+        if member_format not in cls.MEMBER_FORMATS:
+            raise ValueError(f"Invalid format '{member_format}' for an archive. "
+                             f"Available formats: {list(cls.MEMBER_FORMATS)}")
+        return member_format
+
+    @staticmethod
+    def format_of(path) -> str:
+        """
+        The archive format named by the extension of `path`, e.g. 'catalog.tar.gz'.
+        """
+        for archive_format in ArchiveWriter.FORMATS:
+            if path.endswith('.' + archive_format):
+                return archive_format
+        raise ValueError(f"Cannot tell the archive format of '{path}'. "
+                         f"Use one of the extensions {['.' + f for f in ArchiveWriter.FORMATS]}.")
+
+    def add_pack(self, pack: Pack, cards: Iterable[Card]) -> int:
+        """
+        Add the cards of one pack. Returns the number of uncompressed bytes added.
+        """
+        cards = list(cards)
+        data = "".join(CardFormatter.stream(cards, self.member_format)).encode('utf-8')
+        name = f"{pack.code}.{self.member_format}"
+        if self.archive_format == 'tar.gz':
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(self.created)
+            self._archive.addfile(info, io.BytesIO(data))
+        elif self.archive_format == 'zip':
+            self._archive.writestr(zipfile.ZipInfo(name, time.localtime(self.created)[:6]), data,
+                                   compress_type=zipfile.ZIP_DEFLATED)
+        else:
+            self._archive.write(data)
+        self.packs.append({
+            'series': pack.series,
+            'code': pack.code,
+            'name': pack.name,
+            'file': None if self.archive_format == 'ndjson.gz' else name,
+            'cards': len(cards),
+            'bytes': len(data),
+            'sha256': hashlib.sha256(data).hexdigest(),
+        })
+        return len(data)
+
+    def manifest(self) -> dict:
+        return {
+            'created': self.created,
+            'archive_format': self.archive_format,
+            'format': self.member_format,
+            'total_cards': sum(p['cards'] for p in self.packs),
+            'packs': self.packs,
+        }
+
+    def close(self):
+        manifest = self.manifest()
+        if self.archive_format == 'ndjson.gz':
+            self._archive.write((json.dumps({'manifest': manifest}) + "\n").encode('utf-8'))
+        else:
+            data = json.dumps(manifest, indent=2).encode('utf-8')
+            if self.archive_format == 'tar.gz':
+                info = tarfile.TarInfo(self.MANIFEST_NAME)
+                info.size = len(data)
+                info.mtime = int(self.created)
+                self._archive.addfile(info, io.BytesIO(data))
+            else:
+                self._archive.writestr(self.MANIFEST_NAME, data)
+        self._archive.close()
+        return manifest
+
+    def abort(self):
+        """
+        Close the archive without a manifest, after a failure.
+        """
+        try:
+            self._archive.close()
+        except (OSError, ValueError, tarfile.TarError) as e:
+            logging.debug(f"Error closing aborted archive: {e}")
+
+
+def iter_archive(pack_cards: Iterable[Tuple[Pack, List[Card]]], archive_format, member_format='json') -> Iterator[bytes]:
+    """
+    Yield the bytes of an archive of `(pack, cards)` pairs, one chunk per pack as it is added.
+    """
+    buffer = ChunkBuffer()
+    writer = ArchiveWriter(buffer, archive_format, member_format)
+    for pack, cards in pack_cards:
+        writer.add_pack(pack, cards)
+        chunk = buffer.drain()
+        if chunk:
+            yield chunk
+    writer.close()
+    yield buffer.drain()
+
+
+class AtomicFile:
+    """
+    Binary file written as `<path>.part` and renamed to `path` by `commit`, so readers only
+    ever see a previous complete file or the new complete one. `discard` removes the
+    partial file instead.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.part_path = path + ".part"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.part_path, 'wb')
+
+    def commit(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.part_path, self.path)
+        logging.info(f"Wrote {self.path}")
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.part_path)
+        except OSError:
+            pass
+
+
+class ArchiveFile:
+    """
+    An archive written to `path` atomically, in the format named by its extension.
+    Packs are compressed into it as they are added; `commit` finishes it and moves it
+    into place, `discard` drops it and leaves any previous archive untouched. Used as a
+    context manager, it is discarded when the block raises.
+    """
+
+    def __init__(self, path, member_format='json'):
+        archive_format = ArchiveWriter.format_of(path)
+        self.target = AtomicFile(path)
+        try:
+            self.writer = ArchiveWriter(self.target.file, archive_format, member_format)
+        except BaseException:
+            self.target.discard()
+            raise
+
+    def add_pack(self, pack: Pack, cards: Iterable[Card]) -> int:
+        return self.writer.add_pack(pack, cards)
+
+    def commit(self) -> dict:
+        manifest = self.writer.close()
+        self.target.commit()
+        return manifest
+
+    def discard(self):
+        self.writer.abort()
+        self.target.discard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.discard()
+
+
+def export_archive(path, pack_cards: Iterable[Tuple[Pack, List[Card]]], member_format='json') -> dict:
+    """
+    Atomically write an archive of `(pack, cards)` pairs to `path`. Returns the manifest.
+    """
+    with ArchiveFile(path, member_format) as archive:
+        for pack, cards in pack_cards:
+            archive.add_pack(pack, cards)
+        return archive.commit()
+
+
+class TestArchive(unittest.TestCase):
+    PACKS = [
+        (Pack('556101', 'BOOSTER PACK', 'ROMANCE DAWN', 'OP01'),
+         [Card('OP01-001', 'OP01-001', 'L', 'LEADER', 'Roronoa Zoro', None, None, None, 'Red', None)]),
+        (Pack('556102', 'BOOSTER PACK', 'Paramount War', 'OP02'),
+         [Card('OP02-001', 'OP02-001', 'L', 'LEADER', 'Edward.Newgate', None, None, None, 'Red', None),
+          Card('OP02-002', 'OP02-002', 'R', 'CHARACTER', 'Monkey.D.Garp', None, None, None, 'Red', None)]),
+    ]
+
+    def test_tar_and_zip_members_match_manifest(self):
+        for archive_format in ('tar.gz', 'zip'):
+            data = b"".join(iter_archive(self.PACKS, archive_format, 'csv'))
+            if archive_format == 'tar.gz':
+                with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as tar:
+                    files = {m.name: tar.extractfile(m).read() for m in tar.getmembers()}
+            else:
+                with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                    files = {name: archive.read(name) for name in archive.namelist()}
+            manifest = json.loads(files.pop(ArchiveWriter.MANIFEST_NAME))
+            self.assertEqual([p['cards'] for p in manifest['packs']], [1, 2])
+            for entry in manifest['packs']:
+                self.assertEqual(hashlib.sha256(files[entry['file']]).hexdigest(), entry['sha256'])
+            self.assertEqual(files['OP02.csv'].decode('utf-8'), CardFormatter.to_csv(self.PACKS[1][1]))
+
+    def test_ndjson_gz_ends_with_manifest(self):
+        lines = gzip.decompress(b"".join(iter_archive(self.PACKS, 'ndjson.gz'))).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(json.loads(lines[-1])['manifest']['total_cards'], 3)
+
+    def test_export_is_atomic(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.zip')
+
+            def failing():
+                yield self.PACKS[0]
+                raise IOError("upstream went away")
+            with self.assertRaises(IOError):
+                export_archive(path, failing())
+            self.assertEqual(os.listdir(directory), [])
+
+            manifest = export_archive(path, self.PACKS)
+            self.assertEqual(manifest['total_cards'], 3)
+            self.assertEqual(os.listdir(directory), ['catalog.zip'])
+            with self.assertRaises(ValueError):
+                ArchiveWriter.format_of('catalog.rar')
+
+
+if __name__ == "__main__":
+    unittest.main()
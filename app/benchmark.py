@@ -0,0 +1,343 @@
+from lxml import html
+from urllib.parse import urljoin
+import argparse
+import copy
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+from .card import Card, CardFormatter
+from .pack import PackFormatter
+from .scraper import OptcgScraper
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+CARDLIST_FIXTURE = os.path.join(FIXTURES_DIR, 'cardlist.html')
+PACKLIST_FIXTURE = os.path.join(FIXTURES_DIR, 'packlist.html')
+DEFAULT_BASELINE = os.path.join(FIXTURES_DIR, 'benchmark_baseline.json')
+
+# Nominal size of a real booster pack page; the suite parses pages of 1x, 10x and 100x this.
+PACK_SIZE = 120
+SCALES = {'1x': 1, '10x': 10, '100x': 100}
+FORMATS = ('text', 'json', 'csv', 'ndjson')
+CARDS_XPATH = '//*[@id="cardlist"]/main/article/div/div[@class="resultCol"]//dl[@class="modalCol"]'
+
+
+def legacy_from_xpathtree(tree):
+    """
+    The original per-field string XPath extraction, kept as the reference the precompiled
+    `CardExtractor` is measured and checked against.
+    """
+    card_info = tree.xpath('.//div[@class="infoCol"]/span/text()')
+    base_url = tree.xpath('//meta[@property="og:image"]/@content')[0].strip()
+
+    attributes_list = []
+    raw_attributes_string = Card.get_xpath_value(tree, './/div[@class="attribute"]/i/text()')
+    if raw_attributes_string:
+        for attr_str in raw_attributes_string.split('/'):
+            clean_attr_str = attr_str.strip()
+            try:
+                attributes_list.append(Card.Attribute(clean_attr_str))
+            except ValueError:
+                logging.error(f"Warning: Unknown attribute found: '{clean_attr_str}'")
+                attributes_list.append(clean_attr_str)
+
+    power_val = Card.get_text_after_anchor(tree, './/div[@class="power"]/h3')
+    counter_val = Card.get_text_after_anchor(tree, './/div[@class="counter"]/h3')
+    img_url = Card.get_xpath_value(tree, './/img[@class="lazy"]/@data-src')
+    if img_url and '?' in img_url:
+        img_url = img_url.split('?')[0]
+
+    try:
+        effect_element = Card.get_xpath_value(tree, './/div[@class="text"]', get_text=False)
+        trigger_element = Card.get_xpath_value(tree, './/div[@class="trigger"]', get_text=False)
+        data = {
+            'card_id': tree.get('id'),
+            'card_code': card_info[0].strip() if len(card_info) > 0 else None,
+            'rarity': Card.Rarity(card_info[1].strip()) if len(card_info) > 0 else None,
+            'category': Card.Category(card_info[2].strip()) if len(card_info) > 0 else None,
+            'name': Card.get_xpath_value(tree, './/div[@class="cardName"]/text()'),
+            'img_url': urljoin(base_url, img_url),
+            'cost': Card.get_text_after_anchor(tree, './/div[@class="cost"]/h3'),
+            'attributes': attributes_list or None,
+            'power': None if power_val == '-' else power_val,
+            'counter': None if counter_val == '-' else counter_val,
+            'color': Card.get_text_after_anchor(tree, './/div[@class="color"]/h3'),
+            'block': Card.get_text_after_anchor(tree, './/div[@class="block"]/h3'),
+            'types': Card.get_text_after_anchor(tree, './/div[@class="feature"]/h3', delimiter='\n'),
+            'effect': Card.get_inner_html_without_h3(effect_element),
+            'trigger': Card.get_inner_html_without_h3(trigger_element),
+        }
+    except (IndexError, ValueError, KeyError):
+        raise ValueError("Card ID not found in the provided tree.")
+    return Card(**data)
+
+
+def page_with_cards(content, count):
+    """
+    Return a copy of a cardlist page holding exactly `count` cards, cloned from the cards
+    already on the page with unique IDs.
+    """
+    tree = html.fromstring(content)
+    elements = tree.xpath(CARDS_XPATH)
+    for index in range(count - len(elements)):
+        element = elements[index % len(elements)]
+        clone = copy.deepcopy(element)
+        clone.set('id', f"{element.get('id')}_x{index // len(elements) + 1}")
+        element.getparent().append(clone)
+    for element in elements[count:]:
+        element.getparent().remove(element)
+    return html.tostring(tree)
+
+
+def scaled_page(content, scale):
+    """
+    Return a copy of a cardlist page whose card list is repeated `scale` times,
+    with card IDs made unique.
+    """
+    return page_with_cards(content, scale * len(html.fromstring(content).xpath(CARDS_XPATH)))
+
+
+def parse_legacy(content):
+    tree = html.fromstring(content)
+    return [legacy_from_xpathtree(element) for element in tree.xpath(CARDS_XPATH)]
+
+
+def parse_current(content):
+    tree = html.fromstring(content)
+    elements = tree.xpath(CARDS_XPATH)
+    base_url = Card.page_base_url(tree) if elements else None
+    return [Card.from_xpathtree(element, base_url=base_url) for element in elements]
+
+
+def measure(parse, content, repeat):
+    best = None
+    cards = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cards = parse(content)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return cards, best
+
+
+def bench_parse(args):
+    with open(args.page, 'rb') as f:
+        content = scaled_page(f.read(), args.scale)
+
+    legacy_cards, legacy_time = measure(parse_legacy, content, args.repeat)
+    current_cards, current_time = measure(parse_current, content, args.repeat)
+    if legacy_cards != current_cards:
+        raise SystemExit("Precompiled extraction produced different cards than the legacy path.")
+
+    count = len(current_cards)
+    print(f"Parsed {count} cards (best of {args.repeat})")
+    print(f"  legacy:      {count / legacy_time:12.0f} cards/s")
+    print(f"  precompiled: {count / current_time:12.0f} cards/s  ({legacy_time / current_time:.2f}x)")
+
+
+class FixtureResponse:
+
+    status_code = 200
+    from_cache = False
+
+    def __init__(self, content):
+        self.content = content
+        self.headers = {}
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FixtureSession:
+    """
+    Replays recorded pages in place of the HTTP session, so `OptcgScraper.fetch_packs`
+    and `fetch_cards` can be measured end to end without leaving the machine.
+    """
+
+    def __init__(self, packlist, cardlist):
+        self.packlist = packlist
+        self.cardlist = cardlist
+
+    def get(self, url, params=None, **kwargs):
+        return FixtureResponse(self.cardlist if params and params.get('series') else self.packlist)
+
+
+def timed(func, repeat):
+    """
+    Return `(result, best seconds)` over `repeat` runs.
+    """
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def peak_memory_mb(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+def run_suite(args):
+    """
+    Measure parse and formatter throughput and peak memory on the recorded fixtures.
+    Returns `{metric: {'value', 'unit', 'higher_is_better'}}`.
+    """
+    with open(args.packlist, 'rb') as f:
+        packlist = f.read()
+    with open(args.page, 'rb') as f:
+        cardlist = f.read()
+
+    metrics = {}
+
+    def record(name, value, unit, higher_is_better):
+        metrics[name] = {'value': round(value, 3), 'unit': unit, 'higher_is_better': higher_is_better}
+
+    session = FixtureSession(packlist, cardlist)
+    scraper = OptcgScraper(session=session)
+
+    packs, elapsed = timed(scraper.fetch_packs, args.repeat)
+    record('fetch_packs.packs_per_s', len(packs) / elapsed, 'packs/s', True)
+
+    cards = []
+    for label, scale in SCALES.items():
+        session.cardlist = page_with_cards(cardlist, scale * PACK_SIZE)
+        repeat = max(1, args.repeat // scale)
+        cards, elapsed = timed(lambda: scraper.fetch_cards('556101'), repeat)
+        record(f'fetch_cards.{label}.cards_per_s', len(cards) / elapsed, 'cards/s', True)
+        record(f'fetch_cards.{label}.peak_mb', peak_memory_mb(lambda: scraper.fetch_cards('556101')), 'MB', False)
+        cards, elapsed = timed(lambda: list(scraper.iter_cards('556101')), repeat)
+        record(f'iter_cards.{label}.cards_per_s', len(cards) / elapsed, 'cards/s', True)
+        record(f'iter_cards.{label}.peak_mb',
+               peak_memory_mb(lambda: sum(1 for _ in scraper.iter_cards('556101'))), 'MB', False)
+
+    # Formatters run on the 10x page, and on the pack list repeated to a comparable size
+    session.cardlist = page_with_cards(cardlist, SCALES['10x'] * PACK_SIZE)
+    cards = list(scraper.fetch_cards('556101'))
+    many_packs = list(packs) * max(1, len(cards) // max(1, len(packs)))
+    for format_type in FORMATS:
+        _, elapsed = timed(lambda: CardFormatter.format(cards, format_type), args.repeat)
+        record(f'card_formatter.{format_type}.cards_per_s', len(cards) / elapsed, 'cards/s', True)
+        record(f'card_formatter.{format_type}.peak_mb',
+               peak_memory_mb(lambda: CardFormatter.format(cards, format_type)), 'MB', False)
+        _, elapsed = timed(lambda: PackFormatter.format(many_packs, format_type), args.repeat)
+        record(f'pack_formatter.{format_type}.packs_per_s', len(many_packs) / elapsed, 'packs/s', True)
+    return metrics
+
+
+def find_regressions(metrics, baseline, threshold):
+    """
+    Compare metrics against a saved baseline. A throughput metric regresses when it drops
+    by more than `threshold` (a fraction); a memory metric when it grows by more than that.
+    """
+    regressions = []
+    for name, metric in metrics.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['value'], metric['value']
+        if metric['higher_is_better']:
+            regressed = after < before * (1 - threshold)
+        else:
+            regressed = after > before * (1 + threshold)
+        if regressed:
+            regressions.append(f"{name}: {before} -> {after} {metric['unit']}")
+    return regressions
+
+
+def bench_run(args):
+    metrics = run_suite(args)
+    width = max(len(name) for name in metrics)
+    for name, metric in metrics.items():
+        print(f"{name:<{width}}  {metric['value']:>14,.1f} {metric['unit']}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(metrics, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        if not os.path.exists(args.baseline):
+            raise SystemExit(f"Baseline {args.baseline} not found; create it with --save-baseline.")
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = find_regressions(metrics, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions beyond {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+
+def bench_record(args):
+    """
+    Record fresh cardlist and pack-list pages from the live site into the fixtures.
+    """
+    scraper = OptcgScraper()
+    packlist = scraper.session.get(scraper.base_url + "/cardlist")
+    packlist.raise_for_status()
+    cardlist = scraper.fetch_cards_page(args.series)
+    cardlist.raise_for_status()
+    with open(args.packlist, 'wb') as f:
+        f.write(packlist.content)
+    with open(args.page, 'wb') as f:
+        f.write(cardlist.content)
+    print(f"Recorded {args.packlist} and {args.page} (series {args.series})")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the OPTCG scraper.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parse_parser = subparsers.add_parser('parse', help='Compare card extraction throughput.')
+    parse_parser.add_argument('--page', default=CARDLIST_FIXTURE, help='Cardlist HTML page to parse.')
+    parse_parser.add_argument('--scale', type=int, default=50, help='Repeat the page card list this many times.')
+    parse_parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs; the best is reported.')
+
+    run_parser = subparsers.add_parser('run', help='Run the parse and formatter benchmark suite.')
+    run_parser.add_argument('--page', default=CARDLIST_FIXTURE, help='Recorded cardlist HTML page.')
+    run_parser.add_argument('--packlist', default=PACKLIST_FIXTURE, help='Recorded pack-list HTML page.')
+    run_parser.add_argument('--repeat', type=int, default=10, help='Number of timed runs; the best is reported.')
+    run_parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE, default=None,
+                            help=f'Save the results as the baseline (default: {DEFAULT_BASELINE}).')
+    run_parser.add_argument('--baseline', nargs='?', const=DEFAULT_BASELINE, default=None,
+                            help='Compare against a saved baseline and exit non-zero on regressions.')
+    run_parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed slowdown or memory growth as a fraction (default: 0.2).')
+
+    record_parser = subparsers.add_parser('record', help='Record fixture pages from the live site.')
+    record_parser.add_argument('--series', default='556101', help='Series of the cardlist page to record.')
+    record_parser.add_argument('--page', default=CARDLIST_FIXTURE, help='Where to write the cardlist page.')
+    record_parser.add_argument('--packlist', default=PACKLIST_FIXTURE, help='Where to write the pack-list page.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.disable(logging.CRITICAL)
+    if args.command == 'parse':
+        bench_parse(args)
+    elif args.command == 'run':
+        bench_run(args)
+    elif args.command == 'record':
+        bench_record(args)
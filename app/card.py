@@ -1,14 +1,15 @@
 from enum import StrEnum, auto
 from dataclasses import dataclass, asdict, fields
-from typing import Optional, List
+from typing import Optional, List, Iterable, Iterator
 from urllib.parse import urljoin
-from lxml import html
-import requests
-import json
+import threading
 import logging
 import os
-import io
-import csv
+import unittest
+
+from .downloader import ImageDownloader
+from . import streaming
+from . import metrics
 
 
 @dataclass
@@ -113,6 +114,8 @@ class Card:
         if h3.tail and h3.tail.strip():
             content_parts.append(h3.tail.strip())
 
+        from lxml import html
+
         for sibling in h3.itersiblings():
             content_parts.append(html.tostring(sibling, encoding='unicode'))
 
@@ -120,13 +123,100 @@ class Card:
         return full_content if full_content else None
 
     @classmethod
-    def from_xpathtree(cls, tree):
+    def from_dict(cls, data):
+        """
+        Rebuild a Card from the output of `asdict`, e.g. after a JSON round trip.
+        """
+        data = dict(data)
+        if data.get('rarity'):
+            data['rarity'] = cls.Rarity(data['rarity'])
+        if data.get('category'):
+            data['category'] = cls.Category(data['category'])
+        if data.get('attributes'):
+            attributes = []
+            for attr in data['attributes']:
+                try:
+                    attributes.append(cls.Attribute(attr))
+                except ValueError:
+                    attributes.append(attr)
+            data['attributes'] = attributes
+        return cls(**data)
+
+    @staticmethod
+    def page_base_url(tree):
+        """
+        Resolve the base URL that card image paths are relative to. This is a document-wide
+        lookup, so resolve it once per page and pass it to `from_xpathtree`.
+        """
+        return CardExtractor.shared().page_base_url(tree)
+
+    @classmethod
+    def from_xpathtree(cls, tree, base_url=None):
+        extractor = CardExtractor.shared()
+        if base_url is None:
+            base_url = extractor.page_base_url(tree)
+        return cls(**extractor.extract(tree, base_url))
+
+
+class CardExtractor:
+    """
+    Precompiled XPath queries for turning a `dl.modalCol` element into Card fields.
+
+    Compiled XPath objects must not be shared between threads, so use `shared()` to get
+    the instance belonging to the current thread.
+    """
+
+    ANCHORED_FIELDS = ('cost', 'power', 'counter', 'color', 'block', 'feature')
+
+    _local = threading.local()
+
+    def __init__(self):
+        # lxml is only loaded once pages are parsed, so offline commands start without it
+        from lxml import etree
+
+        def compile(path):
+            return etree.XPath(path, smart_strings=False)
+
+        self.page_base = compile('//meta[@property="og:image"]/@content')
+        self.card_info = compile('.//div[@class="infoCol"]/span/text()')
+        self.attribute = compile('.//div[@class="attribute"]/i/text()')
+        self.name = compile('.//div[@class="cardName"]/text()')
+        self.img = compile('.//img[@class="lazy"]/@data-src')
+        self.effect = compile('.//div[@class="text"]')
+        self.trigger = compile('.//div[@class="trigger"]')
+        self.after_anchor = {
+            css: compile(f'.//div[@class="{css}"]/h3/following-sibling::*/text()'
+                         f' | .//div[@class="{css}"]/h3/following-sibling::text()')
+            for css in self.ANCHORED_FIELDS
+        }
+
+    @classmethod
+    def shared(cls):
+        extractor = getattr(cls._local, 'extractor', None)
+        if extractor is None:
+            extractor = cls._local.extractor = cls()
+        return extractor
+
+    def page_base_url(self, tree):
+        return self.page_base(tree)[0].strip()
+
+    @staticmethod
+    def first(query, tree, get_text=True):
+        nodes = query(tree)
+        if not nodes:
+            return None
+        return str(nodes[0]).strip() if get_text else nodes[0]
 
-        card_info = tree.xpath('.//div[@class="infoCol"]/span/text()')
-        base_url = tree.xpath('//meta[@property="og:image"]/@content')[0].strip()
+    def text_after(self, css, tree, delimiter=' '):
+        clean_parts = [t.strip() for t in self.after_anchor[css](tree) if t.strip()]
+        full_text = delimiter.join(clean_parts)
+        return full_text if full_text else None
+
+    def extract(self, tree, base_url):
+        card_info = self.card_info(tree)
 
         attributes_list = []
-        raw_attributes_string = Card.get_xpath_value(tree, './/div[@class="attribute"]/i/text()')
+        raw_attributes_string = self.first(self.attribute, tree)
         if raw_attributes_string:
             for attr_str in raw_attributes_string.split('/'):
                 clean_attr_str = attr_str.strip()
@@ -136,73 +226,154 @@ class Card:
                     logging.error(f"Warning: Unknown attribute found: '{clean_attr_str}'")
                     attributes_list.append(clean_attr_str)
 
-        power_val = Card.get_text_after_anchor(tree, './/div[@class="power"]/h3')
-        counter_val = Card.get_text_after_anchor(tree, './/div[@class="counter"]/h3')
-        img_url = Card.get_xpath_value(tree, './/img[@class="lazy"]/@data-src')
+        power_val = self.text_after('power', tree)
+        counter_val = self.text_after('counter', tree)
+        img_url = self.first(self.img, tree)
         if img_url and '?' in img_url:
             img_url = img_url.split('?')[0]
 
         try:
-            effect_element = Card.get_xpath_value(tree, './/div[@class="text"]', get_text=False)
-            effect_html = Card.get_inner_html_without_h3(effect_element)
-
-            trigger_element = Card.get_xpath_value(tree, './/div[@class="trigger"]', get_text=False)
-            trigger_html = Card.get_inner_html_without_h3(trigger_element)
+            effect_html = Card.get_inner_html_without_h3(self.first(self.effect, tree, get_text=False))
+            trigger_html = Card.get_inner_html_without_h3(self.first(self.trigger, tree, get_text=False))
 
             data = {
                 'card_id': tree.get('id'),
                 'card_code': card_info[0].strip() if len(card_info) > 0 else None,
                 'rarity': Card.Rarity(card_info[1].strip()) if len(card_info) > 0 else None,
                 'category': Card.Category(card_info[2].strip()) if len(card_info) > 0 else None,
-                'name': Card.get_xpath_value(tree, './/div[@class="cardName"]/text()'),
+                'name': self.first(self.name, tree),
                 'img_url': urljoin(base_url, img_url),
-                'cost': Card.get_text_after_anchor(tree, './/div[@class="cost"]/h3'),
+                'cost': self.text_after('cost', tree),
                 'attributes': attributes_list or None,
                 'power': None if power_val == '-' else power_val,
                 'counter': None if counter_val == '-' else counter_val,
-                'color': Card.get_text_after_anchor(tree, './/div[@class="color"]/h3'),
-                'block': Card.get_text_after_anchor(tree, './/div[@class="block"]/h3'),
-                'types': Card.get_text_after_anchor(tree, './/div[@class="feature"]/h3', delimiter='\n'),
+                'color': self.text_after('color', tree),
+                'block': self.text_after('block', tree),
+                'types': self.text_after('feature', tree, delimiter='\n'),
                 'effect': effect_html,
                 'trigger': trigger_html,
             }
             logging.info(f"Adding card: {data['card_code']}, {data['rarity']}, {data['category']}, {data['name']}")
         except (IndexError, ValueError, KeyError):
             raise ValueError("Card ID not found in the provided tree.")
-        return cls(**data)
+        return data
+
+
+class CardStreamParser:
+    """
+    Incremental parser for cardlist pages. Feed it the page in chunks as they are
+    downloaded; every `dl.modalCol` element inside the result list is turned into a Card
+    as soon as it closes, then dropped together with everything before it, so the parsed
+    tree never holds more than the card being read.
+    """
+
+    def __init__(self):
+        from lxml import etree
+
+        self.parser = etree.HTMLPullParser(events=('end',), tag=('meta', 'dl'))
+        self.base_url = None
+
+    @staticmethod
+    def in_result_list(element) -> bool:
+        return any(div.get('class') == 'resultCol' for div in element.iterancestors('div'))
+
+    def read_cards(self) -> List[Card]:
+        cards = []
+        for _, element in self.parser.read_events():
+            if element.tag == 'meta':
+                if self.base_url is None and element.get('property') == 'og:image':
+                    self.base_url = (element.get('content') or '').strip()
+                continue
+            if element.get('class') != 'modalCol' or not self.in_result_list(element):
+                continue
+            try:
+                cards.append(Card.from_xpathtree(element, base_url=self.base_url or ''))
+            except ValueError as e:
+                metrics.CARD_PARSE_FAILURES.inc()
+                logging.debug(f"Error processing card title '{element.get('id')}': {e}")
+            element.clear(keep_tail=True)
+            parent = element.getparent()
+            while element.getprevious() is not None:
+                del parent[0]
+        return cards
+
+    def feed(self, chunk: bytes) -> List[Card]:
+        """
+        Parse the next chunk of the page and return the cards completed by it.
+        """
+        self.parser.feed(chunk)
+        return self.read_cards()
+
+    def close(self) -> List[Card]:
+        """
+        Finish the page and return the cards that were still open.
+        """
+        self.parser.close()
+        return self.read_cards()
 
 
 class CardFormatter:
 
+    IMAGE_DIRECTORY = os.environ.get('OPTCG_IMAGE_DIR', "/tmp/downloaded_images")
+    FIELDS = [field.name for field in fields(Card)]
+    # Formats of `stream`, so of every file written per pack
+    STREAM_FORMATS = ('json', 'csv', 'text', 'ndjson')
+
+    @staticmethod
     def download_image(url, save_path):
-        if os.path.exists(save_path):
-            logging.info(f"File already exists at {save_path}. Skipping download...")
-            return True
+        import requests
+
+        downloader = ImageDownloader(max_workers=1)
         try:
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-            with open(save_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            downloader.download(url, save_path)
             return True
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, IOError) as e:
             logging.error(f"Error downloading the image: {e}")
+        finally:
+            downloader.close()
         return False
 
     @staticmethod
-    def to_text(cards: List[Card]) -> str:
+    def records(cards: Iterable[Card], fields: Optional[List[str]] = None) -> Iterator[dict]:
+        """
+        The dicts serialized for `cards`; with `fields`, only those fields are read and kept.
+        """
+        if fields is None:
+            return (asdict(card) for card in cards)
+        return ({name: getattr(card, name) for name in fields} for card in cards)
+
+    @staticmethod
+    def iter_text(cards: Iterable[Card], fields: Optional[List[str]] = None) -> Iterator[str]:
         logging.info("Formatting card data to text...")
-        lines = [
+        if fields is not None:
+            return streaming.iter_joined(
+                "  " + ", ".join(str(getattr(card, name)) for name in fields) for card in cards)
+        return streaming.iter_joined(
             f"  {card.card_code}, {card.rarity}, {card.name}, {card.category}, {card.card_id} "
             for card in cards
-        ]
-        return "\n".join(lines)
+        )
+
+    @staticmethod
+    def to_text(cards: List[Card], **options) -> str:
+        return "".join(CardFormatter.iter_text(cards, **options))
 
     @staticmethod
-    def to_json(cards: List[Card]) -> str:
+    def iter_json(cards: Iterable[Card], fields: Optional[List[str]] = None, indent: Optional[int] = 2) -> Iterator[str]:
         logging.info("Formatting card data to JSON...")
-        data = [asdict(card) for card in cards]
-        return json.dumps(data, indent=2)
+        return streaming.iter_json_array(CardFormatter.records(cards, fields), indent=indent)
+
+    @staticmethod
+    def to_json(cards: List[Card], **options) -> str:
+        return "".join(CardFormatter.iter_json(cards, **options))
+
+    @staticmethod
+    def iter_ndjson(cards: Iterable[Card], fields: Optional[List[str]] = None) -> Iterator[str]:
+        logging.info("Formatting card data to NDJSON...")
+        return streaming.iter_ndjson(CardFormatter.records(cards, fields))
+
+    @staticmethod
+    def to_ndjson(cards: List[Card], **options) -> str:
+        return "".join(CardFormatter.iter_ndjson(cards, **options))
 
     @staticmethod
     def field_to_csv(val):
@@ -213,55 +384,133 @@ class CardFormatter:
         return "" if val is None else str(val)
 
     @staticmethod
-    def to_csv(cards: List[Card]) -> str:
-
+    def iter_csv(cards: Iterable[Card], fields: Optional[List[str]] = None) -> Iterator[str]:
         logging.info("Formatting card data to CSV...")
-        if not cards:
-            return ""
+        header_row = fields if fields is not None else CardFormatter.FIELDS
+        return streaming.iter_csv(header_row, (
+            [CardFormatter.field_to_csv(getattr(card, header)) for header in header_row]
+            for card in cards
+        ))
 
-        header_row = [field.name for field in fields(Card)]
-        output = io.StringIO()
-        writer = csv.writer(output, quoting=csv.QUOTE_ALL)
-        writer.writerow(header_row)
-        for card in cards:
-            row_values = [CardFormatter.field_to_csv(getattr(card, header)) for header in header_row]
-            writer.writerow(row_values)
-        return output.getvalue().strip()
+    @staticmethod
+    def to_csv(cards: List[Card], **options) -> str:
+        return "".join(CardFormatter.iter_csv(cards, **options))
 
     @staticmethod
-    def to_img(cards: List[Card]) -> str:
+    def to_img(cards: List[Card], max_workers: int = ImageDownloader.DEFAULT_WORKERS, pipeline=None) -> str:
+        """
+        Download card images to `IMAGE_DIRECTORY/<card_id>.jpg`. A `pipeline`
+        (see `images.ImagePipeline`) then makes thumbnails and other variants of them.
+        """
         logging.info("Downloading card images...")
         if not cards:
             return "No cards to download images for."
 
-        save_directory = "/tmp/downloaded_images"
+        save_directory = CardFormatter.IMAGE_DIRECTORY
         os.makedirs(save_directory, exist_ok=True)
+        jobs = []
+        images = []
         for card in cards:
             if not card.img_url:
                 logging.warning(f"Card {card.card_id} has no image URL.")
                 continue
-            try:
-                img_filename = f"{card.card_id}.jpg"
-                file_path = os.path.join(save_directory, img_filename)
-                CardFormatter.download_image(card.img_url, file_path)
-                print(f" {card.card_id} dowloaded successfully to {img_filename}")
-            except Exception as e:
-                logging.error(f"Failed to download image for card {card.card_id}: {e}")
-        return "DONE downloading."
+            img_filename = f"{card.card_id}.jpg"
+            jobs.append((card.img_url, os.path.join(save_directory, img_filename)))
+            images.append((card.card_id, jobs[-1][1]))
+
+        downloader = ImageDownloader(max_workers=max_workers)
+        try:
+            summary = downloader.download_all(jobs)
+        finally:
+            downloader.close()
+        if pipeline is None:
+            return f"DONE downloading. {summary}"
+        logging.info("Making image variants...")
+        return f"DONE downloading. {summary} {pipeline.process(images)}"
+
+    @staticmethod
+    def options(format_type, fields=None, compact=False) -> dict:
+        """
+        Keyword arguments of the formatter for `format_type`: projected `fields`, and compact
+        JSON without indentation. Images take neither.
+        """
+        options = {}
+        if fields is not None and format_type != 'img':
+            options['fields'] = fields
+        if compact and format_type == 'json':
+            options['indent'] = None
+        return options
 
     @classmethod
-    def format(cls, packs: List[Card], format_type: str) -> str:
+    def format(cls, packs: List[Card], format_type: str, fields=None, compact=False) -> str:
         formatters = {
             'text': cls.to_text,
             'json': cls.to_json,
             'csv': cls.to_csv,
+            'ndjson': cls.to_ndjson,
             'img': cls.to_img,
         }
 
         formatter_func = formatters.get(format_type)
 
         if formatter_func:
-            return formatter_func(packs)
+            with metrics.FORMAT_SECONDS.time(formatter='card', format=format_type):
+                return formatter_func(packs, **cls.options(format_type, fields, compact))
         else:
             raise ValueError(f"Invalid format type specified: '{format_type}'. "
                              f"Available formats: {list(formatters.keys())}")
+
+    @classmethod
+    def stream(cls, cards: Iterable[Card], format_type: str, fields=None, compact=False) -> Iterator[str]:
+        """
+        Format cards incrementally, yielding text chunks. The chunks join to the output of
+        `format`, and `cards` may be any iterable, so memory stays flat for large exports.
+        """
+        formatters = {
+            'text': cls.iter_text,
+            'json': cls.iter_json,
+            'csv': cls.iter_csv,
+            'ndjson': cls.iter_ndjson,
+        }
+
+        formatter_func = formatters.get(format_type)
+
+        if formatter_func:
+            return metrics.timed_iter(formatter_func(cards, **cls.options(format_type, fields, compact)),
+                                      metrics.FORMAT_SECONDS, formatter='card', format=format_type)
+        else:
+            raise ValueError(f"Invalid streaming format type specified: '{format_type}'. "
+                             f"Available formats: {list(formatters.keys())}")
+
+
+class TestCardFormatter(unittest.TestCase):
+    def test_stream_formats(self):
+        card = Card('OP01-006', 'OP01-006', Card.Rarity.UNCOMMON, Card.Category.CHARACTER, 'Otama', None,
+                    [Card.Attribute.SPECIAL], '1', 'Red', None, cost='1', power='0', counter='2000')
+        for format_type in CardFormatter.STREAM_FORMATS:
+            self.assertIn('OP01-006', "".join(CardFormatter.stream([card], format_type)), format_type)
+        with self.assertRaises(ValueError):
+            CardFormatter.stream([card], 'img')
+
+
+class TestCardStreamParser(unittest.TestCase):
+    def test_matches_parse_cards(self):
+        from .benchmark import CARDLIST_FIXTURE, page_with_cards
+        from .scraper import OptcgScraper
+
+        with open(CARDLIST_FIXTURE, 'rb') as f:
+            recorded = f.read()
+        for page in (recorded, page_with_cards(recorded, 40)):
+            expected = list(OptcgScraper.parse_cards(page))
+            self.assertTrue(expected)
+            for chunk_size in (1, 7, 64 * 1024):
+                parser = CardStreamParser()
+                cards = []
+                for start in range(0, len(page), chunk_size):
+                    cards.extend(parser.feed(page[start:start + chunk_size]))
+                cards.extend(parser.close())
+                self.assertEqual(cards, expected, f"chunk size {chunk_size}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,383 @@
+from contextlib import contextmanager
+from dataclasses import asdict
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+import tempfile
+import sqlite3
+import logging
+import json
+import os
+import unittest
+
+from .pack import Pack
+from .card import Card
+from .search import card_terms
+from .changes import ChangeLog, diff_records
+
+DEFAULT_CATALOG_PATH = os.environ.get('OPTCG_CATALOG_PATH', "/tmp/optcg_catalog.sqlite3")
+
+
+def to_int(value) -> Optional[int]:
+    """
+    Convert a scraped numeric field ("5000", "-", None) to an int, or None when it has no value.
+    """
+    if value is None:
+        return None
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        return None
+
+
+class CardCatalog:
+    """
+    Local SQLite store of every scraped Pack and Card.
+
+    Each card is kept verbatim as JSON so it can be rebuilt exactly, next to typed,
+    indexed columns used for filtering. Numeric fields are stored as integers so that
+    range filters such as `cost_lte=3` compare numerically. The changes stored scrapes made
+    are read through `changes`, a `changes.ChangeLog` over the same database.
+    """
+
+    MATCH_FILTERS = ('card_id', 'card_code', 'category', 'rarity', 'color', 'pack')
+    RANGE_FIELDS = ('cost', 'power', 'counter')
+    RANGE_OPERATORS = {'': '=', '_lt': '<', '_lte': '<=', '_gt': '>', '_gte': '>='}
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS packs (
+            series TEXT PRIMARY KEY,
+            prefix TEXT,
+            name TEXT,
+            code TEXT
+        );
+        CREATE TABLE IF NOT EXISTS cards (
+            series TEXT NOT NULL,
+            card_id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            card_code TEXT,
+            rarity TEXT,
+            category TEXT,
+            name TEXT,
+            color TEXT,
+            cost INTEGER,
+            power INTEGER,
+            counter INTEGER,
+            data TEXT NOT NULL,
+            PRIMARY KEY (series, card_id)
+        );
+        CREATE TABLE IF NOT EXISTS card_colors (
+            series TEXT NOT NULL,
+            card_id TEXT NOT NULL,
+            color TEXT NOT NULL,
+            PRIMARY KEY (series, card_id, color)
+        );
+        CREATE TABLE IF NOT EXISTS card_terms (
+            series TEXT NOT NULL,
+            card_id TEXT NOT NULL,
+            field TEXT NOT NULL,
+            term TEXT NOT NULL,
+            PRIMARY KEY (series, card_id, field, term)
+        );
+        CREATE TABLE IF NOT EXISTS catalog_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS series_generations (
+            series TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_packs_code ON packs (code);
+        CREATE INDEX IF NOT EXISTS idx_cards_card_id ON cards (card_id);
+        CREATE INDEX IF NOT EXISTS idx_cards_card_code ON cards (card_code);
+        CREATE INDEX IF NOT EXISTS idx_cards_category ON cards (category);
+        CREATE INDEX IF NOT EXISTS idx_cards_rarity ON cards (rarity);
+        CREATE INDEX IF NOT EXISTS idx_cards_cost ON cards (cost);
+        CREATE INDEX IF NOT EXISTS idx_cards_power ON cards (power);
+        CREATE INDEX IF NOT EXISTS idx_cards_counter ON cards (counter);
+        CREATE INDEX IF NOT EXISTS idx_card_colors_color ON card_colors (color);
+    """
+
+    def __init__(self, path=DEFAULT_CATALOG_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.connect() as conn:
+            # WAL is kept in the file: API readers are not locked out while a scrape stores cards
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.SCHEMA)
+        self.changes = ChangeLog(path)
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def split_colors(color) -> List[str]:
+        return [c.strip() for c in (color or '').split('/') if c.strip()]
+
+    @staticmethod
+    def pack_json(series, prefix, name, code) -> str:
+        return json.dumps(asdict(Pack(series, prefix, name, code)))
+
+    def store_packs(self, packs: Iterable[Pack]):
+        """
+        Store the packs and record new or renamed ones in the change log. Packs missing
+        from `packs` are kept, with their cards.
+        """
+        rows = [(pack.series, pack.prefix, pack.name, pack.code) for pack in packs]
+        with self.connect() as conn:
+            stored = {row[0]: self.pack_json(*row) for row in
+                      conn.execute("SELECT series, prefix, name, code FROM packs").fetchall()}
+            changes = []
+            for row in rows:
+                series = row[0]
+                previous = {series: stored[series]} if series in stored else {}
+                changes.extend(diff_records('pack', series, previous, {series: self.pack_json(*row)}))
+            conn.executemany(
+                "INSERT OR REPLACE INTO packs (series, prefix, name, code) VALUES (?, ?, ?, ?)", rows)
+            ChangeLog.record(conn, changes)
+        logging.info(f"Stored {len(rows)} packs in catalog {self.path}")
+
+    def store_cards(self, series, cards):
+        """
+        Replace the stored cards of pack `series` with `cards`. The differences to the cards
+        stored before are recorded in the change log, see `changes.ChangeLog`. Storing the
+        same cards again writes nothing and leaves the generation as it was.
+        """
+        card_rows, color_rows, term_rows = [], [], []
+        for position, card in enumerate(cards):
+            card_rows.append((
+                series, card.card_id, position, card.card_code, card.rarity, card.category, card.name,
+                card.color, to_int(card.cost), to_int(card.power), to_int(card.counter),
+                json.dumps(asdict(card)),
+            ))
+            color_rows.extend((series, card.card_id, color) for color in self.split_colors(card.color))
+            term_rows.extend((series, card.card_id, field, term) for field, term in card_terms(card))
+
+        with self.connect() as conn:
+            stored = dict(conn.execute("SELECT card_id, data FROM cards WHERE series = ? ORDER BY position",
+                                       (series,)).fetchall())
+            changes = diff_records('card', series, stored, {row[1]: row[-1] for row in card_rows}, key_field='card_id')
+            if not changes and list(stored) == [row[1] for row in card_rows]:
+                # Nothing to write, and in-memory views of the catalog stay current
+                logging.info(f"Cards of series {series} in catalog {self.path} are unchanged")
+                return
+            conn.execute("DELETE FROM cards WHERE series = ?", (series,))
+            conn.execute("DELETE FROM card_colors WHERE series = ?", (series,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO cards (series, card_id, position, card_code, rarity, category, name, "
+                "color, cost, power, counter, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", card_rows)
+            conn.executemany(
+                "INSERT OR IGNORE INTO card_colors (series, card_id, color) VALUES (?, ?, ?)", color_rows)
+            conn.execute("DELETE FROM card_terms WHERE series = ?", (series,))
+            conn.executemany(
+                "INSERT OR IGNORE INTO card_terms (series, card_id, field, term) VALUES (?, ?, ?, ?)", term_rows)
+            generation = self._bump_generation(conn)
+            conn.execute("INSERT OR REPLACE INTO series_generations (series, generation) VALUES (?, ?)",
+                         (series, generation))
+            ChangeLog.record(conn, changes)
+        logging.info(f"Stored {len(card_rows)} cards for series {series} in catalog {self.path}, "
+                     f"{len(changes)} changed")
+
+    @staticmethod
+    def _bump_generation(conn) -> int:
+        conn.execute("INSERT INTO catalog_meta (key, value) VALUES ('generation', 1) "
+                     "ON CONFLICT (key) DO UPDATE SET value = value + 1")
+        return conn.execute("SELECT value FROM catalog_meta WHERE key = 'generation'").fetchone()[0]
+
+    def generation(self) -> int:
+        """
+        Counter increased whenever the stored cards of a pack change, so in-memory views can
+        tell they are stale; see `changed_series`.
+        """
+        with self.connect() as conn:
+            row = conn.execute("SELECT value FROM catalog_meta WHERE key = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    @classmethod
+    def parse_filters(cls, params) -> dict:
+        """
+        Validate query parameters such as `{'color': 'Red', 'cost_lte': '3'}`.
+        Raises ValueError on unknown filters or non-integer range values.
+        """
+        filters = {}
+        for key, value in params.items():
+            if value is None or value == '':
+                continue
+            if key in cls.MATCH_FILTERS:
+                filters[key] = str(value)
+                continue
+            field, _, op = key.partition('_')
+            op = f"_{op}" if op else ''
+            if field in cls.RANGE_FIELDS and op in cls.RANGE_OPERATORS:
+                try:
+                    filters[key] = int(value)
+                except (TypeError, ValueError):
+                    raise ValueError(f"Filter '{key}' expects an integer, got '{value}'.")
+                continue
+            raise ValueError(f"Unknown filter '{key}'. Available filters: {cls.available_filters()}")
+        return filters
+
+    @classmethod
+    def available_filters(cls) -> List[str]:
+        ranges = [f"{field}{op}" for field in cls.RANGE_FIELDS for op in cls.RANGE_OPERATORS]
+        return list(cls.MATCH_FILTERS) + ranges
+
+    def iter_rows(self, **filters):
+        """
+        Return an iterator of `(series, data)` rows matching every filter, read from the
+        database as they are consumed. Filters are validated before this returns.
+        """
+        clauses, values = [], []
+        for key, value in self.parse_filters(filters).items():
+            if key == 'color':
+                clauses.append("EXISTS (SELECT 1 FROM card_colors cc WHERE cc.series = cards.series "
+                               "AND cc.card_id = cards.card_id AND cc.color = ?)")
+                values.append(value)
+            elif key == 'pack':
+                clauses.append("(series = ? OR series IN (SELECT series FROM packs WHERE code = ?))")
+                values.extend([value, value])
+            elif key in self.MATCH_FILTERS:
+                clauses.append(f"{key} = ?")
+                values.append(value)
+            else:
+                field, _, op = key.partition('_')
+                clauses.append(f"{field} {self.RANGE_OPERATORS[f'_{op}' if op else '']} ?")
+                values.append(value)
+
+        sql = "SELECT series, data FROM cards"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY series, position"
+        return self._iter_sql(sql, values)
+
+    def _iter_sql(self, sql, values):
+        with self.connect() as conn:
+            yield from conn.execute(sql, values)
+
+    def iter_query(self, **filters):
+        """
+        Return an iterator of the stored cards matching every filter, built one at a time.
+        """
+        return (Card.from_dict(json.loads(data)) for _, data in self.iter_rows(**filters))
+
+    def query(self, **filters):
+        """
+        Return the stored cards matching every filter, e.g.
+        `catalog.query(color='Red', cost_lte=3, category='CHARACTER')`.
+        """
+        return list(self.iter_query(**filters))
+
+    def packs(self) -> List[Pack]:
+        with self.connect() as conn:
+            rows = conn.execute("SELECT series, prefix, name, code FROM packs ORDER BY rowid").fetchall()
+        return [Pack(*row) for row in rows]
+
+    def iter_cards(self):
+        """
+        Yield `(series, card)` for every stored card.
+        """
+        return ((series, Card.from_dict(json.loads(data))) for series, data in self.iter_rows())
+
+    def changed_series(self, since=0) -> Dict[str, int]:
+        """
+        The generation at which the cards of each series were last stored, for the series
+        stored after generation `since`.
+        """
+        with self.connect() as conn:
+            rows = conn.execute("SELECT series, generation FROM series_generations WHERE generation > ?",
+                                (since,)).fetchall()
+        return dict(rows)
+
+    def card_terms(self, series=None) -> Dict[Tuple[str, str], List[Tuple[str, str]]]:
+        """
+        The search terms stored for every card, or for the cards of one pack, keyed by
+        `(series, card_id)`.
+        """
+        sql, values = "SELECT series, card_id, field, term FROM card_terms", ()
+        if series is not None:
+            sql, values = sql + " WHERE series = ?", (series,)
+        terms = defaultdict(list)
+        with self.connect() as conn:
+            for row_series, card_id, field, term in conn.execute(sql, values):
+                terms[(row_series, card_id)].append((field, term))
+        return terms
+
+    def iter_printings(self, codes: Iterable[str]):
+        """
+        Yield `(series, card)` for every stored card with one of the card `codes`, or, for
+        cards without a card code, with one of them as card ID.
+        """
+        codes = list(codes)
+        with self.connect() as conn:
+            # Stay well below SQLite's limit on query parameters
+            for start in range(0, len(codes), 400):
+                chunk = codes[start:start + 400]
+                marks = ", ".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT series, data FROM cards WHERE card_code IN ({marks}) "
+                    f"OR (card_code IS NULL AND card_id IN ({marks})) ORDER BY series, position", chunk + chunk)
+                for series, data in rows:
+                    yield series, Card.from_dict(json.loads(data))
+
+    def iter_pack_cards(self):
+        """
+        Yield `(pack, cards)` for every stored pack that has cards, one pack at a time.
+        """
+        for pack in self.packs():
+            cards = list(self.iter_query(pack=pack.series))
+            if cards:
+                yield pack, cards
+
+
+class TestCardCatalog(unittest.TestCase):
+    def test_to_int(self):
+        self.assertEqual(to_int("5000"), 5000)
+        self.assertIsNone(to_int("-"))
+        self.assertIsNone(to_int(None))
+
+    def test_parse_filters(self):
+        filters = CardCatalog.parse_filters({'color': 'Red', 'cost_lte': '3', 'power': '5000', 'rarity': ''})
+        self.assertEqual(filters, {'color': 'Red', 'cost_lte': 3, 'power': 5000})
+        with self.assertRaises(ValueError):
+            CardCatalog.parse_filters({'cost_lte': 'three'})
+        with self.assertRaises(ValueError):
+            CardCatalog.parse_filters({'flavor': 'x'})
+
+    def test_generation_changes_only_with_cards(self):
+        zoro = Card('OP01-001', 'OP01-001', 'L', 'LEADER', 'Roronoa Zoro', None, None, None, 'Red', None)
+        otama = Card('OP01-006', 'OP01-006', 'UC', 'CHARACTER', 'Otama', None, None, None, 'Red', None)
+        with tempfile.TemporaryDirectory() as directory:
+            catalog = CardCatalog(os.path.join(directory, 'catalog.sqlite3'))
+            catalog.store_cards('556101', [zoro, otama])
+            self.assertEqual((catalog.generation(), catalog.changed_series()), (1, {'556101': 1}))
+            catalog.store_cards('556101', [zoro, otama])
+            self.assertEqual(catalog.generation(), 1)
+            catalog.store_cards('556101', [otama, zoro])
+            catalog.store_cards('556102', [zoro])
+            self.assertEqual(catalog.changed_series(1), {'556101': 2, '556102': 3})
+            self.assertEqual(catalog.query(pack='556101'), [otama, zoro])
+
+    def test_readers_not_locked_out_by_writer(self):
+        zoro = Card('OP01-001', 'OP01-001', 'L', 'LEADER', 'Roronoa Zoro', None, None, None, 'Red', None)
+        with tempfile.TemporaryDirectory() as directory:
+            catalog = CardCatalog(os.path.join(directory, 'catalog.sqlite3'))
+            catalog.store_cards('556101', [zoro])
+            writer = sqlite3.connect(catalog.path, isolation_level=None)
+            try:
+                writer.execute("BEGIN EXCLUSIVE")
+                writer.execute("DELETE FROM cards")
+                self.assertEqual(catalog.query(pack='556101'), [zoro])
+                writer.execute("ROLLBACK")
+            finally:
+                writer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+import sqlite3
+import json
+import time
+import unittest
+
+
+@dataclass
+class Change:
+    """
+    One entry of the change log. `fields` maps every modified field to `[old, new]`;
+    `data` is the record as stored after the change, or as it was before a removal.
+    """
+
+    kind: str
+    change: str
+    series: str
+    card_id: Optional[str] = None
+    fields: Optional[dict] = None
+    data: Optional[dict] = None
+    recorded: Optional[float] = None
+    cursor: Optional[int] = None
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def diff_records(kind, series, old: Dict[str, str], new: Dict[str, str], key_field=None) -> List[Change]:
+    """
+    Compare the stored and new JSON records of one pack, keyed by card ID (or by series for
+    packs), and return the added, removed and modified ones. Records whose JSON is equal are
+    not decoded at all.
+    """
+    changes = []
+    for key, data in new.items():
+        previous = old.get(key)
+        if previous == data:
+            continue
+        record = json.loads(data)
+        card_id = record.get(key_field) if key_field else None
+        if previous is None:
+            changes.append(Change(kind, 'added', series, card_id, data=record))
+            continue
+        before = json.loads(previous)
+        fields = {name: [before.get(name), value] for name, value in record.items() if before.get(name) != value}
+        if fields:
+            changes.append(Change(kind, 'modified', series, card_id, fields=fields, data=record))
+    for key, data in old.items():
+        if key not in new:
+            record = json.loads(data)
+            changes.append(Change(kind, 'removed', series, record.get(key_field) if key_field else None, data=record))
+    return changes
+
+
+class ChangeLog:
+    """
+    Append-only log of the pack and card changes found whenever the catalog stores new
+    scrape results. Every entry gets a monotonically increasing cursor, so consumers poll
+    with the last cursor they have seen and receive only what changed since.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS changes (
+            cursor INTEGER PRIMARY KEY AUTOINCREMENT,
+            recorded REAL NOT NULL,
+            kind TEXT NOT NULL,
+            change TEXT NOT NULL,
+            series TEXT NOT NULL,
+            card_id TEXT,
+            fields TEXT,
+            data TEXT
+        );
+    """
+
+    DEFAULT_LIMIT = 1000
+
+    def __init__(self, path):
+        self.path = path
+        with self.connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def record(conn, changes: List[Change]):
+        """
+        Append `changes` within the caller's transaction, so they commit with the data they describe.
+        """
+        recorded = time.time()
+        conn.executemany(
+            "INSERT INTO changes (recorded, kind, change, series, card_id, fields, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(recorded, c.kind, c.change, c.series, c.card_id,
+              json.dumps(c.fields) if c.fields is not None else None,
+              json.dumps(c.data) if c.data is not None else None) for c in changes])
+
+    def since(self, cursor=0, limit=DEFAULT_LIMIT) -> List[Change]:
+        """
+        The changes recorded after `cursor`, oldest first, at most `limit` of them.
+        """
+        with self.connect() as conn:
+            rows = conn.execute(
+                "SELECT cursor, recorded, kind, change, series, card_id, fields, data FROM changes "
+                "WHERE cursor > ? ORDER BY cursor LIMIT ?", (cursor, limit)).fetchall()
+        return [Change(kind, change, series, card_id,
+                       json.loads(fields) if fields is not None else None,
+                       json.loads(data) if data is not None else None,
+                       recorded, row_cursor)
+                for row_cursor, recorded, kind, change, series, card_id, fields, data in rows]
+
+    def latest(self) -> int:
+        with self.connect() as conn:
+            row = conn.execute("SELECT MAX(cursor) FROM changes").fetchone()
+        return row[0] or 0
+
+
+class TestChanges(unittest.TestCase):
+    def test_diff_records(self):
+        old = {
+            'OP01-001': json.dumps({'card_id': 'OP01-001', 'power': '5000'}),
+            'OP01-002': json.dumps({'card_id': 'OP01-002', 'power': '3000'}),
+            'OP01-003': json.dumps({'card_id': 'OP01-003', 'power': '1000'}),
+        }
+        new = {
+            'OP01-001': old['OP01-001'],
+            'OP01-002': json.dumps({'card_id': 'OP01-002', 'power': '4000'}),
+            'OP01-004': json.dumps({'card_id': 'OP01-004', 'power': '2000'}),
+        }
+        changes = diff_records('card', '556101', old, new, key_field='card_id')
+        self.assertEqual([(c.change, c.card_id) for c in changes],
+                         [('modified', 'OP01-002'), ('added', 'OP01-004'), ('removed', 'OP01-003')])
+        self.assertEqual(changes[0].fields, {'power': ['3000', '4000']})
+
+
+if __name__ == "__main__":
+    unittest.main()
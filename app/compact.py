@@ -0,0 +1,194 @@
+from dataclasses import dataclass, asdict
+from typing import Optional, Tuple, Union
+import sys
+import unittest
+import weakref
+
+from .card import Card
+
+Number = Union[int, str, None]
+
+
+class Interner:
+    """
+    Pool of shared immutable values. Strings go through `sys.intern`; tuples are pooled
+    so that every card with the same types or colors references one tuple. Equal compact
+    cards are pooled weakly, so a card reprinted in several packs is held once for as long
+    as any index references it.
+    """
+
+    _tuples = {}
+    _cards = weakref.WeakValueDictionary()
+
+    @staticmethod
+    def share_str(value):
+        return sys.intern(value) if isinstance(value, str) else value
+
+    @classmethod
+    def share_tuple(cls, values):
+        if values is None:
+            return None
+        values = tuple(values)
+        return cls._tuples.setdefault(values, values)
+
+    @classmethod
+    def share_card(cls, card):
+        # Keyed by ID and hash rather than the card itself, which would keep every card alive
+        key = (card.card_id, hash(card))
+        shared = cls._cards.get(key)
+        if shared is not None and shared == card:
+            return shared
+        if shared is None:
+            cls._cards[key] = card
+        return card
+
+
+def to_number(value) -> Number:
+    """
+    Store a scraped numeric string as an int when that loses nothing ("5000" -> 5000),
+    otherwise keep the interned string (e.g. "-") so it serializes back unchanged.
+    """
+    if value is None or isinstance(value, int):
+        return value
+    text = str(value)
+    if text.isdigit() and str(int(text)) == text:
+        return int(text)
+    return Interner.share_str(text)
+
+
+def from_number(value) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+@dataclass(slots=True, frozen=True, weakref_slot=True)
+class CompactCard:
+    """
+    Memory-lean, typed form of a Card for catalogs kept resident in memory.
+
+    Numbers are ints, colors/attributes/category/rarity are enum members, and repeated
+    strings and tuples (types, names, effects) are shared between cards. `to_dict` returns
+    exactly `asdict(card)` of the Card it was built from, so serialization is unchanged.
+    """
+
+    card_id: str
+    card_code: str
+    rarity: Optional[Card.Rarity]
+    category: Optional[Card.Category]
+    name: Optional[str]
+    img_url: Optional[str]
+    attributes: Optional[Tuple[Union[Card.Attribute, str], ...]]
+    block: Number
+    colors: Optional[Tuple[Union[Card.Color, str], ...]]
+    effect: Optional[str]
+    cost: Number = None
+    power: Number = None
+    counter: Number = None
+    types: Optional[Tuple[str, ...]] = None
+    trigger: Optional[str] = None
+
+    @staticmethod
+    def parse_colors(color):
+        if color is None:
+            return None
+        colors = []
+        for part in color.split('/'):
+            try:
+                colors.append(Card.Color(part))
+            except ValueError:
+                colors.append(Interner.share_str(part))
+        return Interner.share_tuple(colors)
+
+    @classmethod
+    def from_card(cls, card: Card) -> "CompactCard":
+        types = None
+        if card.types is not None:
+            types = Interner.share_tuple(Interner.share_str(t) for t in card.types.split('\n'))
+        return cls(
+            card_id=Interner.share_str(card.card_id),
+            card_code=Interner.share_str(card.card_code),
+            rarity=card.rarity,
+            category=card.category,
+            name=Interner.share_str(card.name),
+            img_url=card.img_url,
+            attributes=Interner.share_tuple(card.attributes),
+            block=to_number(card.block),
+            colors=cls.parse_colors(card.color),
+            effect=Interner.share_str(card.effect),
+            cost=to_number(card.cost),
+            power=to_number(card.power),
+            counter=to_number(card.counter),
+            types=types,
+            trigger=Interner.share_str(card.trigger),
+        )
+
+    @classmethod
+    def shared(cls, card: Card) -> "CompactCard":
+        """
+        `from_card`, returning the pooled instance when an equal card is already in memory.
+        """
+        return Interner.share_card(cls.from_card(card))
+
+    @property
+    def color(self) -> Optional[str]:
+        return None if self.colors is None else '/'.join(str(c) for c in self.colors)
+
+    def to_card(self) -> Card:
+        return Card(
+            card_id=self.card_id,
+            card_code=self.card_code,
+            rarity=self.rarity,
+            category=self.category,
+            name=self.name,
+            img_url=self.img_url,
+            attributes=list(self.attributes) if self.attributes is not None else None,
+            block=from_number(self.block),
+            color=self.color,
+            effect=self.effect,
+            cost=from_number(self.cost),
+            power=from_number(self.power),
+            counter=from_number(self.counter),
+            types='\n'.join(self.types) if self.types is not None else None,
+            trigger=self.trigger,
+        )
+
+    def to_dict(self) -> dict:
+        return asdict(self.to_card())
+
+
+class TestCompactCard(unittest.TestCase):
+    CARD = Card(
+        card_id='OP01-006_p1', card_code='OP01-006', rarity=Card.Rarity.UNCOMMON,
+        category=Card.Category.CHARACTER, name='Otama', img_url='https://example.com/OP01-006_p1.png',
+        attributes=[Card.Attribute.SPECIAL], block='1', color='Red/Green', effect='[On Play] ...',
+        cost='1', power='0', counter='2000', types='Land of Wano\nStraw Hat Crew', trigger=None)
+
+    def test_round_trip_keeps_serialization(self):
+        compact = CompactCard.from_card(self.CARD)
+        self.assertEqual(compact.to_dict(), asdict(self.CARD))
+        self.assertEqual(compact.to_card(), self.CARD)
+
+    def test_typed_fields(self):
+        compact = CompactCard.from_card(self.CARD)
+        self.assertEqual(compact.cost, 1)
+        self.assertEqual(compact.counter, 2000)
+        self.assertEqual(compact.colors, (Card.Color.RED, Card.Color.GREEN))
+        self.assertFalse(hasattr(compact, '__dict__'))
+
+    def test_repeated_values_are_shared(self):
+        first = CompactCard.from_card(self.CARD)
+        second = CompactCard.from_card(Card(**{**asdict(self.CARD), 'card_id': 'OP01-006'}))
+        self.assertIs(first.types, second.types)
+        self.assertIs(first.colors, second.colors)
+
+    def test_equal_cards_are_shared(self):
+        first = CompactCard.shared(self.CARD)
+        self.assertIs(CompactCard.shared(Card(**asdict(self.CARD))), first)
+        self.assertIsNot(CompactCard.shared(Card(**{**asdict(self.CARD), 'power': '1000'})), first)
+
+    def test_non_numeric_values_survive(self):
+        card = Card(**{**asdict(self.CARD), 'cost': '-', 'block': None})
+        self.assertEqual(CompactCard.from_card(card).to_dict(), asdict(card))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from urllib.parse import urlsplit
+import multiprocessing
+import threading
+import logging
+import os
+import time
+import unittest
+
+
+def process_context():
+    """
+    Multiprocessing context for every process pool: forkserver, or spawn where it is
+    unavailable, rather than fork. Pools are also started from the threaded web service,
+    and forking it would copy locks held by its other threads into the workers.
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+class HostRateLimiter:
+    """
+    Spaces out requests so that no single host sees more than `rate` requests per second.
+    A rate of None or 0 disables limiting.
+    """
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class OrderedFetcher:
+    """
+    Runs `fetch(item)` for every item on a bounded thread pool and yields `(item, result)`
+    in the original order. At most `max_workers` fetches are in flight at any time, so a slow
+    item only holds back the ones queued behind it, never the whole run.
+    """
+
+    DEFAULT_WORKERS = 4
+
+    def __init__(self, fetch, max_workers=DEFAULT_WORKERS):
+        if max_workers < 1:
+            raise ValueError(f"max_workers must be at least 1, got {max_workers}")
+        self.fetch = fetch
+        self.max_workers = max_workers
+
+    def run(self, items):
+        items = iter(items)
+        if self.max_workers == 1:
+            for item in items:
+                yield item, self.fetch(item)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="optcg-fetch") as executor:
+            pending = deque()
+            try:
+                for item in items:
+                    pending.append((item, executor.submit(self.fetch, item)))
+                    if len(pending) >= self.max_workers:
+                        item, future = pending.popleft()
+                        yield item, future.result()
+                while pending:
+                    item, future = pending.popleft()
+                    yield item, future.result()
+            finally:
+                for _, future in pending:
+                    if future.cancel():
+                        logging.debug("Cancelled queued fetch after the consumer stopped early.")
+
+
+class ParsePipeline:
+    """
+    Fetches on threads and parses on a process pool, so downloads and CPU-bound parsing
+    overlap and parsing uses every core. The caller, consuming results in input order, is
+    the writer stage.
+
+    `fetch(item)` runs on `fetch_workers` threads and returns `(payload, context)`;
+    `parse(payload)` (a picklable, module-level function) runs on `parse_workers` processes
+    unless the payload is None. `run` yields `(item, context, parsed, error)`, where `error`
+    is the exception `parse` raised. At most `queue_size` fetched payloads wait for or are
+    in parsing; when the queue is full, fetching stops until the writer catches up.
+
+    Parse processes are started with `process_context`.
+    """
+
+    def __init__(self, fetch, parse, fetch_workers=OrderedFetcher.DEFAULT_WORKERS, parse_workers=None,
+                 queue_size=None):
+        if parse_workers is not None and parse_workers < 1:
+            raise ValueError(f"parse_workers must be at least 1, got {parse_workers}")
+        self.parse = parse
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.queue_size = queue_size or 2 * self.parse_workers
+        self.fetcher = OrderedFetcher(fetch, max_workers=fetch_workers)
+
+    @staticmethod
+    def _result(future):
+        if future is None:
+            return None, None
+        try:
+            return future.result(), None
+        except Exception as e:
+            return None, e
+
+    def run(self, items):
+        with ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=process_context()) as pool:
+            pending = deque()
+            try:
+                for item, (payload, context) in self.fetcher.run(items):
+                    future = pool.submit(self.parse, payload) if payload is not None else None
+                    pending.append((item, context, future))
+                    if len(pending) >= self.queue_size:
+                        item, context, future = pending.popleft()
+                        yield (item, context, *self._result(future))
+                while pending:
+                    item, context, future = pending.popleft()
+                    yield (item, context, *self._result(future))
+            finally:
+                for _, _, future in pending:
+                    if future is not None:
+                        future.cancel()
+
+
+def _parse_length(payload):
+    # Test helper for `ParsePipeline`; module-level so parse processes can unpickle it
+    if payload == 'bad':
+        raise ValueError("unparseable")
+    return len(payload)
+
+
+class TestOrderedFetcher(unittest.TestCase):
+    def test_results_keep_input_order(self):
+        def slow_first(n):
+            time.sleep(0.05 if n == 0 else 0)
+            return n * 10
+        results = list(OrderedFetcher(slow_first, max_workers=3).run(range(6)))
+        self.assertEqual(results, [(n, n * 10) for n in range(6)])
+
+    def test_in_flight_is_bounded(self):
+        lock = threading.Lock()
+        state = {'active': 0, 'peak': 0}
+
+        def track(n):
+            with lock:
+                state['active'] += 1
+                state['peak'] = max(state['peak'], state['active'])
+            time.sleep(0.01)
+            with lock:
+                state['active'] -= 1
+            return n
+        list(OrderedFetcher(track, max_workers=2).run(range(8)))
+        self.assertLessEqual(state['peak'], 2)
+
+    def test_parse_pipeline(self):
+        pipeline = ParsePipeline(lambda n: (None if n == 2 else ('bad' if n == 3 else 'x' * n), n * 10),
+                                 _parse_length, fetch_workers=2, parse_workers=2, queue_size=2)
+        results = [(item, context, parsed, type(error)) for item, context, parsed, error in pipeline.run(range(5))]
+        self.assertEqual(results, [(0, 0, 0, type(None)), (1, 10, 1, type(None)), (2, 20, None, type(None)),
+                                   (3, 30, None, ValueError), (4, 40, 4, type(None))])
+        with self.assertRaises(ValueError):
+            ParsePipeline(lambda n: (n, None), _parse_length, parse_workers=-1)
+
+    def test_rate_limiter_spaces_requests(self):
+        limiter = HostRateLimiter(rate=50)
+        start = time.monotonic()
+        for _ in range(4):
+            limiter.wait("https://example.com/cardlist")
+        self.assertGreaterEqual(time.monotonic() - start, 3 / 50 - 0.005)
+
+
+if __name__ == "__main__":
+    unittest.main()
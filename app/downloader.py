@@ -0,0 +1,386 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional, Tuple
+import tempfile
+import threading
+import logging
+import time
+import os
+import unittest
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, where concurrent writers are not locked out
+    fcntl = None
+
+# requests is imported where downloads happen, so that importing this module (e.g. for
+# DEFAULT_WORKERS in the CLI's options) stays cheap
+
+
+class IncompleteDownloadError(IOError):
+    pass
+
+
+@dataclass
+class DownloadSummary:
+
+    downloaded: int = 0
+    skipped: int = 0
+    failed: int = 0
+    failures: List[str] = field(default_factory=list)
+
+    def __str__(self):
+        summary = f"Downloaded {self.downloaded}, skipped {self.skipped}, failed {self.failed}."
+        if self.failures:
+            summary += " Failed: " + ", ".join(self.failures)
+        return summary
+
+
+class ImageDownloader:
+    """
+    Downloads files over a shared, pooled session on a bounded thread pool.
+
+    Every file is written to `<path>.part` first and renamed into place only once it is
+    complete, so a crash never leaves a truncated file under the final name; writers of the
+    same file take turns, see `locked`. A leftover `.part` file is resumed with a Range
+    request whose If-Range carries the ETag or Last-Modified of the response that started it
+    (kept in `<path>.part.validator`), so a file changed on the server is downloaded again in
+    full rather than spliced. Existing files are downloaded again only when the server
+    reports a different size for them.
+    """
+
+    DEFAULT_WORKERS = 8
+    CHUNK_SIZE = 64 * 1024
+    TIMEOUT = 30
+
+    DOWNLOADED = 'downloaded'
+    SKIPPED = 'skipped'
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, session=None, retry=None):
+        if max_workers < 1:
+            raise ValueError(f"max_workers must be at least 1, got {max_workers}")
+        self.max_workers = max_workers
+        from .upstream import RetryPolicy
+
+        self.session = session or self.create_session(max_workers)
+        self.retry = retry or RetryPolicy()
+
+    @staticmethod
+    def create_session(pool_size):
+        from requests.adapters import HTTPAdapter
+        import requests
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @staticmethod
+    def content_length(resp) -> Optional[int]:
+        try:
+            return int(resp.headers['Content-Length'])
+        except (KeyError, ValueError):
+            return None
+
+    @staticmethod
+    def validator(resp) -> Optional[str]:
+        """
+        The strong ETag, else the Last-Modified date, of a response: what If-Range accepts.
+        """
+        etag = resp.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return resp.headers.get('Last-Modified')
+
+    def remote_size(self, url) -> Optional[int]:
+        """
+        The size the server reports for `url`, or None when it does not say or the HEAD
+        request fails (some hosts answer HEAD with 403 or 405).
+        """
+        import requests
+
+        try:
+            resp = self.session.head(url, allow_redirects=True, timeout=self.TIMEOUT)
+            resp.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logging.debug(f"Cannot check the size of {url}: {e}")
+            return None
+        return self.content_length(resp)
+
+    def download(self, url, save_path) -> str:
+        """
+        Download `url` to `save_path`. Returns DOWNLOADED or SKIPPED, and raises
+        requests.exceptions.RequestException or IOError on failure. Connection errors,
+        429/5xx answers and truncated transfers are retried with backoff, resuming the
+        partial file.
+        """
+        return self.retry.call(lambda: self.download_once(url, save_path), f"Download of {url}",
+                               retry_on=(IncompleteDownloadError,))
+
+    @staticmethod
+    @contextmanager
+    def locked(path):
+        """
+        Hold an exclusive lock on `<path>.lock` while downloading `path`, so that writers in
+        other threads and processes never share its `.part` file. The lock file is removed on
+        release; a writer that locked a file removed meanwhile locks the new one instead.
+        """
+        if fcntl is None:
+            yield
+            return
+        lock_path = path + '.lock'
+        while True:
+            lock_file = open(lock_path, 'a')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if os.path.samestat(os.fstat(lock_file.fileno()), os.stat(lock_path)):
+                    break
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+        try:
+            yield
+        finally:
+            os.remove(lock_path)
+            lock_file.close()
+
+    def download_once(self, url, save_path) -> str:
+        """
+        One attempt at `download`. A writer that waited for another one to finish the same
+        file finds it in place and skips it.
+        """
+        with self.locked(save_path):
+            return self._download(url, save_path)
+
+    def _download(self, url, save_path) -> str:
+        if os.path.exists(save_path):
+            local_size = os.path.getsize(save_path)
+            expected = self.remote_size(url)
+            if expected is None or expected == local_size:
+                logging.info(f"File already exists at {save_path}. Skipping download...")
+                return self.SKIPPED
+            logging.warning(f"{save_path} is {local_size} bytes but the server reports {expected}. Downloading again...")
+
+        part_path = save_path + '.part'
+        validator_path = part_path + '.validator'
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        validator = None
+        if offset:
+            try:
+                with open(validator_path, encoding='utf-8') as f:
+                    validator = f.read().strip() or None
+            except FileNotFoundError:
+                pass
+        # Without a validator there is no telling whether the remote file changed, so start over
+        headers = {'Range': f'bytes={offset}-', 'If-Range': validator} if validator else {}
+
+        with self.session.get(url, stream=True, headers=headers, timeout=self.TIMEOUT) as resp:
+            if resp.status_code == 416:
+                # The partial file is already as long as (or longer than) the remote file.
+                os.remove(part_path)
+                return self._download(url, save_path)
+            resp.raise_for_status()
+
+            length = self.content_length(resp)
+            if validator and resp.status_code == 206:
+                if self.validator(resp) not in (None, validator):
+                    # The server ignored If-Range and the file changed since the part was written
+                    logging.warning(f"{url} changed since {part_path} was written. Downloading again...")
+                    os.remove(part_path)
+                    return self._download(url, save_path)
+                logging.info(f"Resuming {save_path} from byte {offset}...")
+                mode = 'ab'
+            else:
+                offset, mode = 0, 'wb'
+                self.save_validator(validator_path, self.validator(resp))
+            expected = offset + length if length is not None else None
+
+            with open(part_path, mode) as f:
+                for chunk in resp.iter_content(chunk_size=self.CHUNK_SIZE):
+                    f.write(chunk)
+
+        written = os.path.getsize(part_path)
+        if expected is not None and written != expected:
+            raise IncompleteDownloadError(f"Incomplete download of {url}: got {written} of {expected} bytes")
+        os.replace(part_path, save_path)
+        self.save_validator(validator_path, None)
+        return self.DOWNLOADED
+
+    @staticmethod
+    def save_validator(path, validator):
+        """
+        Keep the validator of the response a `.part` file was started from, or remove it.
+        """
+        if validator:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(validator)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def download_all(self, jobs: Iterable[Tuple[str, str]]) -> DownloadSummary:
+        """
+        Download every `(url, save_path)` pair concurrently and return the counts.
+        """
+        import requests
+
+        summary = DownloadSummary()
+
+        def run(job):
+            url, save_path = job
+            try:
+                return job, self.download(url, save_path), None
+            except (requests.exceptions.RequestException, IOError) as e:
+                return job, None, e
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="optcg-img") as executor:
+            for (url, save_path), status, error in executor.map(run, jobs):
+                if error is not None:
+                    logging.error(f"Error downloading {url}: {error}")
+                    summary.failed += 1
+                    summary.failures.append(os.path.basename(save_path))
+                elif status == self.SKIPPED:
+                    summary.skipped += 1
+                else:
+                    logging.info(f"{url} downloaded successfully to {save_path}")
+                    summary.downloaded += 1
+        return summary
+
+    def close(self):
+        self.session.close()
+
+
+class StubResponse:
+
+    def __init__(self, status_code, body=b'', headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = {'Content-Length': str(len(body))} if status_code != 416 else {}
+        self.headers.update(headers or {})
+        self.delay = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            import requests
+
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error", response=self)
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            time.sleep(self.delay)
+            yield self.body[start:start + chunk_size]
+
+
+class StubSession:
+
+    def __init__(self, answers, size=None, head_status=200):
+        self.answers = list(answers)
+        self.size = size
+        self.head_status = head_status
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append(headers or {})
+        return self.answers.pop(0)
+
+    def head(self, url, **kwargs):
+        resp = StubResponse(self.head_status)
+        resp.headers = {'Content-Length': str(self.size)} if self.size is not None else {}
+        return resp
+
+    def close(self):
+        pass
+
+
+class TestImageDownloader(unittest.TestCase):
+    ETAG = {'ETag': '"v1"'}
+
+    def setUp(self):
+        from .upstream import RetryPolicy
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'OP01-001.jpg')
+        self.retry = RetryPolicy(attempts=3, base_delay=0.001, max_delay=0.01)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def download(self, answers, size=None, head_status=200):
+        session = StubSession(answers, size, head_status)
+        status = ImageDownloader(max_workers=1, session=session, retry=self.retry).download('https://x/1.jpg', self.path)
+        with open(self.path, 'rb') as f:
+            return status, f.read(), session.requests
+
+    def test_resumes_truncated_transfer(self):
+        truncated = StubResponse(200, b'abc', {'Content-Length': '6', **self.ETAG})
+        status, data, requests_sent = self.download([truncated, StubResponse(206, b'def', self.ETAG)])
+        self.assertEqual((status, data), (ImageDownloader.DOWNLOADED, b'abcdef'))
+        self.assertEqual(requests_sent[1], {'Range': 'bytes=3-', 'If-Range': '"v1"'})
+        self.assertEqual(os.listdir(self.directory.name), ['OP01-001.jpg'])
+
+    def test_changed_file_is_downloaded_again(self):
+        truncated = StubResponse(200, b'abc', {'Content-Length': '6', **self.ETAG})
+        # The server answers If-Range with the whole new file
+        status, data, _ = self.download([truncated, StubResponse(200, b'ABCDEFG', {'ETag': '"v2"'})])
+        self.assertEqual(data, b'ABCDEFG')
+        # A server that ignores If-Range is caught by the changed ETag
+        os.remove(self.path)
+        truncated = StubResponse(200, b'abc', {'Content-Length': '6', **self.ETAG})
+        status, data, _ = self.download([truncated, StubResponse(206, b'DEFG', {'ETag': '"v2"'}),
+                                         StubResponse(200, b'ABCDEFG', {'ETag': '"v2"'})])
+        self.assertEqual(data, b'ABCDEFG')
+
+    def test_range_not_satisfiable_restarts(self):
+        with open(self.path + '.part', 'wb') as f:
+            f.write(b'abcdefgh')
+        with open(self.path + '.part.validator', 'w') as f:
+            f.write('"v1"')
+        status, data, requests_sent = self.download([StubResponse(416), StubResponse(200, b'abcdef', self.ETAG)])
+        self.assertEqual(data, b'abcdef')
+        self.assertEqual(requests_sent[1], {})
+
+    def test_size_mismatch(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'abc')
+        status, data, _ = self.download([], size=3)
+        self.assertEqual((status, data), (ImageDownloader.SKIPPED, b'abc'))
+        status, data, _ = self.download([StubResponse(200, b'abcdef')], size=6)
+        self.assertEqual((status, data), (ImageDownloader.DOWNLOADED, b'abcdef'))
+        with self.assertRaises(IncompleteDownloadError):
+            self.download([StubResponse(200, b'ab', {'Content-Length': '6'})] * 3, size=7)
+
+    def test_concurrent_writers_take_turns(self):
+        slow = StubResponse(200, b'abcdef', self.ETAG)
+        slow.delay = 0.01
+        session = StubSession([slow, StubResponse(200, b'ABCDEF')], size=6)
+        downloader = ImageDownloader(max_workers=1, session=session, retry=self.retry)
+        statuses = []
+        threads = [threading.Thread(target=lambda: statuses.append(downloader.download_once('https://x/1.jpg', self.path)))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(statuses), [ImageDownloader.DOWNLOADED, ImageDownloader.SKIPPED])
+        self.assertEqual(len(session.requests), 1)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'abcdef')
+        self.assertEqual(os.listdir(self.directory.name), ['OP01-001.jpg'])
+
+    def test_existing_file_kept_when_size_unknown(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'abc')
+        # No GET is answered: the local file must be kept
+        self.assertEqual(self.download([], size=6, head_status=405)[:2], (ImageDownloader.SKIPPED, b'abc'))
+        self.assertEqual(self.download([], size=None)[:2], (ImageDownloader.SKIPPED, b'abc'))
+
+
+if __name__ == "__main__":
+    unittest.main()
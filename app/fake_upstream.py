@@ -0,0 +1,208 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import argparse
+import functools
+import threading
+import random
+import struct
+import json
+import time
+import zlib
+import unittest
+
+from .benchmark import CARDLIST_FIXTURE, PACKLIST_FIXTURE
+from .scraper import DEFAULT_BASE_URL, OptcgScraper
+
+
+@functools.lru_cache(maxsize=None)
+def placeholder_png() -> bytes:
+    """
+    A valid 1x1 PNG, served for every card image unless a recorded image is given.
+    """
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    header = struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(b'\x00\xff\xff\xff')) + chunk(b'IEND', b''))
+
+
+class FakeUpstream:
+    """
+    Local stand-in for the card site, for load tests that must not reach it.
+
+    `/cardlist` answers with the recorded pack list, `/cardlist/?series=...` with the
+    recorded cardlist page for every series, and `/images/...` with a card image. Links to
+    the real site in the pages are rewritten to this server, so images are fetched from it
+    too. Every answer is delayed by `latency` plus up to `jitter` seconds, and fails with
+    `error_status` at `error_rate`. `/_stats` reports the requests served so far.
+    """
+
+    def __init__(self, packlist: bytes, cardlist: bytes, image: bytes = None, latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_status=503, host='127.0.0.1', port=0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.image = image or placeholder_png()
+        self.stats = {'requests': 0, 'errors': 0, 'packs': 0, 'cards': 0, 'images': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.server = ThreadingHTTPServer((host, port), FakeUpstreamHandler)
+        self.server.daemon_threads = True
+        self.server.upstream = self
+        real_site = DEFAULT_BASE_URL.encode('ascii')
+        self.packlist = packlist.replace(real_site, self.base_url.encode('ascii'))
+        self.cardlist = cardlist.replace(real_site, self.base_url.encode('ascii'))
+
+    @classmethod
+    def from_fixtures(cls, packlist=PACKLIST_FIXTURE, cardlist=CARDLIST_FIXTURE, image=None, cards=None, **kwargs):
+        """
+        Serve recorded pages from files; with `cards`, the cardlist page is grown or cut to that many cards.
+        """
+        with open(packlist, 'rb') as f:
+            packlist_page = f.read()
+        with open(cardlist, 'rb') as f:
+            cardlist_page = f.read()
+        if cards:
+            from .benchmark import page_with_cards
+
+            cardlist_page = page_with_cards(cardlist_page, cards)
+        image_bytes = None
+        if image:
+            with open(image, 'rb') as f:
+                image_bytes = f.read()
+        return cls(packlist_page, cardlist_page, image=image_bytes, **kwargs)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeUpstream":
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-upstream', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def respond(self, path, query):
+        """
+        Return `(status, content type, body)` for a request, after the configured delay.
+        """
+        if path == '/_stats':
+            with self._lock:
+                return 200, 'application/json', json.dumps(self.stats).encode('utf-8')
+
+        if path.rstrip('/') == '/cardlist':
+            kind, content_type = ('cards', 'text/html') if query.get('series') else ('packs', 'text/html')
+            body = self.cardlist if kind == 'cards' else self.packlist
+        elif path.startswith('/images/'):
+            kind, content_type, body = 'images', 'image/png', self.image
+        else:
+            kind, content_type, body = None, 'text/plain', b'Not Found'
+
+        with self._lock:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            failed = kind is not None and self._random.random() < self.error_rate
+            self.stats['requests'] += 1
+            if kind is not None:
+                self.stats[kind] += 1
+            if failed:
+                self.stats['errors'] += 1
+        if delay:
+            time.sleep(delay)
+        if kind is None:
+            return 404, content_type, body
+        if failed:
+            return self.error_status, 'text/plain', b'Injected failure'
+        return 200, content_type, body
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        status, content_type, body = self.server.upstream.respond(parts.path, parse_qs(parts.query))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve recorded card site pages locally for load tests.")
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1).')
+    parser.add_argument('--port', type=int, default=8081, help='Port to listen on (default: 8081).')
+    parser.add_argument('--packlist', default=PACKLIST_FIXTURE, help='Recorded pack-list HTML page.')
+    parser.add_argument('--page', default=CARDLIST_FIXTURE, help='Recorded cardlist HTML page served for every series.')
+    parser.add_argument('--cards', type=int, default=None, help='Grow or cut the cardlist page to this many cards.')
+    parser.add_argument('--image', default=None, help='Image file served for every card (default: a 1x1 PNG).')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds every answer is delayed (default: 0).')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many extra seconds of random delay.')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of page and image requests that fail (default: 0).')
+    parser.add_argument('--error-status', type=int, default=503, help='Status of failed requests (default: 503).')
+    return parser.parse_args()
+
+
+class TestFakeUpstream(unittest.TestCase):
+    def test_scraper_reads_fake_site(self):
+        import logging
+        from .fetch_cache import CacheConfig
+
+        logging.disable(logging.CRITICAL)
+        try:
+            with FakeUpstream.from_fixtures() as upstream:
+                scraper = OptcgScraper(session=OptcgScraper.create_session(cache=CacheConfig(backend='memory')),
+                                       base_url=upstream.base_url)
+                packs = scraper.fetch_packs()
+                cards = scraper.fetch_cards(packs[0].series)
+                self.assertTrue(packs and cards)
+                self.assertTrue(all(card.img_url.startswith(upstream.base_url + '/images/') for card in cards))
+                image = scraper.session.get(cards[0].img_url)
+                self.assertEqual(image.content, placeholder_png())
+                self.assertEqual(upstream.stats['packs'], 1)
+                self.assertEqual(upstream.stats['cards'], 1)
+        finally:
+            logging.disable(logging.NOTSET)
+
+    def test_injected_errors(self):
+        upstream = FakeUpstream(b'packs', b'cards', error_rate=1.0, error_status=429, seed=1)
+        try:
+            self.assertEqual(upstream.respond('/cardlist/', {'series': ['556101']})[0], 429)
+            self.assertEqual(upstream.respond('/missing', {})[0], 404)
+            self.assertEqual(json.loads(upstream.respond('/_stats', {})[2])['errors'], 1)
+        finally:
+            upstream.server.server_close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    upstream = FakeUpstream.from_fixtures(
+        args.packlist, args.page, image=args.image, cards=args.cards, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, error_status=args.error_status, host=args.host, port=args.port)
+    print(f"Serving the card site stand-in on {upstream.base_url}; set OPTCG_BASE_URL={upstream.base_url}")
+    try:
+        upstream.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        upstream.server.server_close()
@@ -0,0 +1,207 @@
+from dataclasses import dataclass
+from functools import lru_cache
+import tempfile
+import logging
+import zlib
+import io
+import os
+import unittest
+
+DEFAULT_CACHE_PATH = "/tmp/optcg_scrape.sqlite"
+
+
+@lru_cache(maxsize=None)
+def compressed_serializer():
+    """
+    Cached responses are pickled, then zlib-compressed; cardlist pages shrink about tenfold.
+    requests_cache is imported here rather than at module level, so commands that never
+    create a session (--help, offline queries) do not pay for loading it.
+    """
+    from requests_cache.serializers import SerializerPipeline, Stage, pickle_serializer
+
+    return SerializerPipeline(
+        [*pickle_serializer.stages, Stage(zlib, dumps='compress', loads='decompress')],
+        name='pickle+zlib',
+        is_binary=True,
+    )
+
+
+@dataclass
+class CacheConfig:
+    """
+    Settings of the requests cache in front of the card site.
+
+    `packs_ttl` and `cards_ttl` are how long the pack list and the cardlist pages stay
+    fresh. For `stale_ttl` seconds after that, the stale copy is returned at once and
+    refreshed in the background, so no request waits on the card site while any copy exists.
+    That is off by default, so that scrapes write out fresh pages; the web service turns it
+    on with `SERVICE_STALE_TTL`, see `from_env`.
+    """
+
+    BACKENDS = ('sqlite', 'filesystem', 'memory', 'redis')
+    SERVICE_STALE_TTL = 86400
+
+    backend: str = 'sqlite'
+    path: str = DEFAULT_CACHE_PATH
+    packs_ttl: int = 7200
+    cards_ttl: int = 7200
+    stale_ttl: int = 0
+    compress: bool = True
+
+    ENVIRONMENT = {
+        'backend': 'OPTCG_CACHE_BACKEND',
+        'path': 'OPTCG_CACHE_PATH',
+        'packs_ttl': 'OPTCG_CACHE_PACKS_TTL',
+        'cards_ttl': 'OPTCG_CACHE_CARDS_TTL',
+        'stale_ttl': 'OPTCG_CACHE_STALE_TTL',
+    }
+
+    def __post_init__(self):
+        if self.backend not in self.BACKENDS:
+            raise ValueError(f"Invalid cache backend '{self.backend}'. Available backends: {list(self.BACKENDS)}")
+
+    @classmethod
+    def from_env(cls, environ=os.environ, service=False) -> "CacheConfig":
+        """
+        Settings from OPTCG_CACHE_* environment variables. With `service`, as for the web
+        service, stale pages are served for `SERVICE_STALE_TTL` seconds unless
+        OPTCG_CACHE_STALE_TTL says otherwise.
+        """
+        values = {'stale_ttl': cls.SERVICE_STALE_TTL} if service else {}
+        for name, variable in cls.ENVIRONMENT.items():
+            if environ.get(variable):
+                values[name] = environ[variable] if name in ('backend', 'path') else int(environ[variable])
+        if environ.get('OPTCG_CACHE_COMPRESS'):
+            values['compress'] = environ['OPTCG_CACHE_COMPRESS'].lower() not in ('0', 'false', 'no')
+        return cls(**values)
+
+    @classmethod
+    def from_args(cls, args) -> "CacheConfig":
+        """
+        Settings from the --cache-* command line options, falling back to the environment.
+        """
+        config = cls.from_env()
+        for name in ('backend', 'path', 'packs_ttl', 'cards_ttl', 'stale_ttl'):
+            value = getattr(args, f"cache_{name}", None)
+            if value is not None:
+                setattr(config, name, value)
+        if getattr(args, 'cache_uncompressed', False):
+            config.compress = False
+        config.__post_init__()
+        return config
+
+    def urls_expire_after(self):
+        # First match wins: cardlist pages are requested as /cardlist/?series=..., the pack list as /cardlist
+        return {
+            '*/cardlist/': self.cards_ttl,
+            '*/cardlist': self.packs_ttl,
+        }
+
+    def backend_options(self):
+        if self.backend == 'sqlite':
+            # WAL lets every gunicorn worker read while one writes; writers wait instead of failing
+            return {'wal': True, 'busy_timeout': 30000}
+        return {}
+
+    def create_session(self) -> "requests_cache.CachedSession":
+        import requests_cache
+
+        logging.debug(f"Using {self.backend} request cache at {self.path}")
+        return requests_cache.CachedSession(
+            self.path,
+            backend=self.backend,
+            serializer=compressed_serializer() if self.compress else None,
+            expire_after=max(self.packs_ttl, self.cards_ttl),
+            urls_expire_after=self.urls_expire_after(),
+            stale_while_revalidate=self.stale_ttl or False,
+            **self.backend_options(),
+        )
+
+
+class TestCacheConfig(unittest.TestCase):
+    def test_from_env(self):
+        config = CacheConfig.from_env({'OPTCG_CACHE_CARDS_TTL': '60', 'OPTCG_CACHE_COMPRESS': 'no'})
+        self.assertEqual((config.cards_ttl, config.packs_ttl, config.compress), (60, 7200, False))
+        with self.assertRaises(ValueError):
+            CacheConfig.from_env({'OPTCG_CACHE_BACKEND': 'tape'})
+
+    def test_stale_pages_only_for_the_service(self):
+        self.assertEqual(CacheConfig.from_env({}).stale_ttl, 0)
+        self.assertEqual(CacheConfig.from_env({}, service=True).stale_ttl, CacheConfig.SERVICE_STALE_TTL)
+        self.assertEqual(CacheConfig.from_env({'OPTCG_CACHE_STALE_TTL': '0'}, service=True).stale_ttl, 0)
+
+    def test_cli_gets_fresh_pages(self):
+        from argparse import Namespace
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        import threading
+        import time
+
+        served = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                served.append(self.path)
+                body = f"page {len(served)}".encode('ascii')
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/cardlist/?series=556101"
+        try:
+            for config, expected in ((CacheConfig.from_args(Namespace(cache_backend='memory', cache_cards_ttl=1)),
+                                      ['page 1', 'page 1', 'page 2']),
+                                     (CacheConfig(backend='memory', cards_ttl=1, stale_ttl=60),
+                                      ['page 3', 'page 3', 'page 3'])):
+                session = config.create_session()
+                try:
+                    pages = [session.get(url).text, session.get(url).text]
+                    time.sleep(1.1)
+                    # Once expired, the CLI waits for the card site instead of using the stale page
+                    pages.append(session.get(url).text)
+                    self.assertEqual(pages, expected)
+                    # The service refreshes a stale page in the background
+                    deadline = time.monotonic() + 5
+                    while len(served) < 4 and config.stale_ttl and time.monotonic() < deadline:
+                        time.sleep(0.01)
+                finally:
+                    session.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_compressed_round_trip(self):
+        from requests.adapters import HTTPAdapter
+        from requests_cache import CachedResponse
+        from requests_cache.serializers import pickle_serializer
+        from urllib3 import HTTPResponse
+        import requests
+
+        content = b"<html>" + b"<dl class='modalCol'></dl>" * 500 + b"</html>"
+        request = requests.Request('GET', 'https://example.com/cardlist/?series=556101').prepare()
+        resp = HTTPAdapter().build_response(request, HTTPResponse(
+            body=io.BytesIO(content), status=200, preload_content=False, request_url=request.url))
+        cached = CachedResponse.from_response(resp)
+
+        data = compressed_serializer().dumps(cached)
+        self.assertLess(len(data), len(pickle_serializer.dumps(cached)) // 10)
+        self.assertEqual(compressed_serializer().loads(data).content, content)
+
+    def test_session_settings(self):
+        with tempfile.TemporaryDirectory() as directory:
+            session = CacheConfig(path=os.path.join(directory, 'cache.sqlite'), cards_ttl=60).create_session()
+            try:
+                self.assertEqual(session.settings.urls_expire_after['*/cardlist/'], 60)
+                self.assertFalse(session.settings.stale_while_revalidate)
+                self.assertEqual(session.cache.responses.serializer.name, compressed_serializer().name)
+            finally:
+                session.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,344 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+import tempfile
+import threading
+import hashlib
+import logging
+import json
+import io
+import os
+import unittest
+
+try:
+    from PIL import Image, features
+except ImportError:  # Pillow is only needed when image variants are requested
+    Image = None
+    features = None
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, where manifest updates are not locked
+    fcntl = None
+
+from .concurrency import process_context
+
+
+@dataclass(frozen=True)
+class ImageVariant:
+    """
+    One derived image: `width` pixels wide (None keeps the original size) in `format`.
+    """
+
+    width: Optional[int]
+    format: str
+
+    EXTENSIONS = {'webp': 'webp', 'avif': 'avif', 'jpeg': 'jpg', 'png': 'png'}
+
+    @property
+    def label(self):
+        return f"{self.width or 'full'}.{self.EXTENSIONS[self.format]}"
+
+    @classmethod
+    def parse(cls, sizes: Optional[str], formats: Optional[str]) -> List["ImageVariant"]:
+        """
+        Variants for every combination of the comma separated `sizes` (widths in pixels,
+        or 'full') and `formats`. Formats default to webp, sizes to full size only.
+        """
+        format_names = [f.strip().lower() for f in (formats or 'webp').split(',') if f.strip()]
+        for name in format_names:
+            if name not in cls.EXTENSIONS:
+                raise ValueError(f"Unsupported image format '{name}'. Available formats: {list(cls.EXTENSIONS)}")
+        widths = []
+        for size in (sizes or 'full').split(','):
+            size = size.strip().lower()
+            if not size:
+                continue
+            if size == 'full':
+                widths.append(None)
+            elif size.isdigit() and int(size) > 0:
+                widths.append(int(size))
+            else:
+                raise ValueError(f"Invalid thumbnail size '{size}'; expected a width in pixels or 'full'.")
+        return [cls(width, name) for width in widths for name in format_names]
+
+
+def file_hash(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_atomic(path, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Per process, so workers and concurrent runs writing the same file do not share a part file
+    part_path = f"{path}.{os.getpid()}.part"
+    with open(part_path, 'wb') as f:
+        f.write(data)
+    os.replace(part_path, path)
+
+
+def render_variants(source_path, source_hash, store_dir, variants) -> Dict[str, dict]:
+    """
+    Render every variant of one source image into the content-addressed store and return
+    `{label: {'path': ..., 'sha256': ...}}`. Runs in a worker process.
+    """
+    results = {}
+    with Image.open(source_path) as original:
+        original.load()
+        for variant in variants:
+            img = original.copy()
+            if variant.width and img.width > variant.width:
+                height = max(1, round(img.height * variant.width / img.width))
+                img = img.resize((variant.width, height), Image.Resampling.LANCZOS)
+            if variant.format == 'jpeg' and img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            buffer = io.BytesIO()
+            img.save(buffer, format=variant.format.upper())
+            data = buffer.getvalue()
+            path = os.path.join(store_dir, source_hash[:2], f"{source_hash}-{variant.label}")
+            if not os.path.exists(path):
+                write_atomic(path, data)
+            results[variant.label] = {'path': path, 'sha256': hashlib.sha256(data).hexdigest()}
+    return results
+
+
+@dataclass
+class VariantSummary:
+
+    processed: int = 0
+    unchanged: int = 0
+    shared: int = 0
+    failed: int = 0
+    failures: List[str] = field(default_factory=list)
+
+    def __str__(self):
+        summary = (f"Image variants: processed {self.processed}, unchanged {self.unchanged}, "
+                   f"shared artwork {self.shared}, failed {self.failed}.")
+        if self.failures:
+            summary += " Failed: " + ", ".join(self.failures)
+        return summary
+
+
+class ImagePipeline:
+    """
+    Turns downloaded card images into thumbnails and WebP/AVIF variants on a process pool.
+
+    Variants are stored under `<directory>/variants/` by the hash of their source image, so
+    artwork shared by reprints is rendered and stored once. `<directory>/manifest.json` maps
+    every card ID to its source hash and variant paths and hashes; a card whose source hash
+    and variants are unchanged since the last run is skipped.
+
+    Used as a context manager, the pipeline keeps one process pool for every `process` call
+    and saves the manifest once on exit; otherwise each call saves it and shuts the pool down.
+    Saving merges this run's entries into the manifest on disk under a file lock, so runs in
+    other processes do not lose each other's entries.
+    """
+
+    MANIFEST_NAME = 'manifest.json'
+
+    def __init__(self, directory, variants: List[ImageVariant], max_workers=None):
+        if Image is None:
+            raise RuntimeError("Image variants require Pillow; install it with 'pip install Pillow'.")
+        for variant in variants:
+            if variant.format in ('webp', 'avif') and not features.check(variant.format):
+                raise RuntimeError(f"This Pillow build cannot write {variant.format.upper()} images.")
+        self.directory = directory
+        self.variants = variants
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.store_dir = os.path.join(directory, 'variants')
+        self.manifest_path = os.path.join(directory, self.MANIFEST_NAME)
+        self._cards: Optional[Dict[str, dict]] = None
+        self._updates: Dict[str, dict] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._batch = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_args(cls, args, directory) -> Optional["ImagePipeline"]:
+        """
+        Build the pipeline requested with --thumb-sizes / --image-formats, or None.
+        """
+        sizes = getattr(args, 'thumb_sizes', None)
+        formats = getattr(args, 'image_formats', None)
+        if not sizes and not formats:
+            return None
+        return cls(directory, ImageVariant.parse(sizes, formats), max_workers=getattr(args, 'image_workers', None))
+
+    def __enter__(self):
+        self._batch = True
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._batch = False
+        self.close()
+
+    def close(self):
+        """
+        Save the manifest if entries changed and shut the process pool down.
+        """
+        try:
+            self.save_manifest()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def load_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'cards': {}}
+        except (ValueError, OSError) as e:
+            logging.warning(f"Ignoring unreadable image manifest {self.manifest_path}: {e}")
+            return {'cards': {}}
+
+    def save_manifest(self):
+        """
+        Merge the entries made since the last save into the manifest on disk.
+        """
+        with self._lock:
+            if not self._updates:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.manifest_path + ".lock", 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                manifest = self.load_manifest()
+                manifest.setdefault('cards', {}).update(self._updates)
+                write_atomic(self.manifest_path, json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+            self._updates.clear()
+
+    def is_current(self, entry, source_hash) -> bool:
+        if not entry or entry.get('source_hash') != source_hash:
+            return False
+        stored = entry.get('variants', {})
+        return all(v.label in stored and os.path.exists(stored[v.label]['path']) for v in self.variants)
+
+    def process(self, images: List[Tuple[str, str]]) -> VariantSummary:
+        """
+        Make the variants for `(card_id, image path)` pairs and record them in the manifest.
+        """
+        summary = VariantSummary()
+        if self._cards is None:
+            self._cards = self.load_manifest().get('cards', {})
+        cards = self._cards
+
+        pending: Dict[str, List[Tuple[str, str]]] = {}
+        for card_id, path in images:
+            if not os.path.exists(path):
+                continue
+            source_hash = file_hash(path)
+            if self.is_current(cards.get(card_id), source_hash):
+                summary.unchanged += 1
+                continue
+            pending.setdefault(source_hash, []).append((card_id, path))
+
+        try:
+            if self.max_workers == 1 or len(pending) <= 1:
+                results = ((h, self._render(h, entries)) for h, entries in pending.items())
+                self._collect(results, pending, summary)
+            else:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=process_context())
+                futures = {h: self._pool.submit(render_variants, entries[0][1], h, self.store_dir, self.variants)
+                           for h, entries in pending.items()}
+                self._collect(((h, self._result(f)) for h, f in futures.items()), pending, summary)
+        finally:
+            if not self._batch:
+                self.close()
+        return summary
+
+    def _render(self, source_hash, entries):
+        try:
+            return render_variants(entries[0][1], source_hash, self.store_dir, self.variants)
+        except Exception as e:
+            return e
+
+    @staticmethod
+    def _result(future):
+        try:
+            return future.result()
+        except Exception as e:
+            return e
+
+    def _collect(self, results, pending, summary):
+        for source_hash, result in results:
+            entries = pending[source_hash]
+            if isinstance(result, Exception):
+                logging.error(f"Failed to make image variants of {entries[0][1]}: {result}")
+                summary.failed += len(entries)
+                summary.failures.extend(card_id for card_id, _ in entries)
+                continue
+            for card_id, path in entries:
+                entry = {'source': path, 'source_hash': source_hash, 'variants': result}
+                self._cards[card_id] = self._updates[card_id] = entry
+            summary.processed += 1
+            summary.shared += len(entries) - 1
+
+
+class TestImageVariant(unittest.TestCase):
+    def test_parse(self):
+        variants = ImageVariant.parse('200,full', 'webp,jpeg')
+        self.assertEqual([v.label for v in variants], ['200.webp', '200.jpg', 'full.webp', 'full.jpg'])
+        self.assertEqual(ImageVariant.parse(None, None), [ImageVariant(None, 'webp')])
+        with self.assertRaises(ValueError):
+            ImageVariant.parse('big', None)
+        with self.assertRaises(ValueError):
+            ImageVariant.parse(None, 'gif')
+
+
+@unittest.skipIf(Image is None, "Pillow is not installed")
+class TestImagePipeline(unittest.TestCase):
+    def make_image(self, path, color):
+        Image.new('RGB', (600, 838), color).save(path, format='JPEG')
+
+    def test_shared_artwork_and_reruns(self):
+        with tempfile.TemporaryDirectory() as directory:
+            images = []
+            for card_id, color in (('OP01-006', 'red'), ('OP01-006_p1', 'red'), ('OP01-001', 'green')):
+                path = os.path.join(directory, f"{card_id}.jpg")
+                self.make_image(path, color)
+                images.append((card_id, path))
+            pipeline = ImagePipeline(directory, ImageVariant.parse('150', 'webp'), max_workers=1)
+
+            summary = pipeline.process(images)
+            self.assertEqual((summary.processed, summary.shared, summary.unchanged), (2, 1, 0))
+            cards = pipeline.load_manifest()['cards']
+            self.assertEqual(cards['OP01-006']['variants'], cards['OP01-006_p1']['variants'])
+            with Image.open(cards['OP01-001']['variants']['150.webp']['path']) as thumb:
+                self.assertEqual(thumb.width, 150)
+
+            summary = pipeline.process(images)
+            self.assertEqual((summary.processed, summary.unchanged), (0, 3))
+
+            self.make_image(images[2][1], 'blue')
+            summary = pipeline.process(images)
+            self.assertEqual((summary.processed, summary.unchanged), (1, 2))
+
+    def test_batch_and_concurrent_runs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            images = []
+            for card_id, color in (('OP01-001', 'red'), ('OP01-002', 'green'), ('OP01-003', 'blue')):
+                path = os.path.join(directory, f"{card_id}.jpg")
+                self.make_image(path, color)
+                images.append((card_id, path))
+            variants = ImageVariant.parse('100', 'jpeg')
+
+            with ImagePipeline(directory, variants, max_workers=2) as pipeline:
+                pipeline.process(images[:2])
+                pool = pipeline._pool
+                # Another run saves while this one is still going
+                ImagePipeline(directory, variants, max_workers=1).process(images[2:])
+                pipeline.process(images[:2])
+                self.assertIs(pipeline._pool, pool)
+                self.assertEqual(list(pipeline.load_manifest()['cards']), ['OP01-003'])
+            self.assertIsNone(pipeline._pool)
+            self.assertEqual(sorted(pipeline.load_manifest()['cards']), ['OP01-001', 'OP01-002', 'OP01-003'])
+
+
+if __name__ == "__main__":
+    unittest.main()
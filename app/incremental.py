@@ -0,0 +1,216 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import List, Optional
+import tempfile
+import sqlite3
+import hashlib
+import logging
+import time
+import os
+import unittest
+
+from .pack import Pack
+
+
+@dataclass
+class SeriesState:
+
+    series: str
+    content_hash: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    updated: Optional[float] = None
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class SeriesStateStore:
+    """
+    Remembers, per series, the hash and HTTP validators of the last cardlist page that was
+    written out. Kept in the catalog database next to the cards themselves.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS series_state (
+            series TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            updated REAL
+        );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self.connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, series) -> Optional[SeriesState]:
+        with self.connect() as conn:
+            row = conn.execute(
+                "SELECT series, content_hash, etag, last_modified, updated FROM series_state WHERE series = ?",
+                (series,)).fetchone()
+        return SeriesState(*row) if row else None
+
+    def put(self, state: SeriesState):
+        state.updated = time.time()
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO series_state (series, content_hash, etag, last_modified, updated) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (state.series, state.content_hash, state.etag, state.last_modified, state.updated))
+
+
+@dataclass
+class IncrementalReport:
+
+    changed: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+    # Changed packs whose page had no cards; their state is not saved, so they are fetched again
+    empty: List[str] = field(default_factory=list)
+
+    def __str__(self):
+        changed = ", ".join(self.changed) if self.changed else "none"
+        summary = f"Changed packs: {changed}. {len(self.unchanged)} packs unchanged."
+        if self.empty:
+            summary += f" Changed packs without cards: {', '.join(self.empty)}."
+        return summary
+
+
+class IncrementalFetcher:
+    """
+    Fetches a pack's cardlist page with conditional request headers and parses it only when
+    the page differs from the one last written. A pack whose output file is missing is
+    always treated as changed.
+    """
+
+    def __init__(self, scraper, store: SeriesStateStore):
+        self.scraper = scraper
+        self.store = store
+
+    @staticmethod
+    def content_hash(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    def fetch(self, pack, output_path=None):
+        """
+        Returns `(cards, state)`. `cards` is None when the pack is unchanged; otherwise
+        `state` should be saved with `store.put` once the cards have been written.
+        """
+        content, state = self.fetch_page(pack, output_path)
+        if content is None:
+            return None, state
+        return self.scraper.parse_cards(content), state
+
+    def fetch_page(self, pack, output_path=None):
+        """
+        Like `fetch`, but returns the raw page content instead of parsing it, for callers
+        that parse elsewhere. The content is None when the pack is unchanged.
+        """
+        previous = self.store.get(pack.series)
+        have_output = output_path is None or os.path.exists(output_path)
+        headers = previous.conditional_headers() if previous and have_output else {}
+
+        resp = self.scraper.fetch_cards_page(pack.series, headers=headers, force_refresh=True)
+        if resp.status_code == 304 and previous and have_output:
+            logging.info(f"Pack {pack.code} not modified upstream.")
+            return None, previous
+
+        state = SeriesState(
+            series=pack.series,
+            content_hash=self.content_hash(resp.content),
+            etag=resp.headers.get('ETag'),
+            last_modified=resp.headers.get('Last-Modified'),
+        )
+        if previous and have_output and state.content_hash == previous.content_hash:
+            logging.info(f"Pack {pack.code} content unchanged.")
+            return None, state
+        return resp.content, state
+
+
+class StubResponse:
+
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+class StubScraper:
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.requests = []
+
+    def fetch_cards_page(self, series, headers=None, force_refresh=False):
+        self.requests.append(headers)
+        return self.answers.pop(0)
+
+    @staticmethod
+    def parse_cards(content):
+        return content.decode('utf-8').split(',')
+
+
+class TestIncrementalFetcher(unittest.TestCase):
+    PACK = Pack('556101', 'BOOSTER PACK', 'ROMANCE DAWN', 'OP01')
+    VALIDATORS = {'ETag': '"v1"', 'Last-Modified': 'Wed, 01 Oct 2025 10:00:00 GMT'}
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = SeriesStateStore(os.path.join(self.directory.name, 'catalog.sqlite3'))
+        self.output = os.path.join(self.directory.name, 'OP01.csv')
+        open(self.output, 'w').close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def fetch(self, answer, output_path=None):
+        scraper = StubScraper([answer])
+        cards, state = IncrementalFetcher(scraper, self.store).fetch(self.PACK, output_path or self.output)
+        return cards, state, scraper.requests[0]
+
+    def test_conditional_requests(self):
+        cards, state, headers = self.fetch(StubResponse(200, b'OP01-001,OP01-002', self.VALIDATORS))
+        self.assertEqual((cards, headers), (['OP01-001', 'OP01-002'], {}))
+        self.store.put(state)
+        self.assertEqual(self.store.get('556101').etag, '"v1"')
+
+        cards, state, headers = self.fetch(StubResponse(304))
+        self.assertIsNone(cards)
+        self.assertEqual(headers, {'If-None-Match': '"v1"', 'If-Modified-Since': 'Wed, 01 Oct 2025 10:00:00 GMT'})
+        self.assertEqual(state.content_hash, IncrementalFetcher.content_hash(b'OP01-001,OP01-002'))
+
+        # A server without validator support answers 200 with the same page
+        cards, _, _ = self.fetch(StubResponse(200, b'OP01-001,OP01-002'))
+        self.assertIsNone(cards)
+        cards, _, _ = self.fetch(StubResponse(200, b'OP01-001,OP01-003'))
+        self.assertEqual(cards, ['OP01-001', 'OP01-003'])
+
+    def test_missing_output_is_fetched_in_full(self):
+        _, state, _ = self.fetch(StubResponse(200, b'OP01-001', self.VALIDATORS))
+        self.store.put(state)
+        cards, _, headers = self.fetch(StubResponse(200, b'OP01-001'), os.path.join(self.directory.name, 'gone.csv'))
+        self.assertEqual((cards, headers), (['OP01-001'], {}))
+
+    def test_report(self):
+        report = IncrementalReport(changed=['OP01'], unchanged=['OP02', 'OP03'], empty=['OP04'])
+        self.assertEqual(str(report), "Changed packs: OP01. 2 packs unchanged. Changed packs without cards: OP04.")
+
+
+if __name__ == "__main__":
+    unittest.main()
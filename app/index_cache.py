@@ -0,0 +1,97 @@
+from typing import Dict
+import threading
+import time
+import unittest
+
+
+class CatalogIndexCache:
+    """
+    An index of a catalog kept in memory between requests. The catalog's generation is
+    checked at most every `check_interval` seconds; when it changed, `update` gets the
+    packs stored since, see `CardCatalog.changed_series`. Subclasses build and update
+    indexes that are never modified afterwards, so callers of `get` may keep using one
+    while it is refreshed.
+    """
+
+    def __init__(self, catalog, check_interval=1.0):
+        self.catalog = catalog
+        self.check_interval = check_interval
+        self._index = None
+        self._generation = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def build(self):
+        raise NotImplementedError
+
+    def update(self, index, series_ids: Dict[str, int]):
+        raise NotImplementedError
+
+    def get(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._index is not None and now - self._checked < self.check_interval:
+                return self._index
+            self._checked = now
+            if self._index is None:
+                # Read the generation first, so packs stored while building are reloaded next time
+                generation = self.catalog.generation()
+                self._index = self.build()
+            else:
+                changed = self.catalog.changed_series(self._generation)
+                if not changed:
+                    return self._index
+                generation = max(changed.values())
+                self._index = self.update(self._index, changed)
+            self._generation = generation
+            return self._index
+
+
+class StubCatalog:
+
+    def __init__(self):
+        self.series = {}
+
+    def store(self, series):
+        self.series[series] = self.generation() + 1
+
+    def generation(self):
+        return max(self.series.values(), default=0)
+
+    def changed_series(self, since=0):
+        return {series: generation for series, generation in self.series.items() if generation > since}
+
+
+class PackListCache(CatalogIndexCache):
+
+    def build(self):
+        return ('built', sorted(self.catalog.series))
+
+    def update(self, index, series_ids):
+        return ('updated', sorted(series_ids))
+
+
+class TestCatalogIndexCache(unittest.TestCase):
+    def test_updates_only_changed_packs(self):
+        catalog = StubCatalog()
+        catalog.store('556101')
+        cache = PackListCache(catalog, check_interval=0)
+        self.assertEqual(cache.get(), ('built', ['556101']))
+        first = cache.get()
+        self.assertIs(cache.get(), first)
+        catalog.store('556102')
+        catalog.store('556101')
+        self.assertEqual(cache.get(), ('updated', ['556101', '556102']))
+        catalog.store('556103')
+        self.assertEqual(cache.get(), ('updated', ['556103']))
+
+    def test_check_interval(self):
+        catalog = StubCatalog()
+        cache = PackListCache(catalog, check_interval=60)
+        first = cache.get()
+        catalog.store('556101')
+        self.assertIs(cache.get(), first)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,412 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Callable, List, Optional
+import threading
+import tempfile
+import logging
+import sqlite3
+import json
+import time
+import uuid
+import os
+import unittest
+
+from .scraper import ScrapeProgress
+
+
+@dataclass
+class PackProgress:
+
+    code: str
+    name: str
+    status: str = 'pending'
+    cards: int = 0
+    bytes_written: int = 0
+    elapsed: Optional[float] = None
+    error: Optional[str] = None
+
+
+class Job(ScrapeProgress):
+    """
+    A background scrape. The job is its own progress listener, so its per-pack state is
+    updated as the scrape runs and can be read at any time with `to_dict`. With a `store`,
+    every change is also saved there for the other worker processes to read.
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, key, params, store=None):
+        self.job_id = uuid.uuid4().hex
+        self.key = key
+        self.params = params
+        self.store = store
+        self.pid = os.getpid()
+        self.status = self.QUEUED
+        self.message = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.packs: "OrderedDict[str, PackProgress]" = OrderedDict()
+        self._pack_started = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self.status in (self.QUEUED, self.RUNNING)
+
+    def packs_found(self, packs):
+        with self._lock:
+            for pack in packs:
+                self.packs[pack.series] = PackProgress(code=pack.code, name=pack.name)
+        self.save()
+
+    def pack_started(self, pack):
+        with self._lock:
+            self._pack_started[pack.series] = time.monotonic()
+            self.packs[pack.series].status = 'running'
+        self.save()
+
+    def _finish_pack(self, pack, status):
+        entry = self.packs[pack.series]
+        entry.status = status
+        started = self._pack_started.pop(pack.series, None)
+        if started is not None:
+            entry.elapsed = round(time.monotonic() - started, 3)
+        return entry
+
+    def pack_done(self, pack, card_count, bytes_written):
+        with self._lock:
+            entry = self._finish_pack(pack, 'done')
+            entry.cards = card_count
+            entry.bytes_written = bytes_written
+        self.save()
+
+    def pack_failed(self, pack, error):
+        with self._lock:
+            self._finish_pack(pack, 'failed').error = str(error)
+        self.save()
+
+    def pack_unchanged(self, pack):
+        with self._lock:
+            self._finish_pack(pack, 'unchanged')
+        self.save()
+
+    def save(self):
+        if self.store is not None:
+            # Serialized, so an older snapshot never overwrites a newer one
+            with self._save_lock:
+                self.store.save(self)
+
+    def run(self, body: Callable[["Job"], str]):
+        self.status = self.RUNNING
+        self.started = time.time()
+        self.save()
+        try:
+            self.message = body(self)
+            self.status = self.DONE
+        except Exception as e:
+            logging.exception(f"Job {self.job_id} failed")
+            self.error = str(e)
+            self.status = self.FAILED
+        finally:
+            self.finished = time.time()
+            self.save()
+
+    def state(self) -> dict:
+        """
+        Everything needed to rebuild the job with `from_state`, as JSON-serializable values.
+        """
+        with self._lock:
+            packs = {series: asdict(entry) for series, entry in self.packs.items()}
+        return {
+            'job_id': self.job_id, 'key': self.key, 'params': self.params, 'pid': self.pid,
+            'status': self.status, 'message': self.message, 'error': self.error,
+            'created': self.created, 'started': self.started, 'finished': self.finished,
+            'packs': packs,
+        }
+
+    @classmethod
+    def from_state(cls, state) -> "Job":
+        """
+        A read-only copy of a job saved by another process, see `JobStore`.
+        """
+        job = cls(state['key'], state['params'])
+        for name in ('job_id', 'pid', 'status', 'message', 'error', 'created', 'started', 'finished'):
+            setattr(job, name, state[name])
+        job.packs = OrderedDict((series, PackProgress(**entry)) for series, entry in state['packs'].items())
+        return job
+
+    def to_dict(self):
+        with self._lock:
+            packs = [asdict(entry) for entry in self.packs.values()]
+        counts = {status: sum(1 for p in packs if p['status'] == status)
+                  for status in ('pending', 'running', 'done', 'unchanged', 'failed')}
+        end = self.finished or time.time()
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'params': self.params,
+            'message': self.message,
+            'error': self.error,
+            'created': self.created,
+            'elapsed': round(end - self.started, 3) if self.started else None,
+            'progress': {'total': len(packs), **counts},
+            'packs': packs,
+        }
+
+
+class JobStore:
+    """
+    Jobs saved in an SQLite database (the card catalog's, in the web service), so that
+    every gunicorn worker can report and join the jobs started by the others. A job left
+    queued or running by a worker process that no longer exists is reported as failed.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            key TEXT NOT NULL,
+            active INTEGER NOT NULL,
+            created REAL NOT NULL,
+            state TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_key ON jobs (key, active);
+    """
+
+    WORKER_EXITED = "The worker process running this job exited."
+
+    def __init__(self, path, max_finished=None):
+        self.path = path
+        self.max_finished = max_finished
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row(job: Job):
+        return job.job_id, json.dumps(job.key), int(job.active), job.created, json.dumps(job.state())
+
+    def claim(self, job: Job) -> Optional[Job]:
+        """
+        Save `job` unless a live job with the same key is queued or running; that job is
+        returned instead. The check and the insert are one transaction, so two workers
+        never both start a job for the same key.
+        """
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for (state,) in conn.execute("SELECT state FROM jobs WHERE key = ? AND active = 1",
+                                         (json.dumps(job.key),)).fetchall():
+                running = self._check(conn, Job.from_state(json.loads(state)))
+                if running.active:
+                    return running
+            conn.execute("INSERT INTO jobs (job_id, key, active, created, state) VALUES (?, ?, ?, ?, ?)",
+                         self._row(job))
+            if self.max_finished is not None:
+                conn.execute("DELETE FROM jobs WHERE active = 0 AND job_id NOT IN "
+                             "(SELECT job_id FROM jobs WHERE active = 0 ORDER BY created DESC LIMIT ?)",
+                             (self.max_finished,))
+        return None
+
+    def save(self, job: Job):
+        with self.connect() as conn:
+            conn.execute("UPDATE jobs SET active = ?, state = ? WHERE job_id = ?",
+                         (int(job.active), json.dumps(job.state()), job.job_id))
+
+    def _check(self, conn, job: Job) -> Job:
+        """
+        Mark `job` failed when it is active but its worker process is gone.
+        """
+        if not job.active or self.process_alive(job.pid):
+            return job
+        job.status = Job.FAILED
+        job.error = self.WORKER_EXITED
+        job.finished = job.finished or time.time()
+        conn.execute("UPDATE jobs SET active = 0, state = ? WHERE job_id = ?", (json.dumps(job.state()), job.job_id))
+        return job
+
+    @staticmethod
+    def process_alive(pid) -> bool:
+        if pid == os.getpid():
+            return True
+        if pid <= 0:
+            return False  # kill() would signal a whole process group
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            pass  # Exists, but belongs to another user
+        return True
+
+    def get(self, job_id) -> Optional[Job]:
+        with self.connect() as conn:
+            row = conn.execute("SELECT state FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            return self._check(conn, Job.from_state(json.loads(row[0]))) if row else None
+
+    def list(self) -> List[Job]:
+        with self.connect() as conn:
+            rows = conn.execute("SELECT state FROM jobs ORDER BY created").fetchall()
+            return [self._check(conn, Job.from_state(json.loads(state))) for (state,) in rows]
+
+
+class JobManager:
+    """
+    Runs jobs on background threads. Submitting a job whose key matches a job that is
+    still queued or running returns that job instead of starting another. Finished jobs
+    are kept for inspection, up to `max_finished` of them. Without a `store` jobs are only
+    known to this process; with one, to every process sharing it, see `JobStore`.
+    """
+
+    DEFAULT_MAX_FINISHED = 50
+
+    def __init__(self, max_finished=DEFAULT_MAX_FINISHED, store: Optional[JobStore] = None):
+        self.max_finished = max_finished
+        self.store = store
+        if store is not None:
+            store.max_finished = max_finished
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, key, params, body: Callable[[Job], str]):
+        """
+        Start `body(job)` in the background. Returns `(job, created)`.
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job.key == key and job.active:
+                    return job, False
+            job = Job(key, params, store=self.store)
+            if self.store is not None:
+                running = self.store.claim(job)
+                if running is not None:
+                    return running, False
+            self._jobs[job.job_id] = job
+            self._prune()
+
+        thread = threading.Thread(target=job.run, args=(body,), name=f"optcg-job-{job.job_id[:8]}", daemon=True)
+        thread.start()
+        return job, True
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            return self.store.get(job_id)
+        return job
+
+    def list(self):
+        with self._lock:
+            local = dict(self._jobs)
+        if self.store is None:
+            return list(local.values())
+        # Jobs of this process are read live rather than from their last saved state
+        return [local.get(job.job_id, job) for job in self.store.list()]
+
+
+class TestJobManager(unittest.TestCase):
+    def test_duplicate_submit_joins_running_job(self):
+        release = threading.Event()
+        manager = JobManager()
+        job, created = manager.submit(('packs', 'csv'), {}, lambda job: release.wait(5) and "done")
+        again, created_again = manager.submit(('packs', 'csv'), {}, lambda job: "other")
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertIs(job, again)
+        release.set()
+
+    def test_finished_jobs_are_kept_and_pruned(self):
+        manager = JobManager(max_finished=2)
+        jobs = []
+        for n in range(4):
+            job, _ = manager.submit(('packs', n), {}, lambda job: "ok")
+            while job.active:
+                time.sleep(0.001)
+            jobs.append(job)
+        self.assertEqual(jobs[-1].to_dict()['status'], Job.DONE)
+        self.assertIsNone(manager.get(jobs[0].job_id))
+        self.assertIsNotNone(manager.get(jobs[-1].job_id))
+
+    def test_failed_job_records_error(self):
+        def body(job):
+            raise RuntimeError("upstream down")
+        job, _ = JobManager().submit('k', {}, body)
+        while job.active:
+            time.sleep(0.001)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.error, "upstream down")
+
+
+
+class TestJobStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'catalog.sqlite3')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def wait(self, manager, job_id):
+        # The saved state is the last thing a job writes
+        while manager.get(job_id).active:
+            time.sleep(0.001)
+        time.sleep(0.01)
+
+    def test_jobs_shared_between_workers(self):
+        release = threading.Event()
+        first = JobManager(store=JobStore(self.path))
+        second = JobManager(store=JobStore(self.path))
+        job, _ = first.submit(('packs', 'csv'), {'workers': 8}, lambda job: release.wait(5) and "done")
+        seen = second.get(job.job_id)
+        self.assertTrue(seen.active)
+        self.assertEqual(seen.params, {'workers': 8})
+        joined, created = second.submit(('packs', 'csv'), {'workers': 4}, lambda job: "other")
+        self.assertFalse(created)
+        self.assertEqual(joined.job_id, job.job_id)
+        release.set()
+        self.wait(second, job.job_id)
+        self.assertEqual(second.get(job.job_id).to_dict(), job.to_dict())
+        self.assertEqual([j.job_id for j in second.list()], [job.job_id])
+        self.assertIsNone(second.get('unknown'))
+
+    def test_job_of_exited_worker_fails(self):
+        import subprocess
+        import sys
+
+        exited = subprocess.Popen([sys.executable, '-c', ''])
+        exited.wait()
+        store = JobStore(self.path)
+        job = Job(('packs', 'csv'), {})
+        job.pid = exited.pid
+        store.claim(job)
+        self.assertEqual(store.get(job.job_id).error, JobStore.WORKER_EXITED)
+        manager = JobManager(store=store)
+        started, created = manager.submit(('packs', 'csv'), {}, lambda job: "ok")
+        self.assertTrue(created)
+        self.wait(manager, started.job_id)
+
+
+if __name__ == "__main__":
+    unittest.main()
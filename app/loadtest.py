@@ -0,0 +1,321 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import subprocess
+import threading
+import argparse
+import tempfile
+import random
+import math
+import socket
+import json
+import time
+import sys
+import os
+import unittest
+
+import requests
+
+from .fake_upstream import FakeUpstream
+
+# Relative weight of each kind of request in the default mix
+DEFAULT_MIX = 'packs=1,cards=8,img=1'
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@dataclass
+class Sample:
+    name: str
+    status: Optional[int]
+    seconds: float
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status is not None and self.status < 400
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of already sorted `values`.
+    """
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(values)))
+    return values[min(rank, len(values)) - 1]
+
+
+def summarize(samples: List[Sample], elapsed: float) -> Dict[str, dict]:
+    """
+    Throughput, latency percentiles and error rate per kind of request, and over all of them as 'all'.
+    """
+    groups: Dict[str, List[Sample]] = {'all': samples}
+    for sample in samples:
+        groups.setdefault(sample.name, []).append(sample)
+
+    summary = {}
+    for name, group in groups.items():
+        latencies = sorted(sample.seconds * 1000 for sample in group)
+        errors = sum(1 for sample in group if not sample.ok)
+        summary[name] = {
+            'requests': len(group),
+            'errors': errors,
+            'error_rate': round(errors / len(group), 4) if group else 0.0,
+            'rps': round(len(group) / elapsed, 2) if elapsed else 0.0,
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+        }
+    return summary
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in ('packs', 'cards', 'img'):
+            raise ValueError(f"Unknown request kind '{name.strip()}' in mix; use packs, cards and img.")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def build_plan(series: List[str], mix=DEFAULT_MIX, download_workers=4) -> List[Tuple[str, str, float]]:
+    """
+    `(kind, path, weight)` for every request the load generator picks from; the weight of
+    `cards` and `img` is spread over all series.
+    """
+    weights = parse_mix(mix)
+    plan = []
+    if weights.get('packs'):
+        plan.append(('packs', '/packs?format=json', weights['packs']))
+    for series_id in series:
+        if weights.get('cards'):
+            plan.append(('cards', f'/cards/{series_id}?format=json', weights['cards'] / len(series)))
+        if weights.get('img'):
+            plan.append(('img', f'/cards/{series_id}?format=img&download_workers={download_workers}',
+                         weights['img'] / len(series)))
+    return plan
+
+
+def discover_series(base_url, timeout=60.0) -> List[str]:
+    """
+    Series IDs of the packs the service under test lists.
+    """
+    resp = requests.get(base_url + '/packs?format=ndjson', timeout=timeout)
+    resp.raise_for_status()
+    packs = [json.loads(line) for line in resp.text.splitlines() if line.strip()]
+    return [pack['series'] for pack in packs if pack.get('series')]
+
+
+class LoadGenerator:
+    """
+    Sends requests drawn from a weighted plan to `base_url` from `concurrency` threads,
+    each with its own connection, until `duration` seconds have passed or `max_requests`
+    were sent, and records the status and latency of every one.
+    """
+
+    def __init__(self, base_url, plan: List[Tuple[str, str, float]], concurrency=8, duration=10.0,
+                 max_requests=None, timeout=120.0, seed=None):
+        if not plan:
+            raise ValueError("The load test plan has no requests.")
+        self.base_url = base_url.rstrip('/')
+        self.plan = plan
+        self.concurrency = concurrency
+        self.duration = duration
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.seed = seed
+        self.samples: List[Sample] = []
+        self._sent = 0
+        self._lock = threading.Lock()
+
+    def _claim(self, deadline) -> bool:
+        with self._lock:
+            if time.monotonic() >= deadline or (self.max_requests is not None and self._sent >= self.max_requests):
+                return False
+            self._sent += 1
+            return True
+
+    def _worker(self, index, deadline):
+        rng = random.Random(None if self.seed is None else self.seed + index)
+        weights = [weight for _, _, weight in self.plan]
+        samples = []
+        with requests.Session() as session:
+            while self._claim(deadline):
+                name, path, _ = rng.choices(self.plan, weights)[0]
+                started = time.perf_counter()
+                try:
+                    # The body is read in full, so streamed responses are timed to their last byte
+                    resp = session.get(self.base_url + path, timeout=self.timeout)
+                    resp.content
+                    samples.append(Sample(name, resp.status_code, time.perf_counter() - started))
+                except requests.RequestException as e:
+                    samples.append(Sample(name, None, time.perf_counter() - started, str(e)))
+        with self._lock:
+            self.samples.extend(samples)
+
+    def run(self) -> Tuple[List[Sample], float]:
+        """
+        Run the load and return the samples and the elapsed wall-clock seconds.
+        """
+        started = time.monotonic()
+        deadline = started + self.duration if self.duration else float('inf')
+        threads = [threading.Thread(target=self._worker, args=(index, deadline), daemon=True)
+                   for index in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.samples, time.monotonic() - started
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class GunicornServer:
+    """
+    `app.api:app` on gunicorn in a subprocess, with its catalog, requests cache and images
+    kept in `directory` and the card site replaced by `upstream_url`.
+    """
+
+    def __init__(self, upstream_url, directory, workers=2, threads=4, extra_env=None):
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.env = dict(os.environ)
+        self.env.setdefault('OPTCG_CACHE_PATH', os.path.join(directory, 'cache.sqlite'))
+        self.env.update({
+            'OPTCG_BASE_URL': upstream_url,
+            'OPTCG_CATALOG_PATH': os.path.join(directory, 'catalog.sqlite3'),
+            'OPTCG_IMAGE_DIR': os.path.join(directory, 'images'),
+            **(extra_env or {}),
+        })
+        self.command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{self.port}',
+                        '--workers', str(workers), '--threads', str(threads), '--timeout', '300',
+                        '--chdir', directory, '--pythonpath', PROJECT_ROOT, 'app.api:app']
+        self.process = None
+
+    def start(self, timeout=30.0) -> "GunicornServer":
+        self.process = subprocess.Popen(self.command, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with status {self.process.returncode}")
+            try:
+                if requests.get(self.base_url + '/metrics', timeout=1).ok:
+                    return self
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"gunicorn did not answer on {self.base_url} within {timeout:.0f}s")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def print_report(summary, upstream_stats=None):
+    print(f"{'request':<8} {'count':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for name, row in summary.items():
+        print(f"{name:<8} {row['requests']:>7} {row['rps']:>9.1f} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} "
+              f"{row['p99_ms']:>9.1f} {row['error_rate']:>7.1%}")
+    if upstream_stats:
+        print("Card site stand-in served " + ", ".join(f"{value} {name}" for name, value in upstream_stats.items()))
+
+
+def run_load(args, base_url) -> Dict[str, dict]:
+    series = discover_series(base_url)
+    if args.series:
+        series = series[:args.series]
+    plan = build_plan(series, args.mix, download_workers=args.download_workers)
+    if args.warmup:
+        LoadGenerator(base_url, plan, concurrency=args.concurrency, duration=args.warmup, seed=args.seed).run()
+    samples, elapsed = LoadGenerator(base_url, plan, concurrency=args.concurrency, duration=args.duration,
+                                     max_requests=args.requests, seed=args.seed).run()
+    return summarize(samples, elapsed)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Load-test the web service against a local stand-in for the card site.")
+    parser.add_argument('--target', default=None,
+                        help='Base URL of a running web service; by default gunicorn is started on a stand-in '
+                             'for the card site.')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='Concurrent clients (default: 8).')
+    parser.add_argument('-d', '--duration', type=float, default=10.0, help='Seconds to send load for (default: 10).')
+    parser.add_argument('-n', '--requests', type=int, default=None, help='Stop after this many requests.')
+    parser.add_argument('--warmup', type=float, default=0.0, help='Seconds of unreported load sent first (default: 0).')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help=f'Relative weights of /packs, /cards/<series_id> and image scraping (default: {DEFAULT_MIX}).')
+    parser.add_argument('--series', type=int, default=None, help='Only request the first N packs.')
+    parser.add_argument('--download-workers', type=int, default=4, help='download_workers of image requests.')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the request order.')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes (default: 2).')
+    parser.add_argument('--threads', type=int, default=4, help='Threads per gunicorn worker (default: 4).')
+    parser.add_argument('--latency', type=float, default=0.05, help='Card site stand-in latency in seconds (default: 0.05).')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra random card site latency in seconds.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of card site requests that fail.')
+    parser.add_argument('--cards', type=int, default=None, help='Cards on every stand-in cardlist page.')
+    parser.add_argument('--save', default=None, help='Also write the report as JSON to this file.')
+    return parser.parse_args()
+
+
+class TestLoadTest(unittest.TestCase):
+    def test_percentile_and_summary(self):
+        values = [float(v) for v in range(1, 101)]
+        self.assertEqual([percentile(values, q) for q in (0.5, 0.95, 0.99)], [50.0, 95.0, 99.0])
+        samples = [Sample('cards', 200, 0.01), Sample('cards', 503, 0.03), Sample('packs', None, 0.02, 'timeout')]
+        summary = summarize(samples, elapsed=1.0)
+        self.assertEqual(summary['all']['requests'], 3)
+        self.assertEqual(summary['cards']['error_rate'], 0.5)
+        self.assertEqual(summary['packs']['p99_ms'], 20.0)
+
+    def test_plan(self):
+        plan = build_plan(['556101', '556102'], 'packs=2,cards=4')
+        self.assertEqual([(name, weight) for name, _, weight in plan], [('packs', 2), ('cards', 2), ('cards', 2)])
+        with self.assertRaises(ValueError):
+            parse_mix('everything=1')
+
+    def test_generator_against_stand_in(self):
+        with FakeUpstream(b'packs', b'cards') as upstream:
+            plan = [('cards', '/cardlist/?series=556101', 1.0), ('missing', '/nothing', 1.0)]
+            samples, _ = LoadGenerator(upstream.base_url, plan, concurrency=2, duration=None, max_requests=20,
+                                       seed=1).run()
+            summary = summarize(samples, 1.0)
+            self.assertEqual(summary['all']['requests'], 20)
+            self.assertEqual(summary['missing']['error_rate'], 1.0)
+            self.assertEqual(summary['cards']['errors'], 0)
+            self.assertEqual(upstream.stats['requests'], 20)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    upstream_stats = None
+    if args.target:
+        summary = run_load(args, args.target.rstrip('/'))
+    else:
+        with tempfile.TemporaryDirectory() as directory, FakeUpstream.from_fixtures(
+                cards=args.cards, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                seed=args.seed) as upstream, GunicornServer(upstream.base_url, directory, args.workers, args.threads) as server:
+            print(f"Load testing gunicorn ({args.workers} workers x {args.threads} threads) on {server.base_url}, "
+                  f"card site stand-in on {upstream.base_url}")
+            summary = run_load(args, server.base_url)
+            upstream_stats = dict(upstream.stats)
+    print_report(summary, upstream_stats)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'summary': summary, 'upstream': upstream_stats}, f, indent=2)
+        print(f"Report saved to {args.save}")
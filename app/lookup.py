@@ -0,0 +1,151 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import threading
+import tempfile
+import time
+import os
+import unittest
+
+from .card import Card
+from .compact import CompactCard
+
+
+class CardLookup:
+    """
+    In-memory hash index from card ID and card code to the cards of every pack in a catalog.
+
+    Keys are matched case-insensitively. A card ID (`OP01-006_p1`) resolves to that exact
+    printing; a card code (`OP01-006`) resolves to its base printing, or to its first
+    variant when a pack only has variants. When several packs hold the card, the pack with
+    the lowest series ID wins. Only the packs stored since the last refresh are reloaded.
+    """
+
+    def __init__(self, catalog, check_interval=1.0):
+        self.catalog = catalog
+        self.check_interval = check_interval
+        self.pack_cards: Dict[str, List[CompactCard]] = {}
+        self.by_id: Dict[str, Dict[str, CompactCard]] = {}
+        self.by_code: Dict[str, Dict[str, CompactCard]] = {}
+        self._generation = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(key) -> str:
+        return str(key).strip().upper()
+
+    def _index(self, series, cards: Iterable[Card]):
+        self._unindex(series)
+        compact = [CompactCard.shared(card) for card in cards]
+        self.pack_cards[series] = compact
+        for card in compact:
+            self.by_id.setdefault(self.normalize(card.card_id), {}).setdefault(series, card)
+            if card.card_code:
+                codes = self.by_code.setdefault(self.normalize(card.card_code), {})
+                if series not in codes or card.card_id == card.card_code:
+                    codes[series] = card
+
+    def _unindex(self, series):
+        for card in self.pack_cards.pop(series, []):
+            for index, key in ((self.by_id, card.card_id), (self.by_code, card.card_code)):
+                normalized = self.normalize(key or '')
+                entries = index.get(normalized)
+                if entries is not None:
+                    entries.pop(series, None)
+                    if not entries:
+                        del index[normalized]
+
+    def refresh(self, force=False):
+        """
+        Load the whole catalog on first use, then reload the packs stored since.
+        Changes are checked at most every `check_interval` seconds unless `force` is set.
+        """
+        with self._lock:
+            self._refresh(force)
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self._generation is not None and now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        if self._generation is None:
+            # Read the generation first, so packs stored while loading are reloaded next time
+            generation = self.catalog.generation()
+            cards: Dict[str, List[Card]] = {}
+            for series, card in self.catalog.iter_cards():
+                cards.setdefault(series, []).append(card)
+            for series, pack in cards.items():
+                self._index(series, pack)
+        else:
+            changed = self.catalog.changed_series(self._generation)
+            if not changed:
+                return
+            generation = max(changed.values())
+            for series in changed:
+                self._index(series, self.catalog.iter_query(pack=series))
+        self._generation = generation
+
+    def find(self, key) -> Optional[Tuple[str, Card]]:
+        """
+        Return `(series, card)` for a card ID or card code, or None when it is unknown.
+        """
+        normalized = self.normalize(key)
+        entries = self.by_id.get(normalized) or self.by_code.get(normalized)
+        if not entries:
+            return None
+        series = min(entries)
+        return series, entries[series].to_card()
+
+    def lookup(self, keys: Iterable[str]) -> Tuple[List[Tuple[str, str, Card]], List[str]]:
+        """
+        Resolve every key after refreshing the index. Returns `(query, series, card)` for the
+        keys found, in request order and with repeats kept, and the list of keys not found.
+        """
+        found, missing = [], []
+        with self._lock:
+            self._refresh()
+            for key in keys:
+                match = self.find(key)
+                if match is None:
+                    missing.append(key)
+                else:
+                    found.append((key, *match))
+        return found, missing
+
+
+class TestCardLookup(unittest.TestCase):
+    BASE = Card('OP01-006', 'OP01-006', Card.Rarity.UNCOMMON, Card.Category.CHARACTER, 'Otama', None,
+                [Card.Attribute.SPECIAL], '1', 'Red', None, cost='1', power='0', counter='2000')
+    VARIANT = Card('OP01-006_p1', 'OP01-006', Card.Rarity.UNCOMMON, Card.Category.CHARACTER, 'Otama', None,
+                   [Card.Attribute.SPECIAL], '1', 'Red', None, cost='1', power='0', counter='2000')
+    ZORO = Card('OP01-025', 'OP01-025', Card.Rarity.SUPER_RARE, Card.Category.CHARACTER, 'Roronoa Zoro', None,
+                [Card.Attribute.SLASH], '1', 'Red', None, cost='3', power='5000')
+
+    def setUp(self):
+        from .catalog import CardCatalog
+        self.directory = tempfile.TemporaryDirectory()
+        self.catalog = CardCatalog(os.path.join(self.directory.name, 'catalog.sqlite3'))
+        self.lookup = CardLookup(self.catalog, check_interval=0)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_ids_and_codes(self):
+        self.catalog.store_cards('556101', [self.VARIANT, self.BASE, self.ZORO])
+        found, missing = self.lookup.lookup(['op01-006_p1', 'OP01-006', 'OP01-025', 'OP01-025', 'OP99-001'])
+        self.assertEqual([card.card_id for _, _, card in found], ['OP01-006_p1', 'OP01-006', 'OP01-025', 'OP01-025'])
+        self.assertEqual(found[0][2], self.VARIANT)
+        self.assertEqual(missing, ['OP99-001'])
+
+    def test_incremental_update(self):
+        self.catalog.store_cards('556101', [self.BASE])
+        self.assertEqual(self.lookup.lookup(['OP01-025'])[1], ['OP01-025'])
+        self.catalog.store_cards('556101', [self.ZORO])
+        self.catalog.store_cards('556901', [self.BASE])
+        found, missing = self.lookup.lookup(['OP01-025', 'OP01-006'])
+        self.assertEqual([(series, card.card_id) for _, series, card in found],
+                         [('556101', 'OP01-025'), ('556901', 'OP01-006')])
+        self.assertEqual(missing, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,204 @@
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Tuple
+import threading
+import time
+import unittest
+
+
+class Metric:
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{self._escape(value)}"' for name, value in pairs) + "}"
+
+    @staticmethod
+    def _escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.samples()
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{self._format_labels(key)} {value}"
+
+
+class Histogram(Metric):
+
+    kind = 'histogram'
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, *args, buckets=DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0, 0.0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        series = self._series.get(self._key(labels))
+        return series[1] if series else 0
+
+    def samples(self):
+        with self._lock:
+            series = sorted((key, ([*value[0]], value[1], value[2])) for key, value in self._series.items())
+        for key, (bucket_counts, count, total) in series:
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                yield f"{self.name}_bucket{self._format_labels(key, [('le', repr(float(bound)))])} {bucket_count}"
+            yield f"{self.name}_bucket{self._format_labels(key, [('le', '+Inf')])} {count}"
+            yield f"{self.name}_count{self._format_labels(key)} {count}"
+            yield f"{self.name}_sum{self._format_labels(key)} {total}"
+
+
+class Registry:
+    """
+    Collection of metrics rendered in the Prometheus text exposition format.
+    Values are per process; with several gunicorn workers each reports its own.
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+UPSTREAM_FETCH_SECONDS = Histogram(
+    'optcg_upstream_fetch_seconds', 'Time spent fetching a page from the card site.', ['page'])
+UPSTREAM_BYTES = Counter(
+    'optcg_upstream_bytes_total', 'Bytes of page content received from the card site.', ['page'])
+UPSTREAM_CACHE = Counter(
+    'optcg_upstream_cache_total', 'Upstream page requests answered from the requests cache or not.', ['result'])
+UPSTREAM_RETRIES = Counter(
+    'optcg_upstream_retries_total', 'Upstream requests retried, by status code or error.', ['reason'])
+HTML_PARSE_SECONDS = Histogram(
+    'optcg_html_parse_seconds', 'Time spent building the HTML tree of a page.', ['page'])
+CARD_EXTRACT_SECONDS = Histogram(
+    'optcg_card_extract_seconds', 'Time spent extracting all cards from a parsed cardlist page.')
+CARDS_PARSED = Counter(
+    'optcg_cards_parsed_total', 'Cards successfully extracted from cardlist pages.')
+CARD_PARSE_FAILURES = Counter(
+    'optcg_card_parse_failures_total', 'Card elements that could not be turned into a Card.')
+FORMAT_SECONDS = Histogram(
+    'optcg_format_seconds', 'Time spent formatting output.', ['formatter', 'format'])
+
+
+def record_response(page, resp, size=None):
+    """
+    Count the size and cache status of an upstream response. Streamed responses pass the
+    `size` they read, so their content is not loaded again.
+    """
+    UPSTREAM_BYTES.inc(len(resp.content) if size is None else size, page=page)
+    UPSTREAM_CACHE.inc(result='hit' if getattr(resp, 'from_cache', False) else 'miss')
+
+
+def timed_iter(chunks: Iterable[str], histogram: Histogram, **labels) -> Iterator[str]:
+    """
+    Pass chunks through, observing the total time spent producing them once exhausted.
+    """
+    elapsed = 0.0
+    iterator = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            histogram.observe(elapsed + time.perf_counter() - start, **labels)
+            return
+        elapsed += time.perf_counter() - start
+        yield chunk
+
+
+class TestMetrics(unittest.TestCase):
+    def test_counter_render(self):
+        registry = Registry()
+        counter = Counter('test_total', 'A test counter.', ['result'], registry=registry)
+        counter.inc(result='hit')
+        counter.inc(2, result='hit')
+        self.assertEqual(counter.value(result='hit'), 3)
+        self.assertIn('test_total{result="hit"} 3', registry.render())
+        with self.assertRaises(ValueError):
+            counter.inc(kind='x')
+
+    def test_histogram_buckets(self):
+        registry = Registry()
+        histogram = Histogram('test_seconds', 'A test histogram.', buckets=(0.1, 1.0), registry=registry)
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        text = registry.render()
+        self.assertIn('test_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{le="1.0"} 2', text)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn('test_seconds_count 2', text)
+
+    def test_timed_iter(self):
+        histogram = Histogram('test_iter_seconds', 'A test histogram.', registry=Registry())
+        self.assertEqual("".join(timed_iter(iter(["a", "b"]), histogram)), "ab")
+        self.assertEqual(histogram.count(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,11 @@
 from dataclasses import dataclass, asdict, fields
-from typing import List
+from typing import List, Iterable, Iterator
 import re
 import unittest
 import logging
-import json
-import io
-import csv
+
+from . import streaming
+from . import metrics
 
 
 @dataclass
@@ -35,19 +35,34 @@ class Pack:
 class PackFormatter:
 
     @staticmethod
-    def to_text(packs: List[Pack]) -> str:
+    def iter_text(packs: Iterable[Pack]) -> Iterator[str]:
         logging.info("Formatting pack data to text...")
-        lines = [
+        return streaming.iter_joined(
             f"  {pack.code}, {pack.series}, {pack.name}, {pack.prefix}, "
             for pack in packs
-        ]
-        return "\n".join(lines)
+        )
 
     @staticmethod
-    def to_json(packs: List[Pack]) -> str:
+    def to_text(packs: List[Pack]) -> str:
+        return "".join(PackFormatter.iter_text(packs))
+
+    @staticmethod
+    def iter_json(packs: Iterable[Pack]) -> Iterator[str]:
         logging.info("Formatting pack data to JSON...")
-        data = [asdict(pack) for pack in packs]
-        return json.dumps(data, indent=2)
+        return streaming.iter_json_array(asdict(pack) for pack in packs)
+
+    @staticmethod
+    def to_json(packs: List[Pack]) -> str:
+        return "".join(PackFormatter.iter_json(packs))
+
+    @staticmethod
+    def iter_ndjson(packs: Iterable[Pack]) -> Iterator[str]:
+        logging.info("Formatting pack data to NDJSON...")
+        return streaming.iter_ndjson(asdict(pack) for pack in packs)
+
+    @staticmethod
+    def to_ndjson(packs: List[Pack]) -> str:
+        return "".join(PackFormatter.iter_ndjson(packs))
 
     @staticmethod
     def field_to_csv(val):
@@ -58,20 +73,17 @@ class PackFormatter:
         return "" if val is None else str(val)
 
     @staticmethod
-    def to_csv(cards: List[Pack]) -> str:
-
-        logging.info("Formatting card data to CSV...")
-        if not cards:
-            return ""
-
+    def iter_csv(packs: Iterable[Pack]) -> Iterator[str]:
+        logging.info("Formatting pack data to CSV...")
         header_row = [field.name for field in fields(Pack)]
-        output = io.StringIO()
-        writer = csv.writer(output, quoting=csv.QUOTE_ALL)
-        writer.writerow(header_row)
-        for card in cards:
-            row_values = [PackFormatter.field_to_csv(getattr(card, header)) for header in header_row]
-            writer.writerow(row_values)
-        return output.getvalue().strip()
+        return streaming.iter_csv(header_row, (
+            [PackFormatter.field_to_csv(getattr(pack, header)) for header in header_row]
+            for pack in packs
+        ))
+
+    @staticmethod
+    def to_csv(cards: List[Pack]) -> str:
+        return "".join(PackFormatter.iter_csv(cards))
 
     @classmethod
     def format(cls, packs: List[Pack], format_type: str) -> str:
@@ -79,16 +91,39 @@ class PackFormatter:
             'text': cls.to_text,
             'json': cls.to_json,
             'csv': cls.to_csv,
+            'ndjson': cls.to_ndjson,
         }
 
         formatter_func = formatters.get(format_type)
 
         if formatter_func:
-            return formatter_func(packs)
+            with metrics.FORMAT_SECONDS.time(formatter='pack', format=format_type):
+                return formatter_func(packs)
         else:
             raise ValueError(f"Invalid format type specified: '{format_type}'. "
                              f"Available formats: {list(formatters.keys())}")
 
+    @classmethod
+    def stream(cls, packs: Iterable[Pack], format_type: str) -> Iterator[str]:
+        """
+        Format packs incrementally, yielding text chunks that join to the output of `format`.
+        """
+        formatters = {
+            'text': cls.iter_text,
+            'json': cls.iter_json,
+            'csv': cls.iter_csv,
+            'ndjson': cls.iter_ndjson,
+        }
+
+        formatter_func = formatters.get(format_type)
+
+        if formatter_func:
+            return metrics.timed_iter(formatter_func(packs), metrics.FORMAT_SECONDS,
+                                      formatter='pack', format=format_type)
+        else:
+            raise ValueError(f"Invalid streaming format type specified: '{format_type}'. "
+                             f"Available formats: {list(formatters.keys())}")
+
 
 class TestPack(unittest.TestCase):
     def test_from_title_valid(self):
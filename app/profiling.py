@@ -0,0 +1,155 @@
+import cProfile
+import threading
+import tempfile
+import logging
+import heapq
+import time
+import re
+import os
+import unittest
+
+
+class SlowRequestProfiler:
+    """
+    Profiles requests with cProfile and keeps the profiles of the `keep` slowest ones in
+    `directory`, as `<milliseconds>ms-<name>-<timestamp>.prof` files that can be opened
+    with `python -m pstats` or snakeviz.
+
+    Only one request is profiled at a time; requests arriving while another is being
+    profiled run unprofiled. For streamed responses only the time until the response
+    object is returned is profiled, not the body being sent.
+    """
+
+    DEFAULT_KEEP = 10
+
+    def __init__(self, directory, keep=DEFAULT_KEEP):
+        self.directory = directory
+        self.keep = keep
+        self._slowest = []  # min-heap of (elapsed, path)
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        if not self._busy.acquire(blocking=False):
+            return False
+        profile = cProfile.Profile()
+        self._local.profile = profile
+        self._local.started = time.perf_counter()
+        profile.enable()
+        return True
+
+    def stop(self, name):
+        """
+        Stop profiling the current request. Returns the path of the saved profile, or
+        None when the request was not profiled or was not among the slowest.
+        """
+        profile = getattr(self._local, 'profile', None)
+        if profile is None:
+            return None
+        profile.disable()
+        elapsed = time.perf_counter() - self._local.started
+        self._local.profile = None
+        self._busy.release()
+        return self._record(profile, elapsed, name)
+
+    def _record(self, profile, elapsed, name):
+        with self._lock:
+            if len(self._slowest) >= self.keep and elapsed <= self._slowest[0][0]:
+                return None
+            safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_') or 'request'
+            path = os.path.join(self.directory, f"{elapsed * 1000:010.1f}ms-{safe_name}-{time.time_ns()}.prof")
+            profile.dump_stats(path)
+            heapq.heappush(self._slowest, (elapsed, path))
+            while len(self._slowest) > self.keep:
+                _, dropped = heapq.heappop(self._slowest)
+                try:
+                    os.remove(dropped)
+                except OSError as e:
+                    logging.debug(f"Could not remove profile {dropped}: {e}")
+        logging.info(f"Saved profile of {name} ({elapsed:.3f}s) to {path}")
+        return path
+
+    def install(self, app, skip=()):
+        """
+        Profile the requests of a Flask app, except those to the endpoints in `skip`. The
+        profile is stopped on teardown, which Flask runs even when a view raises.
+        """
+        from flask import request
+
+        @app.before_request
+        def start_profile():
+            if request.endpoint not in skip:
+                request.environ['optcg.profiled'] = self.start()
+
+        @app.teardown_request
+        def stop_profile(exc):
+            if request.environ.get('optcg.profiled'):
+                self.stop(request.full_path.rstrip('?'))
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        """
+        Build a profiler when OPTCG_PROFILE_DIR is set; OPTCG_PROFILE_KEEP sets how many
+        profiles are kept. Returns None when profiling is not enabled.
+        """
+        directory = environ.get('OPTCG_PROFILE_DIR')
+        if not directory:
+            return None
+        return cls(directory, keep=int(environ.get('OPTCG_PROFILE_KEEP', cls.DEFAULT_KEEP)))
+
+
+class TestSlowRequestProfiler(unittest.TestCase):
+    def test_keeps_only_slowest(self):
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = SlowRequestProfiler(directory, keep=2)
+            for delay in (0.03, 0.0, 0.02, 0.01):
+                self.assertTrue(profiler.start())
+                time.sleep(delay)
+                profiler.stop('/cards/569101')
+            kept = sorted(os.listdir(directory))
+            self.assertEqual(len(kept), 2)
+            self.assertTrue(all(name.endswith('.prof') and '-cards_569101-' in name for name in kept))
+            self.assertGreaterEqual(float(kept[0].split('ms')[0]), 20)
+
+    def test_one_request_at_a_time(self):
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = SlowRequestProfiler(directory)
+            self.assertTrue(profiler.start())
+            other = threading.Thread(target=lambda: setattr(self, 'started', profiler.start()))
+            other.start()
+            other.join()
+            self.assertFalse(self.started)
+            profiler.stop('/packs')
+            self.assertIsNone(profiler.stop('/packs'))
+
+    def test_released_when_view_raises(self):
+        from flask import Flask
+
+        app = Flask(__name__)
+
+        @app.route('/fail')
+        def fail():
+            raise RuntimeError('boom')
+
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = SlowRequestProfiler(directory)
+            profiler.install(app)
+            # Propagated exceptions (debug and testing mode) skip after_request handlers
+            app.testing = True
+            with self.assertRaises(RuntimeError):
+                app.test_client().get('/fail')
+            self.assertEqual(len(os.listdir(directory)), 1)
+            self.assertTrue(profiler.start())
+            profiler.stop('/packs')
+
+    def test_from_env(self):
+        self.assertIsNone(SlowRequestProfiler.from_env({}))
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = SlowRequestProfiler.from_env({'OPTCG_PROFILE_DIR': directory, 'OPTCG_PROFILE_KEEP': '3'})
+            self.assertEqual(profiler.keep, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,236 @@
+from dataclasses import dataclass, asdict, fields
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import tempfile
+import json
+import os
+import unittest
+
+from .card import Card, CardFormatter
+from .compact import CompactCard, Interner
+from .index_cache import CatalogIndexCache
+from . import streaming
+
+
+@dataclass(slots=True, frozen=True)
+class Printing:
+    """
+    One place a card is printed: the pack it is in and the card ID it has there.
+    """
+
+    series: str
+    card_id: str
+    rarity: Optional[Card.Rarity] = None
+    img_url: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class ReprintIndex:
+    """
+    Catalog-wide view that keeps every unique card once, keyed by card code, with the
+    packs and variant card IDs (`OP01-006_p1`) it is printed as.
+
+    The card kept for a code is its base printing (card ID equal to the code) from the
+    lowest series, or its first variant when no pack has the base printing. Cards are
+    pooled through `CompactCard.shared`, so indexes built side by side share one object
+    per card.
+    """
+
+    FORMATS = ('json', 'ndjson', 'csv', 'text')
+
+    def __init__(self):
+        self.cards: Dict[str, CompactCard] = {}
+        self.printings: Dict[str, List[Printing]] = {}
+        self.codes_by_id: Dict[str, str] = {}
+        self._ranks: Dict[str, Tuple[bool, str]] = {}
+
+    @staticmethod
+    def normalize(key) -> str:
+        return str(key).strip().upper()
+
+    def __len__(self):
+        return len(self.cards)
+
+    @property
+    def printing_count(self) -> int:
+        return sum(len(printings) for printings in self.printings.values())
+
+    def add(self, series, cards: Iterable[Card]):
+        """
+        Add the cards of one pack. Adding a pack again does not repeat its printings.
+        """
+        series = Interner.share_str(series)
+        for card in cards:
+            code = self.normalize(card.card_code or card.card_id)
+            printings = self.printings.setdefault(code, [])
+            if any(p.series == series and p.card_id == card.card_id for p in printings):
+                continue
+            printings.append(Printing(series, Interner.share_str(card.card_id), card.rarity, card.img_url))
+            self.codes_by_id[self.normalize(card.card_id)] = code
+            rank = (card.card_id != card.card_code, series)
+            if code not in self.cards or rank < self._ranks[code]:
+                self.cards[code] = CompactCard.shared(card)
+                self._ranks[code] = rank
+
+    @classmethod
+    def from_catalog(cls, catalog) -> "ReprintIndex":
+        index = cls()
+        for series, card in catalog.iter_cards():
+            index.add(series, [card])
+        return index
+
+    def updated(self, catalog, series_ids: Iterable[str]) -> "ReprintIndex":
+        """
+        A copy of this index with the packs `series_ids` reloaded from `catalog`. Every card
+        code printed in them before or now is dropped and added again from all its printings
+        in the catalog. This index is left as it is for readers still streaming it.
+        """
+        series_ids = set(series_ids)
+        index = type(self)()
+        index.cards = dict(self.cards)
+        index.printings = dict(self.printings)
+        index.codes_by_id = dict(self.codes_by_id)
+        index._ranks = dict(self._ranks)
+
+        codes = {card.card_code or card.card_id for series in series_ids for card in catalog.iter_query(pack=series)}
+        for code, printings in self.printings.items():
+            if any(printing.series in series_ids for printing in printings):
+                codes.add(self.cards[code].card_code or self.cards[code].card_id)
+        for code in codes:
+            normalized = self.normalize(code)
+            for printing in index.printings.pop(normalized, []):
+                if index.codes_by_id.get(self.normalize(printing.card_id)) == normalized:
+                    del index.codes_by_id[self.normalize(printing.card_id)]
+            index.cards.pop(normalized, None)
+            index._ranks.pop(normalized, None)
+        # Printings are re-added in catalog order, as a full build adds them
+        for series, card in catalog.iter_printings(codes):
+            index.add(series, [card])
+        return index
+
+    def printings_of(self, key) -> Optional[Tuple[Card, List[Printing]]]:
+        """
+        Return the unique card and all its printings for a card code or any of its card
+        IDs, or None when it is unknown.
+        """
+        normalized = self.normalize(key)
+        code = normalized if normalized in self.cards else self.codes_by_id.get(normalized)
+        if code is None:
+            return None
+        return self.cards[code].to_card(), sorted(self.printings[code], key=lambda p: (p.series, p.card_id))
+
+    def records(self) -> Iterator[dict]:
+        """
+        Yield one dict per unique card, ordered by card code: the card's fields plus its `printings`.
+        """
+        for code in sorted(self.cards):
+            card, printings = self.printings_of(code)
+            yield dict(asdict(card), printings=[printing.to_dict() for printing in printings])
+
+    def iter_text(self) -> Iterator[str]:
+        return streaming.iter_joined(
+            f"  {record['card_code']}, {record['name']}, {record['category']}, "
+            f"{len(record['printings'])} printing{'' if len(record['printings']) == 1 else 's'}: "
+            + ", ".join(f"{p['card_id']} ({p['series']})" for p in record['printings'])
+            for record in self.records()
+        )
+
+    def iter_csv(self) -> Iterator[str]:
+        header_row = [field.name for field in fields(Card)] + ['printings']
+        return streaming.iter_csv(header_row, (
+            [CardFormatter.field_to_csv(record[header]) for header in header_row[:-1]]
+            + [",".join(f"{p['series']}:{p['card_id']}" for p in record['printings'])]
+            for record in self.records()
+        ))
+
+    def stream(self, format_type: str) -> Iterator[str]:
+        """
+        Format the unique cards chunk by chunk; printings are a list in JSON and NDJSON,
+        and `series:card_id` pairs in CSV.
+        """
+        if format_type == 'json':
+            return streaming.iter_json_array(self.records())
+        if format_type == 'ndjson':
+            return streaming.iter_ndjson(self.records())
+        if format_type == 'csv':
+            return self.iter_csv()
+        if format_type == 'text':
+            return self.iter_text()
+        raise ValueError(f"Unique cards cannot be written as '{format_type}'; use one of {', '.join(self.FORMATS)}.")
+
+    def format(self, format_type: str) -> str:
+        return "".join(self.stream(format_type))
+
+
+class SharedReprintIndex(CatalogIndexCache):
+    """
+    Reprint index of a catalog kept in memory between requests, see `CatalogIndexCache`.
+    """
+
+    def build(self) -> ReprintIndex:
+        return ReprintIndex.from_catalog(self.catalog)
+
+    def update(self, index, series_ids):
+        return index.updated(self.catalog, series_ids)
+
+
+class TestReprintIndex(unittest.TestCase):
+    BASE = Card('OP01-006', 'OP01-006', Card.Rarity.UNCOMMON, Card.Category.CHARACTER, 'Otama', None,
+                [Card.Attribute.SPECIAL], '1', 'Red', None, cost='1', power='0', counter='2000')
+    VARIANT = Card('OP01-006_p1', 'OP01-006', Card.Rarity.UNCOMMON, Card.Category.CHARACTER, 'Otama', None,
+                   [Card.Attribute.SPECIAL], '1', 'Red', None, cost='1', power='0', counter='2000')
+    ZORO = Card('OP01-025', 'OP01-025', Card.Rarity.SUPER_RARE, Card.Category.CHARACTER, 'Roronoa Zoro', None,
+                [Card.Attribute.SLASH], '1', 'Red', None, cost='3', power='5000')
+
+    def setUp(self):
+        self.index = ReprintIndex()
+        self.index.add('569901', [self.VARIANT, self.BASE])
+        self.index.add('556101', [self.VARIANT, self.ZORO])
+        self.index.add('556101', [self.VARIANT])
+
+    def test_printings_of(self):
+        card, printings = self.index.printings_of('op01-006_p1')
+        self.assertEqual(card, self.BASE)
+        self.assertEqual([(p.series, p.card_id) for p in printings],
+                         [('556101', 'OP01-006_p1'), ('569901', 'OP01-006'), ('569901', 'OP01-006_p1')])
+        self.assertIsNone(self.index.printings_of('OP99-001'))
+        self.assertEqual((len(self.index), self.index.printing_count), (2, 4))
+
+    def test_cards_are_shared(self):
+        other = ReprintIndex()
+        other.add('556101', [self.BASE])
+        self.assertIs(other.cards['OP01-006'], self.index.cards['OP01-006'])
+
+    def test_formats(self):
+        records = json.loads(self.index.format('json'))
+        self.assertEqual([r['card_id'] for r in records], ['OP01-006', 'OP01-025'])
+        self.assertEqual(records[1]['printings'], [Printing('556101', 'OP01-025', Card.Rarity.SUPER_RARE).to_dict()])
+        self.assertEqual(self.index.format('csv').splitlines()[2].split('","')[-1], '556101:OP01-025"')
+        self.assertIn('3 printings', self.index.format('text'))
+        with self.assertRaises(ValueError):
+            self.index.format('img')
+
+    def test_from_catalog(self):
+        from .catalog import CardCatalog
+
+        with tempfile.TemporaryDirectory() as directory:
+            catalog = CardCatalog(os.path.join(directory, 'catalog.sqlite3'))
+            catalog.store_cards('556101', [self.VARIANT, self.ZORO])
+            catalog.store_cards('569901', [self.BASE])
+            shared = SharedReprintIndex(catalog, check_interval=0)
+            self.assertEqual(shared.get().printings_of('OP01-006')[0], self.BASE)
+            catalog.store_cards('569901', [self.BASE, self.VARIANT])
+            self.assertEqual(shared.get().printing_count, 4)
+            first = shared.get()
+            catalog.store_cards('569901', [self.VARIANT])
+            catalog.store_cards('569902', [self.ZORO])
+            updated = shared.get()
+            self.assertEqual(first.printing_count, 4)
+            self.assertEqual(updated.format('json'), ReprintIndex.from_catalog(catalog).format('json'))
+            # The base printing is gone, so the variant is the card kept for its code
+            self.assertEqual(updated.printings_of('OP01-006')[0], self.VARIANT)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Tuple
+import threading
+import hashlib
+import gzip
+import time
+import unittest
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+@dataclass
+class CachedResponse:
+
+    body: bytes
+    mimetype: str
+    etag: str
+    created: float
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    def etag_for(self, encoding=None):
+        """
+        Strong ETag of the representation sent with the given Content-Encoding.
+        """
+        return f"{self.etag}-{encoding}" if encoding else self.etag
+
+    def etags(self):
+        return [self.etag_for(None)] + [self.etag_for(encoding) for encoding in self.encoded]
+
+
+class ResponseCache:
+    """
+    In-process LRU cache of serialized API responses with a time-to-live.
+
+    Bodies are compressed once when they are stored (gzip, and brotli when the module is
+    installed), so serving a cached response never compresses anything.
+    """
+
+    DEFAULT_MAX_ENTRIES = 256
+    DEFAULT_TTL = 300
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple, CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def build_entry(body: bytes, mimetype: str, headers: Optional[Dict[str, str]] = None) -> CachedResponse:
+        encoded = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            encoded['br'] = brotli.compress(body)
+        return CachedResponse(
+            body=body,
+            mimetype=mimetype,
+            etag=hashlib.sha256(body).hexdigest()[:32],
+            created=time.monotonic(),
+            encoded=encoded,
+            headers=headers or {},
+        )
+
+    def get(self, key) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry.created > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body: bytes, mimetype: str, headers: Optional[Dict[str, str]] = None) -> CachedResponse:
+        entry = self.build_entry(body, mimetype, headers)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def get_or_create(self, key, build: Callable[[], Tuple[bytes, str]]) -> CachedResponse:
+        """
+        Return the cached entry for `key`, calling `build()` for `(body, mimetype)` or
+        `(body, mimetype, headers)` on a miss.
+        """
+        entry = self.get(key)
+        if entry is None:
+            entry = self.put(key, *build())
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = ResponseCache(max_entries=2)
+        cache.put('a', b'1', 'text/plain')
+        cache.put('b', b'2', 'text/plain')
+        cache.get('a')
+        cache.put('c', b'3', 'text/plain')
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+
+    def test_ttl_expiry(self):
+        cache = ResponseCache(ttl=0)
+        cache.put('a', b'1', 'text/plain')
+        time.sleep(0.001)
+        self.assertIsNone(cache.get('a'))
+
+    def test_precompressed_body_and_etag(self):
+        entry = ResponseCache().get_or_create('a', lambda: (b'hello' * 100, 'text/plain'))
+        self.assertEqual(gzip.decompress(entry.encoded['gzip']), b'hello' * 100)
+        self.assertEqual(entry.etag, ResponseCache.build_entry(b'hello' * 100, 'text/plain').etag)
+        self.assertIn(entry.etag_for('gzip'), entry.etags())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,33 +1,122 @@
-from lxml import html
-import requests_cache
 from collections import deque
+from contextlib import nullcontext
+from dataclasses import asdict, replace
+import threading
 import logging
 import argparse
+import json
+import atexit
+import time
 import os
 
 from .pack import Pack, PackFormatter
-from .card import Card, CardFormatter
+from .card import Card, CardFormatter, CardStreamParser
+from .concurrency import HostRateLimiter, OrderedFetcher, ParsePipeline
+from .downloader import ImageDownloader
+from .catalog import CardCatalog, DEFAULT_CATALOG_PATH
+from .search import SearchIndex
+from .compact import CompactCard
+from .reprints import ReprintIndex
+from .selection import CardSelection
+from .incremental import IncrementalFetcher, IncrementalReport, SeriesStateStore
+from .archive import ArchiveFile, export_archive
+from .fetch_cache import CacheConfig, DEFAULT_CACHE_PATH
+from . import metrics
 
-__is_debug__ = False  # set --debug via command line argument
+# lxml, requests and Pillow are imported where they are first needed, so that --help and
+# commands answered from the catalog start without loading them.
+
+# The card site; OPTCG_BASE_URL or --base-url point the scraper elsewhere, e.g. at app.fake_upstream.
+DEFAULT_BASE_URL = "https://asia-en.onepiece-cardgame.com"
 
 
 class OptcgScraper:
+    """
+    Client for the card site. Scrapers are cheap to create around an existing session;
+    `shared()` returns the process-wide scraper whose pooled session is reused across
+    API requests, and `configured()` derives a per-request scraper from it.
+    """
+
+    DEFAULT_POOL_SIZE = 16
+    STREAM_CHUNK_SIZE = 64 * 1024
+
+    _shared = None
+    _shared_pid = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, rate_limit=None, session=None, debug=False, cache=None, limit=None, base_url=None):
+        from .upstream import AdaptiveLimit, UpstreamClient
+
+        self.session = session or self.create_session(cache=cache)
+        self.base_url = (base_url or os.environ.get('OPTCG_BASE_URL') or DEFAULT_BASE_URL).rstrip('/')
+        self.rate_limiter = HostRateLimiter(rate_limit)
+        self.client = UpstreamClient(self.session, rate_limiter=self.rate_limiter,
+                                     limit=limit or AdaptiveLimit(maximum=self.DEFAULT_POOL_SIZE))
+        self.debug = debug
+
+    @classmethod
+    def create_session(cls, pool_size=DEFAULT_POOL_SIZE, cache: CacheConfig = None):
+        from requests.adapters import HTTPAdapter
+
+        session = (cache or CacheConfig()).create_session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @classmethod
+    def shared(cls) -> "OptcgScraper":
+        """
+        Scraper shared by all threads of this process, created on first use. A process
+        forked after it was created (e.g. a gunicorn worker with --preload) gets its own,
+        so pooled connections are never shared across processes.
+        """
+        with cls._shared_lock:
+            if cls._shared is None or cls._shared_pid != os.getpid():
+                from .upstream import AdaptiveLimit
+
+                pool_size = int(os.environ.get('OPTCG_HTTP_POOL_SIZE', cls.DEFAULT_POOL_SIZE))
+                cls._shared = cls(session=cls.create_session(pool_size, cache=CacheConfig.from_env(service=True)),
+                                  limit=AdaptiveLimit(maximum=pool_size))
+                cls._shared_pid = os.getpid()
+            return cls._shared
+
+    @classmethod
+    def close_shared(cls):
+        with cls._shared_lock:
+            if cls._shared is not None and cls._shared_pid == os.getpid():
+                cls._shared.close()
+            cls._shared = None
+            cls._shared_pid = None
+
+    def configured(self, rate_limit=None, debug=False) -> "OptcgScraper":
+        """
+        A scraper with its own request settings that reuses this scraper's session and
+        adaptive concurrency limit, so pushback seen by one request slows down all of them.
+        """
+        return OptcgScraper(rate_limit=rate_limit, session=self.session, debug=debug, limit=self.client.limit,
+                            base_url=self.base_url)
 
-    def __init__(self):
-        self.session = requests_cache.CachedSession('optcg_scrape', expire_after=7200)
-        self.base_url = "https://asia-en.onepiece-cardgame.com"
+    def close(self):
+        self.session.close()
+
+    def dump_page(self, resp, file_path):
+        if self.debug and resp.status_code == 200:
+            with open(file_path, "w", encoding="utf-8") as f:
+                f.write(resp.text)
+            logging.info(f"Content from {self.base_url} successfully dumped to {file_path}")
+
+    def fetch_packs(self, force_refresh=False):
+        from lxml import html
 
-    def fetch_packs(self):
         packs = deque()
         logging.info("Fetching packs from website...")
-        resp = self.session.get(self.base_url + "/cardlist")
-        tree = html.fromstring(resp.content)
-        if __is_debug__:
-            if resp.status_code == 200:
-                file_path = "/tmp/packs_data.txt"
-                with open(file_path, "w", encoding="utf-8") as f:
-                    f.write(resp.text)
-                logging.info(f"Content from {self.base_url} successfully dumped to {file_path}")
+        with metrics.UPSTREAM_FETCH_SECONDS.time(page='packs'):
+            resp = self.client.get(self.base_url + "/cardlist", force_refresh=force_refresh)
+        metrics.record_response('packs', resp)
+        with metrics.HTML_PARSE_SECONDS.time(page='packs'):
+            tree = html.fromstring(resp.content)
+        self.dump_page(resp, "/tmp/packs_data.txt")
 
         elements = tree.xpath('//*[@id="series" and @name="series"]/option')
         for element in elements:
@@ -40,34 +129,110 @@ class OptcgScraper:
                 continue
         return packs
 
-    def fetch_cards(self, series_id=None):
+    def fetch_cards_page(self, series_id, headers=None, force_refresh=False, stream=False):
+        """
+        Request the cardlist page of a series and return the response without parsing it.
+        With `stream`, the body is left unread for the caller to consume in chunks.
+        Raises UpstreamError when the card site keeps failing, see `UpstreamClient`.
+        """
+        params = {'series': series_id} if series_id else {}
+        logging.info(f"Fetching cards for series_id={series_id} from website...")
+        with metrics.UPSTREAM_FETCH_SECONDS.time(page='cards'):
+            resp = self.client.get(self.base_url + "/cardlist/", params=params, headers=headers,
+                                   force_refresh=force_refresh, stream=stream)
+        if not stream:
+            metrics.record_response('cards', resp)
+            self.dump_page(resp, "/tmp/cards_data.txt")
+        return resp
+
+    @staticmethod
+    def parse_cards(content):
+        from lxml import html
+
         cards = deque()
+        with metrics.HTML_PARSE_SECONDS.time(page='cards'):
+            tree = html.fromstring(content)
+        with metrics.CARD_EXTRACT_SECONDS.time():
+            elements = tree.xpath('//*[@id="cardlist"]/main/article/div/div[@class="resultCol"]//dl[@class="modalCol"]')
+            base_url = Card.page_base_url(tree) if elements else None
+            for element in elements:
+                try:
+                    card = Card.from_xpathtree(element, base_url=base_url)
+                    cards.append(card)
+                except ValueError as e:
+                    metrics.CARD_PARSE_FAILURES.inc()
+                    logging.debug(f"Error processing card title '{element.get('id')}': {e}")
+                    logging.debug("Card info" + html.tostring(element, encoding='unicode'))
+                    continue
+        metrics.CARDS_PARSED.inc(len(cards))
+        return cards
+
+    def iter_parse_cards(self, chunks):
+        """
+        Parse a cardlist page arriving in `chunks`, yielding every Card as soon as its
+        element is complete; see `CardStreamParser`.
+        """
+        parser = CardStreamParser()
+        parse_seconds = 0.0
+        for chunk in chunks:
+            start = time.perf_counter()
+            cards = parser.feed(chunk)
+            parse_seconds += time.perf_counter() - start
+            metrics.CARDS_PARSED.inc(len(cards))
+            yield from cards
+        start = time.perf_counter()
+        cards = parser.close()
+        # Parsing and card extraction interleave here, so both are counted as parse time
+        metrics.HTML_PARSE_SECONDS.observe(parse_seconds + time.perf_counter() - start, page='cards')
+        metrics.CARDS_PARSED.inc(len(cards))
+        yield from cards
+
+    def iter_cards(self, series_id=None):
+        """
+        Like `fetch_cards`, but return a generator that parses the page while it downloads.
+        Only one card's elements are held at a time, and the first card is yielded before
+        the download finishes when the page is not already cached.
+        """
         if not series_id:
             logging.error("No pack name provided, aborting.")
-            return cards
+            return
+
+        resp = self.fetch_cards_page(series_id, stream=True)
+        size = 0
+
+        def counted(chunks):
+            nonlocal size
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+
+        try:
+            yield from self.iter_parse_cards(counted(resp.iter_content(self.STREAM_CHUNK_SIZE)))
+        finally:
+            resp.close()
+            metrics.record_response('cards', resp, size=size)
+
+    def fetch_cards(self, series_id=None):
+        if not series_id:
+            logging.error("No pack name provided, aborting.")
+            return deque()
+
+        resp = self.fetch_cards_page(series_id)
+        return self.parse_cards(resp.content)
 
-        params = {'series': series_id} if series_id else {}
-        logging.info("Fetching cards for series_id={series_id} from website...")
-        resp = self.session.get(self.base_url + "/cardlist/", params=params)
-        tree = html.fromstring(resp.content)
-
-        if __is_debug__:
-            if resp.status_code == 200:
-                file_path = "/tmp/cards_data.txt"
-                with open(file_path, "w", encoding="utf-8") as f:
-                    f.write(resp.text)
-                logging.info(f"Content from {self.base_url} successfully dumped to {file_path}")
-
-        elements = tree.xpath('//*[@id="cardlist"]/main/article/div/div[@class="resultCol"]//dl[@class="modalCol"]')
-        for element in elements:
-            try:
-                card = Card.from_xpathtree(element)
-                cards.append(card)
-            except ValueError as e:
-                logging.debug(f"Error processing card title '{element.id}': {e}")
-                logging.debug("Card info" + html.tostring(element, encoding='unicode'))
-                continue
-        return cards
+
+def parse_cards_page(content):
+    """
+    Parse a cardlist page into a list of Cards; the entry point of parse worker processes.
+    """
+    return list(OptcgScraper.parse_cards(content))
+
+
+def non_negative_int(value) -> int:
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must not be negative, got {number}")
+    return number
 
 
 def parse_args():
@@ -80,7 +245,7 @@ def parse_args():
     parent_parser = argparse.ArgumentParser(add_help=False)
     parent_parser.add_argument(
         '-f', '--format',
-        choices=['json', 'csv', 'text', 'img'],
+        choices=[*CardFormatter.STREAM_FORMATS, 'img'],
         default='text',
         help='Output format for the results (default: text).')
 
@@ -94,6 +259,92 @@ def parse_args():
         action='store_true',
         help='Enable debug output.')
 
+    parent_parser.add_argument(
+        '--download-workers',
+        type=int,
+        default=ImageDownloader.DEFAULT_WORKERS,
+        help=f'Number of concurrent image downloads for the img format (default: {ImageDownloader.DEFAULT_WORKERS}).')
+
+    parent_parser.add_argument(
+        '--thumb-sizes',
+        type=str,
+        default=None,
+        help="For the img format, comma separated widths of image variants to make, 'full' for the original size "
+             "(e.g. 200,400,full).")
+
+    parent_parser.add_argument(
+        '--image-formats',
+        type=str,
+        default=None,
+        help='For the img format, comma separated formats of image variants to make: webp, avif, jpeg, png '
+             '(default: webp when --thumb-sizes is given).')
+
+    parent_parser.add_argument(
+        '--image-workers',
+        type=int,
+        default=None,
+        help='Number of processes making image variants (default: number of CPUs).')
+
+    parent_parser.add_argument(
+        '--catalog',
+        type=str,
+        default=DEFAULT_CATALOG_PATH,
+        help=f'SQLite catalog that scraped packs and cards are stored in (default: {DEFAULT_CATALOG_PATH}).')
+
+    parent_parser.add_argument(
+        '--base-url',
+        type=str,
+        default=None,
+        help=f'Base URL of the card site (default: {DEFAULT_BASE_URL}, or $OPTCG_BASE_URL).')
+
+    parent_parser.add_argument(
+        '--offline',
+        action='store_true',
+        help="Answer 'packs' and 'cards' from the catalog without contacting the card site.")
+
+    parent_parser.add_argument(
+        '--cache-backend',
+        choices=CacheConfig.BACKENDS,
+        default=None,
+        help='requests cache backend for pages of the card site (default: sqlite, or $OPTCG_CACHE_BACKEND).')
+
+    parent_parser.add_argument(
+        '--cache-path',
+        type=str,
+        default=None,
+        help=f'Location of the requests cache (default: {DEFAULT_CACHE_PATH}, or $OPTCG_CACHE_PATH).')
+
+    parent_parser.add_argument(
+        '--cache-packs-ttl',
+        type=int,
+        default=None,
+        help='Seconds the cached pack list stays fresh (default: 7200).')
+
+    parent_parser.add_argument(
+        '--cache-cards-ttl',
+        type=int,
+        default=None,
+        help='Seconds cached cardlist pages stay fresh (default: 7200).')
+
+    parent_parser.add_argument(
+        '--cache-stale-ttl',
+        type=int,
+        default=None,
+        help='Seconds after expiry during which a stale page is used while it is refreshed in the background, '
+             '0 to always wait for the card site (default: 0; the web service uses 86400).')
+
+    parent_parser.add_argument(
+        '--cache-uncompressed',
+        action='store_true',
+        help='Store cached pages without compression.')
+
+    parent_parser.add_argument(
+        '-o', '--output',
+        type=str,
+        default=None,
+        help='Stream the formatted output (or the summary of commands that write files) into this file '
+             'instead of printing it.')
+
     parser = argparse.ArgumentParser(description="Fetch OPTCG card details from the website.")
     subparsers = parser.add_subparsers(
         dest='command',
@@ -109,6 +360,37 @@ def parse_args():
         default=None,
         help='Use "all" to fetch all cards from every pack.'
     )
+    packs_parser.add_argument(
+        '-j', '--max-workers',
+        type=int,
+        default=OrderedFetcher.DEFAULT_WORKERS,
+        help=f'Maximum number of packs fetched concurrently with "all" (default: {OrderedFetcher.DEFAULT_WORKERS}).')
+    packs_parser.add_argument(
+        '--parse-workers',
+        type=non_negative_int,
+        default=0,
+        help='With "all", parse pages on this many processes while the -j fetch threads keep downloading; '
+             '0 parses in the fetch threads (default: 0).')
+    packs_parser.add_argument(
+        '--rate-limit',
+        type=float,
+        default=None,
+        help='Maximum requests per second sent to the card site (default: unlimited).')
+    packs_parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='With "all", only parse and rewrite packs whose page changed since the last run.')
+    packs_parser.add_argument(
+        '--archive',
+        type=str,
+        default=None,
+        help='With "all", write every pack into this single archive instead of one file per pack. '
+             'The extension picks the archive type: .tar.gz, .zip or .ndjson.gz.')
+    packs_parser.add_argument(
+        '--unique',
+        action='store_true',
+        help='With "all", also write unique.<format> with every card once and the packs and card IDs '
+             'it is printed as.')
 
     cards_parser = subparsers.add_parser('cards', help='List all cards available cards.', parents=[parent_parser])
     cards_parser.add_argument(
@@ -116,73 +398,484 @@ def parse_args():
         type=str,
         help='Series identifier for pack (e.g. "556101" for OP-01).')
 
+    query_parser = subparsers.add_parser(
+        'query', help='Query previously scraped cards from the local catalog.', parents=[parent_parser])
+    for name in CardCatalog.available_filters():
+        query_parser.add_argument(
+            f"--{name.replace('_', '-')}",
+            dest=name,
+            type=str,
+            default=None,
+            help=f'Only return cards matching {name}.')
+
+    search_parser = subparsers.add_parser(
+        'search', help='Search the effects, triggers, keywords and types of cards in the local catalog.',
+        parents=[parent_parser])
+    search_parser.add_argument(
+        'query',
+        type=str,
+        nargs='?',
+        default='',
+        help='Search text, e.g. \'[Blocker] "Straw Hat Crew" -trigger:draw\'. Terms are ANDed; '
+             'use OR between two terms to match either.')
+    search_parser.add_argument(
+        '-n', '--limit',
+        type=int,
+        default=None,
+        help='Return at most this many cards, best matches first.')
+    for name in CardCatalog.available_filters():
+        search_parser.add_argument(
+            f"--{name.replace('_', '-')}",
+            dest=name,
+            type=str,
+            default=None,
+            help=f'Only return cards matching {name}.')
+
+    subparsers.add_parser(
+        'unique', help='List every card of the local catalog once, with the packs and card IDs it is printed as.',
+        parents=[parent_parser])
+
+    printings_parser = subparsers.add_parser(
+        'printings', help='List the printings of a card in the local catalog.', parents=[parent_parser])
+    printings_parser.add_argument(
+        'card',
+        type=str,
+        help='Card code or card ID, e.g. "OP01-006" or "OP01-006_p1".')
+
+    warm_parser = subparsers.add_parser(
+        'warm', help='Refresh the requests cache with the pack list and every cardlist page.', parents=[parent_parser])
+    warm_parser.add_argument(
+        '-j', '--max-workers',
+        type=int,
+        default=OrderedFetcher.DEFAULT_WORKERS,
+        help=f'Maximum number of pages fetched concurrently (default: {OrderedFetcher.DEFAULT_WORKERS}).')
+    warm_parser.add_argument(
+        '--rate-limit',
+        type=float,
+        default=None,
+        help='Maximum requests per second sent to the card site (default: unlimited).')
+
+    export_parser = subparsers.add_parser(
+        'export', help='Export the local catalog into a single archive.', parents=[parent_parser])
+    export_parser.add_argument(
+        'archive',
+        type=str,
+        help='Archive to write; the extension picks the archive type: .tar.gz, .zip or .ndjson.gz.')
+
     args = parser.parse_args()
     return args
 
 
-def run_scraper(args):
+class ScrapeProgress:
     """
-    Main logic for the scraper, callable from other scripts.
+    Receives progress events from `scrape_all_packs`. Events for different packs may
+    arrive from different threads. The default implementation ignores them.
+    """
+
+    def packs_found(self, packs):
+        pass
+
+    def pack_started(self, pack):
+        pass
+
+    def pack_done(self, pack, card_count, bytes_written):
+        pass
+
+    def pack_failed(self, pack, error):
+        pass
+
+    def pack_unchanged(self, pack):
+        pass
+
+
+def pack_output_path(pack, format_type, output_dir):
+    """
+    Path of the file `save_pack_cards` writes for a pack, or None for the 'img' format.
+    """
+    if format_type == 'img':
+        return None
+    return os.path.join(output_dir, f"{pack.code}.{format_type}")
+
+
+def save_pack_cards(pack, cards, format_type, output_dir, download_workers=ImageDownloader.DEFAULT_WORKERS,
+                    image_pipeline=None):
+    """
+    Write the cards of a single pack to `<output_dir>/<pack code>.<format>`,
+    or download their images when the format is 'img'.
+    Returns the number of bytes written, and raises IOError if the file cannot be written.
+    """
+    if not cards:
+        logging.warning(f"No cards found for pack {pack.code}. Skipping file creation.")
+        return 0
+    if format_type == 'img':
+        logging.info(CardFormatter.to_img(list(cards), max_workers=download_workers, pipeline=image_pipeline))
+        return 0
+    filepath = pack_output_path(pack, format_type, output_dir)
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.writelines(CardFormatter.stream(cards, format_type))
+    logging.info(f"Successfully saved cards to {filepath}")
+    return os.path.getsize(filepath)
+
+
+def save_unique_cards(index, format_type, output_dir):
+    """
+    Write every unique card of `index` to `<output_dir>/unique.<format>` and return its path.
+    """
+    filepath = os.path.join(output_dir, f"unique.{format_type}")
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.writelines(index.stream(format_type))
+    logging.info(f"Saved {len(index)} unique cards of {index.printing_count} printings to {filepath}")
+    return filepath
+
+
+def scrape_all_packs(scraper, catalog, args, progress=None):
+    """
+    Fetch the cards of every available pack, store them in the catalog and write one
+    output file per pack, or with `args.archive` a single archive that is compressed as
+    packs arrive and moved into place only once complete. With `args.parse_workers`,
+    pages are parsed on a process pool while the fetch threads keep downloading, see
+    `ParsePipeline`. With `args.unique`, the cards are also collected into a
+    `ReprintIndex` and written once per card code. Returns the confirmation message.
+    """
+    progress = progress or ScrapeProgress()
+    logging.info("Fetching all available pack metadata...")
+    available_packs = scraper.fetch_packs()
+    catalog.store_packs(available_packs)
+
+    archive_path = getattr(args, 'archive', None)
+    if archive_path and args.format == 'img':
+        raise ValueError("Images cannot be written to an archive; use another format with --archive.")
+    unique = ReprintIndex() if getattr(args, 'unique', False) else None
+    if unique is not None and args.format not in ReprintIndex.FORMATS:
+        raise ValueError(f"--unique cannot be combined with '{args.format}'; use one of {', '.join(ReprintIndex.FORMATS)}.")
+
+    image_pipeline = None
+    if args.format == 'img':
+        from .images import ImagePipeline
+
+        output_dir = CardFormatter.IMAGE_DIRECTORY
+        image_pipeline = ImagePipeline.from_args(args, output_dir)
+        logging.info(f"Image download directory is {output_dir}")
+    else:
+        output_dir = "/tmp/cards/"
+        os.makedirs(output_dir, exist_ok=True)
+        logging.info(f"Output directory is set to {output_dir}")
+
+    logging.info(f"Beginning to fetch cards for all {len(available_packs)} packs found...")
+    valid_packs = []
+    for pack in available_packs:
+        if not pack.series or not pack.code or pack.code == "None":
+            logging.warning(f"Skipping pack '{pack.name}' due to missing series ID or code.")
+            continue
+        valid_packs.append(pack)
+    progress.packs_found(valid_packs)
+
+    incremental = None
+    report = IncrementalReport()
+    failed = []
+    if getattr(args, 'incremental', False):
+        incremental = IncrementalFetcher(scraper, SeriesStateStore(catalog.path))
+
+    def fetch_pack(pack):
+        logging.info(f"Fetching cards for {pack.code} - {pack.name}...")
+        progress.pack_started(pack)
+        try:
+            if incremental:
+                output_path = None if archive_path else pack_output_path(pack, args.format, output_dir)
+                cards, state = incremental.fetch(pack, output_path)
+                return cards, state, None
+            return scraper.fetch_cards(pack.series), None, None
+        except Exception as e:
+            return None, None, e
+
+    def fetch_page(pack):
+        logging.info(f"Fetching cards for {pack.code} - {pack.name}...")
+        progress.pack_started(pack)
+        try:
+            if incremental:
+                output_path = None if archive_path else pack_output_path(pack, args.format, output_dir)
+                content, state = incremental.fetch_page(pack, output_path)
+                return content, (state, None)
+            return scraper.fetch_cards_page(pack.series).content, (None, None)
+        except Exception as e:
+            return None, (None, e)
+
+    def parsed_pages(pipeline):
+        for pack, (state, error), cards, parse_error in pipeline.run(valid_packs):
+            if cards is not None:
+                # Parse workers count into their own registries, so cards are counted here
+                metrics.CARDS_PARSED.inc(len(cards))
+            yield pack, (cards, state, error or parse_error)
+
+    max_workers = getattr(args, 'max_workers', OrderedFetcher.DEFAULT_WORKERS)
+    parse_workers = getattr(args, 'parse_workers', 0)
+    if parse_workers:
+        results = parsed_pages(ParsePipeline(fetch_page, parse_cards_page, fetch_workers=max_workers,
+                                             parse_workers=parse_workers))
+    else:
+        results = OrderedFetcher(fetch_pack, max_workers=max_workers).run(valid_packs)
+    # The image pipeline keeps its process pool across packs and saves its manifest once
+    with ArchiveFile(archive_path, args.format) if archive_path else nullcontext() as archive, \
+            image_pipeline or nullcontext():
+        for pack, (cards_from_pack, state, error) in results:
+            if error is not None:
+                logging.error(f"Failed to fetch cards for pack {pack.code}: {error}")
+                progress.pack_failed(pack, error)
+                failed.append(pack.code)
+                continue
+            if incremental and cards_from_pack is None:
+                incremental.store.put(state)
+                report.unchanged.append(pack.code)
+                if archive:
+                    archive.add_pack(pack, catalog.iter_query(pack=pack.series))
+                if unique is not None:
+                    unique.add(pack.series, catalog.iter_query(pack=pack.series))
+                progress.pack_unchanged(pack)
+                continue
+            if cards_from_pack:
+                catalog.store_cards(pack.series, cards_from_pack)
+                if unique is not None:
+                    unique.add(pack.series, cards_from_pack)
+            try:
+                if archive:
+                    bytes_written = archive.add_pack(pack, cards_from_pack) if cards_from_pack else 0
+                else:
+                    bytes_written = save_pack_cards(
+                        pack, cards_from_pack, args.format, output_dir,
+                        download_workers=getattr(args, 'download_workers', ImageDownloader.DEFAULT_WORKERS),
+                        image_pipeline=image_pipeline)
+            except IOError as e:
+                if archive:
+                    # Leaving the block discards the archive, so the previous snapshot stays in place
+                    raise IOError(f"Failed to write cards of pack {pack.code} to {archive_path}: {e}") from e
+                logging.error(f"Failed to write cards of pack {pack.code}: {e}")
+                progress.pack_failed(pack, e)
+                failed.append(pack.code)
+                continue
+            if incremental and cards_from_pack:
+                incremental.store.put(state)
+                report.changed.append(pack.code)
+            elif incremental:
+                # A page without cards is more likely broken than empty; its state is not saved
+                # so that the next run fetches and parses it again
+                logging.warning(f"Pack {pack.code} changed upstream, but no cards were found on its page.")
+                report.empty.append(pack.code)
+            progress.pack_done(pack, len(cards_from_pack), bytes_written)
+        if archive:
+            manifest = archive.commit()
+
+    if archive_path:
+        message = (f"Processing complete. Archive saved to {archive_path} with {manifest['total_cards']} cards "
+                   f"from {len(manifest['packs'])} packs")
+    else:
+        message = f"Processing complete. Files saved in {output_dir}"
+    if unique is not None:
+        unique_path = save_unique_cards(unique, args.format, output_dir)
+        message = (f"{message}. {len(unique)} unique cards of {unique.printing_count} printings "
+                   f"saved to {unique_path}")
+    if incremental:
+        message = f"{message}. {report}"
+    if failed:
+        message = f"{message.rstrip('.')}. Failed packs: {', '.join(failed)}"
+    return message
+
+
+def warm_cache(scraper, args):
+    """
+    Fetch the pack list and every pack's cardlist page past the cache, so that later
+    requests are answered from fresh cache entries. Returns a summary message.
+    """
+    start = time.monotonic()
+    packs = [pack for pack in scraper.fetch_packs(force_refresh=True) if pack.series]
+    pages, size, failed = 1, 0, []
+
+    def fetch_page(pack):
+        try:
+            resp = scraper.fetch_cards_page(pack.series, force_refresh=True)
+            resp.raise_for_status()
+            return len(resp.content), None
+        except Exception as e:
+            return 0, e
+
+    fetcher = OrderedFetcher(fetch_page, max_workers=getattr(args, 'max_workers', OrderedFetcher.DEFAULT_WORKERS))
+    for pack, (page_size, error) in fetcher.run(packs):
+        if error is not None:
+            logging.error(f"Failed to warm cardlist page of pack {pack.code}: {error}")
+            failed.append(pack.code)
+            continue
+        pages += 1
+        size += page_size
+
+    message = f"Warmed cache with {pages} pages ({size // 1024} KiB) in {time.monotonic() - start:.1f}s."
+    if failed:
+        message += " Failed: " + ", ".join(failed)
+    return message
+
+
+def answer_offline(catalog, args, stream):
+    """
+    Answer 'packs' and 'cards' from the catalog alone; no session or scraper is created.
+    Commands that need the card site raise ValueError.
+    """
+    if args.command == 'packs' and args.action is None:
+        packs = catalog.packs()
+        if not packs:
+            logging.warning(f"Catalog {catalog.path} has no packs; run 'packs' once without --offline.")
+        if stream:
+            return PackFormatter.stream(packs, args.format)
+        return PackFormatter.format(packs, args.format)
+
+    if args.command == 'cards' and args.format != 'img':
+        selection = getattr(args, 'selection', None) or CardSelection()
+        cards = catalog.iter_query(pack=args.series_id)
+        if stream:
+            return selection.stream(cards, args.format)
+        cards = list(cards)
+        if not cards:
+            logging.warning(f"Catalog {catalog.path} has no cards for series {args.series_id}.")
+        return selection.format(cards, args.format)
+
+    command = " ".join(filter(None, [args.command, getattr(args, 'action', None)]))
+    if args.format == 'img':
+        command += " -f img"
+    raise ValueError(f"'{command}' needs the card site and cannot run with --offline.")
+
+
+def answer_printings(index, args, stream):
+    """
+    Answer 'unique' with every card of `index` once, and 'printings' with the card and
+    printings of `args.card`. Unknown cards raise ValueError.
+    """
+    if args.command == 'unique':
+        return index.stream(args.format) if stream else index.format(args.format)
+
+    match = index.printings_of(args.card)
+    if match is None:
+        raise ValueError(f"Card '{args.card}' is not in the catalog.")
+    card, printings = match
+    if args.format in ('json', 'ndjson'):
+        record = dict(asdict(card), printings=[printing.to_dict() for printing in printings])
+        text = json.dumps(record, indent=2) if args.format == 'json' else json.dumps(record) + "\n"
+        return iter([text]) if stream else text
+    # Other formats list one card per printing
+    cards = [replace(card, card_id=p.card_id, rarity=p.rarity, img_url=p.img_url) for p in printings]
+    if stream:
+        return CardFormatter.stream(cards, args.format)
+    return CardFormatter.format(cards, args.format)
+
+
+def store_when_complete(catalog, series, cards):
+    """
+    Pass streamed cards through, storing them in the catalog once the whole pack was read.
+    The catalog replaces a pack's cards in one transaction, so the cards read are kept
+    until then, as compact records: memory grows with the pack, not with the page HTML.
     """
-    global __is_debug__
+    read = []
+    for card in cards:
+        read.append(CompactCard.from_card(card))
+        yield card
+    if read:
+        catalog.store_cards(series, [card.to_card() for card in read])
+
+
+def configure_logging(args):
     if args.debug:
-        __is_debug__ = True
         logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
     elif args.verbose:
         logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     else:
         logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
 
-    scraper = OptcgScraper()
+
+def run_scraper(args, progress=None, scraper=None):
+    """
+    Main logic for the scraper, callable from other scripts.
+    `progress` receives per-pack events for 'packs all', see `ScrapeProgress`.
+    With `args.stream` set, formatted output is returned as an iterator of text chunks
+    instead of a single string.
+    Long-running callers pass a `scraper` (usually `OptcgScraper.shared()`) whose session
+    is reused and configure logging themselves; otherwise logging is set up from `args`
+    and a scraper is created for this call.
+    """
+    if scraper is None:
+        configure_logging(args)
+
+    catalog = CardCatalog(getattr(args, 'catalog', DEFAULT_CATALOG_PATH))
+    stream = getattr(args, 'stream', False) and args.format != 'img'
+
+    if args.command == 'export':
+        manifest = export_archive(args.archive, catalog.iter_pack_cards(), args.format)
+        return (f"Exported {manifest['total_cards']} cards from {len(manifest['packs'])} packs "
+                f"to {args.archive}")
+
+    if args.command == 'query':
+        filters = {name: getattr(args, name, None) for name in CardCatalog.available_filters()}
+        if stream:
+            return CardFormatter.stream(catalog.iter_query(**filters), args.format)
+        return CardFormatter.format(catalog.query(**filters), args.format)
+
+    if args.command == 'search':
+        filters = CardCatalog.parse_filters({name: getattr(args, name, None) for name in CardCatalog.available_filters()})
+        results = SearchIndex.from_catalog(catalog).search(args.query, limit=args.limit, **filters)
+        cards = [card for _, card, _ in results]
+        if stream:
+            return CardFormatter.stream(cards, args.format)
+        return CardFormatter.format(cards, args.format)
+
+    if args.command in ('unique', 'printings'):
+        return answer_printings(ReprintIndex.from_catalog(catalog), args, stream)
+
+    if getattr(args, 'offline', False):
+        return answer_offline(catalog, args, stream)
+
+    rate_limit = getattr(args, 'rate_limit', None)
+    if scraper is None:
+        scraper = OptcgScraper(rate_limit=rate_limit, debug=args.debug, cache=CacheConfig.from_args(args),
+                               base_url=getattr(args, 'base_url', None))
+    else:
+        scraper = scraper.configured(rate_limit=rate_limit, debug=args.debug)
+
+    if args.command == 'warm':
+        return warm_cache(scraper, args)
 
     if args.command == 'packs':
         if args.action == 'all':
-            logging.info("Fetching all available pack metadata...")
-            available_packs = scraper.fetch_packs()
-
-            if args.format == 'img':
-                output_dir = "/tmp/downloaded_images"
-                logging.info(f"Image download directory is {output_dir}")
-            else:
-                output_dir = "/tmp/cards/"
-                os.makedirs(output_dir, exist_ok=True)
-                logging.info(f"Output directory is set to {output_dir}")
-
-            logging.info(f"Beginning to fetch cards for all {len(available_packs)} packs found...")
-            for pack in available_packs:
-                if not pack.series or not pack.code or pack.code == "None":
-                    logging.warning(f"Skipping pack '{pack.name}' due to missing series ID or code.")
-                    continue
-                logging.info(f"Fetching cards for {pack.code} - {pack.name}...")
-                cards_from_pack = scraper.fetch_cards(pack.series)
-                if not cards_from_pack:
-                    logging.warning(f"No cards found for pack {pack.code}. Skipping file creation.")
-                    continue
-                if args.format == 'img':
-                    CardFormatter.format(list(cards_from_pack), 'img')
-                else:
-                    formatted_cards = CardFormatter.format(list(cards_from_pack), args.format)
-                    filename = f"{pack.code}.{args.format}"
-                    filepath = os.path.join(output_dir, filename)
-                    try:
-                        with open(filepath, 'w', encoding='utf-8') as f:
-                            f.write(formatted_cards)
-                        logging.info(f"Successfully saved cards to {filepath}")
-                    except IOError as e:
-                        logging.error(f"Failed to write to file {filepath}: {e}")
-
-            return f"Processing complete. Files saved in {output_dir}"
+            return scrape_all_packs(scraper, catalog, args, progress=progress)
         else:
             packs = scraper.fetch_packs()
+            catalog.store_packs(packs)
+            if stream:
+                return PackFormatter.stream(packs, args.format)
             return PackFormatter.format(list(packs), args.format)
 
     elif args.command == 'cards':
+        selection = getattr(args, 'selection', None) or CardSelection()
+        if stream:
+            # Cards are formatted while the page is still downloading and parsing
+            return selection.stream(
+                store_when_complete(catalog, args.series_id, scraper.iter_cards(args.series_id)), args.format)
         cards = scraper.fetch_cards(args.series_id)
-        return CardFormatter.format(list(cards), args.format)
+        if cards:
+            catalog.store_cards(args.series_id, cards)
+        if args.format == 'img':
+            from .images import ImagePipeline
+
+            return CardFormatter.to_img(
+                selection.apply(cards), max_workers=getattr(args, 'download_workers', ImageDownloader.DEFAULT_WORKERS),
+                pipeline=ImagePipeline.from_args(args, CardFormatter.IMAGE_DIRECTORY))
+        return selection.format(cards, args.format)
+
+
+atexit.register(OptcgScraper.close_shared)
 
 
 if __name__ == "__main__":
     args = parse_args()
+    args.stream = args.output is not None
     result = run_scraper(args)
-    if result:
+    if args.output is not None:
+        # Commands that do not stream (e.g. 'packs all', images) return their summary as one string
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.writelines([result] if isinstance(result, str) else result)
+    elif result:
         print(result)
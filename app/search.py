@@ -0,0 +1,362 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+from html import unescape
+import tempfile
+import operator
+import shlex
+import math
+import os
+import re
+import unittest
+
+from .card import Card
+from .compact import CompactCard
+from .index_cache import CatalogIndexCache
+
+TAG_RE = re.compile(r'<[^>]+>')
+KEYWORD_RE = re.compile(r'\[([^\[\]]+)\]')
+WORD_RE = re.compile(r'[a-z0-9]+(?:[.\'][a-z0-9]+)*')
+TYPE_SEPARATOR_RE = re.compile(r'[/\n]')
+
+
+def normalize_text(fragment: Optional[str]) -> str:
+    """
+    Plain lowercase text of a scraped HTML fragment such as an effect or trigger.
+    """
+    if not fragment:
+        return ""
+    return " ".join(unescape(TAG_RE.sub(" ", fragment)).lower().split())
+
+
+def card_terms(card: Card) -> List[Tuple[str, str]]:
+    """
+    The `(field, term)` pairs a card is indexed under: words of its name, effect and
+    trigger, its [keyword] tags (e.g. 'blocker', 'on play') and its types.
+    """
+    terms = set()
+    for field, text in (('name', card.name), ('effect', card.effect), ('trigger', card.trigger)):
+        normalized = normalize_text(text)
+        terms.update((field, word) for word in WORD_RE.findall(normalized))
+        if field != 'name':
+            terms.update(('keyword', tag.strip()) for tag in KEYWORD_RE.findall(normalized))
+    for type_name in TYPE_SEPARATOR_RE.split(card.types or ""):
+        type_name = " ".join(type_name.lower().split())
+        if type_name:
+            terms.add(('type', type_name))
+            terms.update(('type', word) for word in WORD_RE.findall(type_name) if word != type_name)
+    return sorted(terms)
+
+
+class SearchQuery:
+    """
+    Parsed search text. Terms are ANDed; `OR` between two terms matches either, and a
+    leading `-` excludes. `keyword:`, `type:`, `name:`, `effect:` and `trigger:` limit a
+    term to one field, `[Blocker]` is short for `keyword:blocker`, and quoted phrases
+    ("Straw Hat Crew") match a whole type or keyword.
+    """
+
+    FIELDS = ('keyword', 'type', 'name', 'effect', 'trigger')
+
+    def __init__(self, text):
+        self.groups: List[List[Tuple[Optional[str], str]]] = []
+        self.excluded: List[Tuple[Optional[str], str]] = []
+        join_next = False
+        try:
+            tokens = shlex.split(text or "")
+        except ValueError as e:
+            raise ValueError(f"Invalid search query: {e}")
+        for token in tokens:
+            if token == 'OR':
+                join_next = bool(self.groups)
+                continue
+            negate = token.startswith('-') and len(token) > 1
+            term = self.parse_term(token[1:] if negate else token)
+            if term is None:
+                continue
+            if negate:
+                self.excluded.append(term)
+            elif join_next:
+                self.groups[-1].append(term)
+            else:
+                self.groups.append([term])
+            join_next = False
+
+    @classmethod
+    def parse_term(cls, token) -> Optional[Tuple[Optional[str], str]]:
+        bracket = KEYWORD_RE.fullmatch(token)
+        if bracket:
+            return 'keyword', normalize_text(bracket.group(1))
+        field, sep, value = token.partition(':')
+        if sep and field.lower() in cls.FIELDS:
+            return field.lower(), " ".join(value.lower().split())
+        value = " ".join(token.lower().split())
+        if not value:
+            return None
+        # A quoted phrase matches a whole type or keyword; a single word matches any field
+        return (None, value) if ' ' not in value else ('phrase', value)
+
+
+class SearchIndex:
+    """
+    In-memory inverted index over the cards of a catalog.
+
+    Postings map a term to `{doc: weight}`, where the weight reflects the field the term
+    was found in; results are ranked by the sum of weight times inverse document frequency
+    of every matched term. Filters (color, cost ranges, category, ...) are checked on the
+    compact cards of the matching documents only.
+    """
+
+    FIELD_WEIGHTS = {'keyword': 3.0, 'type': 3.0, 'name': 2.0, 'trigger': 1.5, 'effect': 1.0}
+    RANGE_OPERATORS = {'': operator.eq, 'lt': operator.lt, 'lte': operator.le, 'gt': operator.gt, 'gte': operator.ge}
+
+    def __init__(self):
+        # Documents of reloaded packs are removed by setting them to None
+        self.cards: List[Optional[CompactCard]] = []
+        self.series: List[Optional[str]] = []
+        self.docs: Dict[str, List[int]] = {}
+        self.size = 0
+        self.pack_codes: Dict[str, str] = {}
+        self.postings: Dict[str, Dict[int, float]] = defaultdict(dict)
+        # Posting keys this index may modify; None when it shares no postings with another index
+        self._owned: Optional[set] = None
+
+    @staticmethod
+    def keys_for(field, term) -> List[str]:
+        keys = [f"{field}:{term}", f"*:{term}"]
+        if field in ('keyword', 'type'):
+            keys.append(f"phrase:{term}")
+        return keys
+
+    def _writable(self, key) -> Dict[int, float]:
+        postings = self.postings.get(key)
+        if postings is None:
+            postings = self.postings[key] = {}
+        elif self._owned is not None and key not in self._owned:
+            postings = self.postings[key] = dict(postings)
+        if self._owned is not None:
+            self._owned.add(key)
+        return postings
+
+    def add(self, series, card: Card, terms: Iterable[Tuple[str, str]] = None):
+        doc = len(self.cards)
+        self.cards.append(CompactCard.shared(card))
+        self.series.append(series)
+        self.docs.setdefault(series, []).append(doc)
+        self.size += 1
+        for field, term in (terms if terms is not None else card_terms(card)):
+            weight = self.FIELD_WEIGHTS.get(field, 1.0)
+            for key in self.keys_for(field, term):
+                postings = self._writable(key)
+                postings[doc] = max(postings.get(doc, 0.0), weight)
+
+    def remove_series(self, series):
+        """
+        Remove the cards of one pack. Their documents are left empty, not reused.
+        """
+        for doc in self.docs.pop(series, []):
+            for field, term in card_terms(self.cards[doc].to_card()):
+                for key in self.keys_for(field, term):
+                    postings = self._writable(key)
+                    postings.pop(doc, None)
+                    if not postings:
+                        del self.postings[key]
+            self.cards[doc] = None
+            self.series[doc] = None
+            self.size -= 1
+
+    @property
+    def fragmented(self) -> bool:
+        """
+        True when most documents are empty, so that rebuilding pays off.
+        """
+        return len(self.cards) > 2 * self.size + 1000
+
+    def updated(self, catalog, series_ids: Iterable[str]) -> "SearchIndex":
+        """
+        A copy of this index with the cards of `series_ids` reloaded from `catalog`. This
+        index is left as it is, so searches already running on it are not disturbed; the
+        copy shares every posting list it does not change.
+        """
+        index = type(self)()
+        index.cards = list(self.cards)
+        index.series = list(self.series)
+        index.docs = dict(self.docs)
+        index.size = self.size
+        index.postings = defaultdict(dict, self.postings)
+        index._owned = set()
+        index.pack_codes = {pack.series: pack.code for pack in catalog.packs()}
+        for series in series_ids:
+            index.remove_series(series)
+            terms = catalog.card_terms(series)
+            for card in catalog.iter_query(pack=series):
+                index.add(series, card, terms.get((series, card.card_id)))
+        return index
+
+    @classmethod
+    def from_catalog(cls, catalog) -> "SearchIndex":
+        index = cls()
+        index.pack_codes = {pack.series: pack.code for pack in catalog.packs()}
+        terms = catalog.card_terms()
+        for series, card in catalog.iter_cards():
+            index.add(series, card, terms.get((series, card.card_id)))
+        return index
+
+    def _postings(self, term) -> Tuple[Dict[int, float], float]:
+        """
+        The postings of a parsed term and its inverse document frequency.
+        """
+        field, value = term
+        postings = self.postings.get(f"{field or '*'}:{value}", {})
+        idf = math.log(1 + self.size / len(postings)) if postings else 0.0
+        return postings, idf
+
+    def matches_filters(self, doc, filters) -> bool:
+        card = self.cards[doc]
+        for key, value in filters.items():
+            if key == 'color':
+                if not card.colors or value not in card.colors:
+                    return False
+            elif key == 'pack':
+                series = self.series[doc]
+                if value != series and value != self.pack_codes.get(series):
+                    return False
+            elif key in ('card_id', 'card_code', 'category', 'rarity'):
+                if getattr(card, key) != value:
+                    return False
+            else:
+                field, _, op = key.partition('_')
+                number = getattr(card, field)
+                if not isinstance(number, int) or not self.RANGE_OPERATORS[op](number, value):
+                    return False
+        return True
+
+    def search(self, query: str, limit=None, **filters) -> List[Tuple[str, Card, float]]:
+        """
+        Return `(series, card, score)` for the cards matching `query` and every filter, best
+        first. `filters` are validated catalog filters, see `CardCatalog.parse_filters`.
+        An empty query matches every card.
+        """
+        parsed = SearchQuery(query)
+        groups = [[self._postings(term) for term in group] for group in parsed.groups]
+        # Intersect starting from the rarest group, so later groups only probe surviving documents
+        groups.sort(key=lambda group: sum(len(postings) for postings, _ in group))
+
+        scores: Optional[Dict[int, float]] = None
+        for group in groups:
+            if scores is None:
+                scores = {}
+                for postings, idf in group:
+                    for doc, weight in postings.items():
+                        scores[doc] = max(scores.get(doc, 0.0), weight * idf)
+            else:
+                matched = {}
+                for doc, score in scores.items():
+                    best = max((postings[doc] * idf for postings, idf in group if doc in postings), default=None)
+                    if best is not None:
+                        matched[doc] = score + best
+                scores = matched
+            if not scores:
+                return []
+        if scores is None:
+            scores = dict.fromkeys((doc for doc, card in enumerate(self.cards) if card is not None), 0.0)
+        for term in parsed.excluded:
+            for doc in self._postings(term)[0]:
+                scores.pop(doc, None)
+
+        # Ties keep catalog order: by series, then by position, as documents of a pack are added in order
+        ranked = sorted((doc for doc in scores if self.matches_filters(doc, filters)),
+                        key=lambda doc: (-scores[doc], self.series[doc], doc))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [(self.series[doc], self.cards[doc].to_card(), round(scores[doc], 4)) for doc in ranked]
+
+
+class SharedSearchIndex(CatalogIndexCache):
+    """
+    Search index of a catalog kept in memory between requests, see `CatalogIndexCache`.
+    It is rebuilt whole once updates left it fragmented.
+    """
+
+    def build(self) -> SearchIndex:
+        return SearchIndex.from_catalog(self.catalog)
+
+    def update(self, index, series_ids):
+        if index.fragmented:
+            return self.build()
+        return index.updated(self.catalog, series_ids)
+
+
+class TestSearchIndex(unittest.TestCase):
+    CARDS = [
+        Card('OP01-006', 'OP01-006', Card.Rarity.UNCOMMON, Card.Category.CHARACTER, 'Otama', None,
+             [Card.Attribute.SPECIAL], '1', 'Red', "[On Play] Give up to 1 of your opponent's Characters &minus;2000 power.",
+             cost='1', power='0', counter='2000', types='Land of Wano', trigger="Activate this card's<b>[On Play]</b> effect."),
+        Card('OP01-006_p1', 'OP01-006', Card.Rarity.UNCOMMON, Card.Category.CHARACTER, 'Otama', None,
+             [Card.Attribute.SPECIAL], '1', 'Red/Green', "[Blocker] [On Play] Give up to 1 Character &minus;2000 power.",
+             cost='1', power='0', counter='2000', types='Land of Wano/Straw Hat Crew'),
+        Card('OP01-025', 'OP01-025', Card.Rarity.SUPER_RARE, Card.Category.CHARACTER, 'Roronoa Zoro', None,
+             [Card.Attribute.SLASH], '1', 'Red', "[Rush] (This card can attack on the turn in which it is played.)",
+             cost='3', power='5000', counter=None, types='Supernovas/Straw Hat Crew'),
+        Card('OP01-029', 'OP01-029', Card.Rarity.COMMON, Card.Category.EVENT, 'Radical Beam!!', None,
+             None, '1', 'Red', "[Counter] Up to 1 of your Leader or Character cards gains +2000 power.",
+             cost='1', types='Straw Hat Crew', trigger='[Trigger] Up to 1 of your Leader gains +1000 power.'),
+    ]
+
+    def setUp(self):
+        self.index = SearchIndex()
+        for card in self.CARDS:
+            self.index.add('556101', card)
+
+    def ids(self, query, **filters):
+        return [card.card_id for _, card, _ in self.index.search(query, **filters)]
+
+    def test_terms(self):
+        terms = card_terms(self.CARDS[1])
+        self.assertIn(('keyword', 'blocker'), terms)
+        self.assertIn(('type', 'straw hat crew'), terms)
+        self.assertIn(('effect', '2000'), terms)
+
+    def test_keyword_and_type(self):
+        self.assertEqual(self.ids('[Blocker]'), ['OP01-006_p1'])
+        self.assertEqual(sorted(self.ids('"Straw Hat Crew"')), ['OP01-006_p1', 'OP01-025', 'OP01-029'])
+        self.assertEqual(self.ids('type:"straw hat crew" [Rush]'), ['OP01-025'])
+
+    def test_boolean_operators(self):
+        self.assertEqual(sorted(self.ids('[Blocker] OR [Rush]')), ['OP01-006_p1', 'OP01-025'])
+        self.assertEqual(self.ids('"on play" -blocker'), ['OP01-006'])
+        self.assertEqual(self.ids('trigger:trigger'), ['OP01-029'])
+
+    def test_filters_and_ranking(self):
+        self.assertEqual(self.ids('"Straw Hat Crew"', category='EVENT'), ['OP01-029'])
+        self.assertEqual(self.ids('', color='Green'), ['OP01-006_p1'])
+        self.assertEqual(self.ids('"straw hat crew"', cost_gte=3), ['OP01-025'])
+        # A name match outranks a mention in the effect text
+        self.assertEqual(self.ids('zoro OR power')[0], 'OP01-025')
+        self.assertEqual(self.index.search('[Blocker]')[0][1], self.CARDS[1])
+
+    def test_from_catalog(self):
+        from .catalog import CardCatalog
+        with tempfile.TemporaryDirectory() as directory:
+            catalog = CardCatalog(os.path.join(directory, 'catalog.sqlite3'))
+            shared = SharedSearchIndex(catalog, check_interval=0)
+            self.assertEqual(shared.get().search('[Rush]'), [])
+            catalog.store_cards('556101', self.CARDS)
+            results = shared.get().search('[Rush]', pack='556101')
+            self.assertEqual([card for _, card, _ in results], [self.CARDS[2]])
+
+            before = shared.get()
+            catalog.store_cards('556101', self.CARDS[:2])
+            catalog.store_cards('556102', self.CARDS[2:])
+            after = shared.get()
+            self.assertEqual(before.search('[Rush]')[0][0], '556101')
+            self.assertEqual([series for series, _, _ in after.search('[Rush]')], ['556102'])
+            # A reloaded index answers like one built from scratch
+            rebuilt = SearchIndex.from_catalog(catalog)
+            for query in ('', '"straw hat crew"', 'zoro OR power', '"on play" -blocker'):
+                self.assertEqual(after.search(query), rebuilt.search(query))
+            catalog.store_cards('556101', self.CARDS[:2])
+            self.assertIs(shared.get(), after)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional
+import unittest
+
+from .card import Card, CardFormatter
+from .catalog import CardCatalog, to_int
+from .search import SearchIndex
+
+
+class CardSelection:
+    """
+    Filters, pagination and field projection applied to the cards of a pack before they
+    are formatted, so dropped cards and fields are never serialized.
+
+    Filters are the catalog filters (`rarity=SR`, `category=LEADER`, `cost_lte=3`, ...)
+    except `pack`. `offset` and `limit` page through the matching cards in page order.
+    """
+
+    PARAMS = ('fields', 'limit', 'offset', 'compact')
+    MAX_LIMIT = 1000
+
+    def __init__(self, fields: Optional[List[str]] = None, filters: Optional[dict] = None,
+                 limit: Optional[int] = None, offset: int = 0, compact: bool = False):
+        self.fields = fields
+        self.filters = filters or {}
+        self.limit = limit
+        self.offset = offset
+        self.compact = compact
+        # Number of cards that matched the filters, set by `apply`
+        self.matched: Optional[int] = None
+
+    @classmethod
+    def from_params(cls, params) -> "CardSelection":
+        """
+        Build a selection from query parameters; parameters in `PARAMS` are read here and
+        the rest must be catalog filters. Raises ValueError on invalid values.
+        """
+        fields = None
+        if params.get('fields'):
+            fields = [name.strip() for name in params['fields'].split(',') if name.strip()]
+            unknown = [name for name in fields if name not in CardFormatter.FIELDS]
+            if unknown or not fields:
+                raise ValueError(f"Unknown card fields {unknown}. Available fields: {CardFormatter.FIELDS}")
+        try:
+            limit = int(params['limit']) if params.get('limit') else None
+            offset = int(params.get('offset') or 0)
+        except ValueError:
+            raise ValueError("'limit' and 'offset' must be integers.")
+        if offset < 0 or (limit is not None and not 1 <= limit <= cls.MAX_LIMIT):
+            raise ValueError(f"'offset' must not be negative and 'limit' must be between 1 and {cls.MAX_LIMIT}.")
+        filters = CardCatalog.parse_filters({k: v for k, v in params.items() if k not in cls.PARAMS})
+        if 'pack' in filters:
+            raise ValueError("The 'pack' filter does not apply to the cards of a single pack.")
+        compact = str(params.get('compact', '')).lower() in ('1', 'true', 'yes')
+        return cls(fields, filters, limit, offset, compact)
+
+    def is_default(self) -> bool:
+        return not (self.fields or self.filters or self.limit is not None or self.offset or self.compact)
+
+    def key(self) -> tuple:
+        """
+        Hashable form of the selection, for keying cached responses.
+        """
+        return (tuple(self.fields or ()), tuple(sorted(self.filters.items())), self.limit, self.offset, self.compact)
+
+    def matches(self, card: Card) -> bool:
+        for key, value in self.filters.items():
+            if key == 'color':
+                if value not in (card.color or '').split('/'):
+                    return False
+            elif key in ('card_id', 'card_code', 'category', 'rarity'):
+                if getattr(card, key) != value:
+                    return False
+            else:
+                field, _, op = key.partition('_')
+                number = to_int(getattr(card, field))
+                if number is None or not SearchIndex.RANGE_OPERATORS[op](number, value):
+                    return False
+        return True
+
+    def select(self, cards: Iterable[Card]) -> Iterator[Card]:
+        """
+        Lazily yield the requested page of matching cards.
+        """
+        matching = (card for card in cards if self.matches(card)) if self.filters else iter(cards)
+        stop = None if self.limit is None else self.offset + self.limit
+        return islice(matching, self.offset, stop)
+
+    def apply(self, cards: Iterable[Card]) -> List[Card]:
+        """
+        Return the requested page of matching cards and record how many matched in `matched`.
+        """
+        matching = [card for card in cards if self.matches(card)] if self.filters else list(cards)
+        self.matched = len(matching)
+        stop = None if self.limit is None else self.offset + self.limit
+        return matching[self.offset:stop]
+
+    def format(self, cards: Iterable[Card], format_type: str) -> str:
+        return CardFormatter.format(self.apply(cards), format_type, fields=self.fields, compact=self.compact)
+
+    def stream(self, cards: Iterable[Card], format_type: str) -> Iterator[str]:
+        return CardFormatter.stream(self.select(cards), format_type, fields=self.fields, compact=self.compact)
+
+
+class TestCardSelection(unittest.TestCase):
+    CARDS = [
+        Card('OP01-001', 'OP01-001', Card.Rarity.LEADER, Card.Category.LEADER, 'Roronoa Zoro', 'https://example.com/1.png',
+             [Card.Attribute.SLASH], '1', 'Red', '<b>effect</b>', power='5000'),
+        Card('OP01-006', 'OP01-006', Card.Rarity.UNCOMMON, Card.Category.CHARACTER, 'Otama', 'https://example.com/6.png',
+             [Card.Attribute.SPECIAL], '1', 'Red/Green', None, cost='1', power='0', counter='2000'),
+        Card('OP01-025', 'OP01-025', Card.Rarity.SUPER_RARE, Card.Category.CHARACTER, 'Roronoa Zoro',
+             'https://example.com/25.png', [Card.Attribute.SLASH], '1', 'Red', None, cost='3', power='5000'),
+    ]
+
+    def test_filters_and_pages(self):
+        selection = CardSelection.from_params({'category': 'CHARACTER', 'color': 'Red', 'offset': '1', 'limit': '5'})
+        self.assertEqual([card.card_id for card in selection.apply(self.CARDS)], ['OP01-025'])
+        self.assertEqual(selection.matched, 2)
+        rare = CardSelection.from_params({'rarity': 'SR'})
+        self.assertEqual([card.card_id for card in rare.select(self.CARDS)], ['OP01-025'])
+        cheap = CardSelection.from_params({'cost_lte': '2'})
+        self.assertEqual([card.card_id for card in cheap.apply(self.CARDS)], ['OP01-006'])
+
+    def test_projection_and_compact(self):
+        selection = CardSelection.from_params({'fields': 'card_code,name,img_url', 'limit': '1', 'compact': '1'})
+        self.assertEqual(selection.format(self.CARDS, 'json'),
+                         '[{"card_code":"OP01-001","name":"Roronoa Zoro","img_url":"https://example.com/1.png"}]')
+        self.assertEqual(selection.format(self.CARDS, 'csv'),
+                         '"card_code","name","img_url"\r\n"OP01-001","Roronoa Zoro","https://example.com/1.png"')
+        self.assertEqual("".join(selection.stream(self.CARDS, 'json')), selection.format(self.CARDS, 'json'))
+        self.assertTrue(CardSelection.from_params({}).is_default())
+
+    def test_invalid_params(self):
+        for params in ({'fields': 'name,html'}, {'limit': '0'}, {'offset': '-1'}, {'limit': 'ten'},
+                       {'pack': 'OP-01'}, {'rarity_lte': 'SR'}):
+            with self.assertRaises(ValueError):
+                CardSelection.from_params(params)
+
+
+if __name__ == "__main__":
+    unittest.main()
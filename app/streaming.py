@@ -0,0 +1,93 @@
+from typing import Iterable, Iterator, List, Optional
+import json
+import io
+import csv
+import unittest
+
+
+def iter_joined(lines: Iterable[str], separator: str = "\n") -> Iterator[str]:
+    """
+    Yield `lines` separated by `separator`; the chunks join to `separator.join(lines)`.
+    """
+    first = True
+    for line in lines:
+        yield line if first else separator + line
+        first = False
+
+
+def iter_json_array(records: Iterable[dict], indent: Optional[int] = 2) -> Iterator[str]:
+    """
+    Yield a JSON array one record at a time. The chunks join to exactly
+    `json.dumps(list(records), indent=indent)`, or with `indent=None` to the compact
+    `json.dumps(list(records), separators=(',', ':'))`.
+    """
+    first = True
+    if indent is None:
+        for record in records:
+            yield ("[" if first else ",") + json.dumps(record, separators=(',', ':'))
+            first = False
+        yield "[]" if first else "]"
+        return
+    pad = " " * indent
+    for record in records:
+        # Newlines inside JSON strings are escaped, so every raw newline is a line break to indent
+        item = json.dumps(record, indent=indent).replace("\n", "\n" + pad)
+        yield ("[\n" if first else ",\n") + pad + item
+        first = False
+    yield "[]" if first else "\n]"
+
+
+def iter_ndjson(records: Iterable[dict]) -> Iterator[str]:
+    """
+    Yield one compact JSON document per line.
+    """
+    for record in records:
+        yield json.dumps(record) + "\n"
+
+
+def iter_csv(header: List[str], rows: Iterable[List[str]]) -> Iterator[str]:
+    """
+    Yield a fully quoted CSV document row by row, without a trailing line break.
+    Nothing is yielded when there are no rows.
+    """
+    output = io.StringIO()
+    writer = csv.writer(output, quoting=csv.QUOTE_ALL)
+
+    def render(row):
+        output.seek(0)
+        output.truncate()
+        writer.writerow(row)
+        return output.getvalue()[:-len(writer.dialect.lineterminator)]
+
+    header_sent = False
+    for row in rows:
+        if not header_sent:
+            yield render(header)
+            header_sent = True
+        yield writer.dialect.lineterminator + render(row)
+
+
+class TestStreaming(unittest.TestCase):
+    RECORDS = [{"name": "Otama", "effect": "line\nbreak", "cost": 1}, {"name": "Zoro", "types": ["a", "b"]}]
+
+    def test_json_array_matches_dumps(self):
+        self.assertEqual("".join(iter_json_array(self.RECORDS)), json.dumps(self.RECORDS, indent=2))
+        self.assertEqual("".join(iter_json_array([])), json.dumps([], indent=2))
+        self.assertEqual("".join(iter_json_array(self.RECORDS, indent=None)),
+                         json.dumps(self.RECORDS, separators=(',', ':')))
+
+    def test_csv_matches_buffered_writer(self):
+        rows = [["1", 'say "hi"'], ["2", "multi\nline"]]
+        output = io.StringIO()
+        writer = csv.writer(output, quoting=csv.QUOTE_ALL)
+        writer.writerows([["id", "text"]] + rows)
+        self.assertEqual("".join(iter_csv(["id", "text"], iter(rows))), output.getvalue().strip())
+        self.assertEqual("".join(iter_csv(["id"], iter([]))), "")
+
+    def test_joined_and_ndjson(self):
+        self.assertEqual("".join(iter_joined(["a", "b", "c"])), "a\nb\nc")
+        self.assertEqual([json.loads(line) for line in "".join(iter_ndjson(self.RECORDS)).splitlines()], self.RECORDS)
+
+
+if __name__ == "__main__":
+    unittest.main()
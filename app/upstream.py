@@ -0,0 +1,307 @@
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Optional
+import threading
+import requests
+import logging
+import random
+import time
+import unittest
+
+from .concurrency import HostRateLimiter
+from . import metrics
+
+
+class UpstreamError(requests.exceptions.RequestException):
+    """
+    The card site did not give a usable answer, after retrying where that made sense.
+    """
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: before retry `n` it waits a random time of up to
+    `base_delay * 2**n` seconds, capped at `max_delay`, or at least as long as the server
+    asked for with Retry-After.
+    """
+
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+    THROTTLE_STATUSES = frozenset({429, 503})
+    RETRY_EXCEPTIONS = (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+    )
+
+    def __init__(self, attempts=4, base_delay=0.5, max_delay=30.0):
+        if attempts < 1:
+            raise ValueError(f"attempts must be at least 1, got {attempts}")
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, retry, retry_after=None) -> float:
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+        if retry_after is not None:
+            return max(min(retry_after, self.max_delay), backoff)
+        return backoff
+
+    @staticmethod
+    def parse_retry_after(value) -> Optional[float]:
+        """
+        Seconds to wait from a Retry-After header, given either as seconds or as an HTTP date.
+        """
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    @classmethod
+    def is_retryable(cls, error) -> bool:
+        if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+            return error.response.status_code in cls.RETRY_STATUSES
+        return isinstance(error, cls.RETRY_EXCEPTIONS)
+
+    def call(self, func, description, retry_on=()):
+        """
+        Call `func()` until it succeeds, retrying retryable request errors and `retry_on`
+        exceptions. The last error is raised once all attempts are used.
+        """
+        for retry in range(self.attempts):
+            try:
+                return func()
+            except Exception as e:
+                if retry + 1 >= self.attempts or not (self.is_retryable(e) or isinstance(e, retry_on)):
+                    raise
+                response = getattr(e, 'response', None)
+                retry_after = self.parse_retry_after(response.headers.get('Retry-After')) if response is not None else None
+                wait = self.delay(retry, retry_after)
+                metrics.UPSTREAM_RETRIES.inc(reason=type(e).__name__)
+                logging.warning(f"{description} failed ({e}); retrying in {wait:.1f}s...")
+                time.sleep(wait)
+
+
+class AdaptiveLimit:
+    """
+    AIMD limit on concurrent requests. Every success raises the limit by 1/limit (about one
+    more slot per round of requests); a throttling answer halves it, at most once per
+    `decrease_interval` so one burst of 429s counts once. A Retry-After pauses every caller.
+    """
+
+    def __init__(self, maximum, minimum=1, decrease_interval=1.0):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.decrease_interval = decrease_interval
+        self.limit = float(maximum)
+        self._active = 0
+        self._resume_at = 0.0
+        self._last_decrease = float('-inf')
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                pause = self._resume_at - time.monotonic()
+                if pause > 0:
+                    self._cond.wait(pause)
+                elif self._active < int(self.limit):
+                    break
+                else:
+                    self._cond.wait()
+            self._active += 1
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def succeeded(self):
+        with self._cond:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def throttled(self, pause=None):
+        with self._cond:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.decrease_interval:
+                self.limit = max(self.minimum, self.limit / 2)
+                self._last_decrease = now
+                logging.warning(f"Card site is pushing back; lowering concurrency to {int(self.limit)}.")
+            if pause:
+                self._resume_at = max(self._resume_at, now + pause)
+
+
+class UpstreamClient:
+    """
+    GETs pages from the card site through `session` with retries, backoff and an adaptive
+    concurrency limit. Responses below 400 (including 304) are returned; anything else
+    raises UpstreamError once retries are used up, so an error page is never parsed as an
+    empty pack. A streamed response keeps its concurrency slot until it is closed, so the
+    limit also covers bodies still being read.
+    """
+
+    TIMEOUT = 30
+
+    def __init__(self, session, rate_limiter=None, limit=None, retry=None):
+        self.session = session
+        self.rate_limiter = rate_limiter or HostRateLimiter()
+        self.limit = limit or AdaptiveLimit(maximum=16)
+        self.retry = retry or RetryPolicy()
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.TIMEOUT)
+        for retry in range(self.retry.attempts):
+            last_try = retry + 1 >= self.retry.attempts
+            retry_after = None
+            self.limit.acquire()
+            release = True
+            try:
+                self.rate_limiter.wait(url)
+                try:
+                    resp = self.session.get(url, **kwargs)
+                except RetryPolicy.RETRY_EXCEPTIONS as e:
+                    if last_try:
+                        raise UpstreamError(f"GET {url} failed after {self.retry.attempts} attempts: {e}") from e
+                    reason = type(e).__name__
+                else:
+                    if resp.status_code < 400:
+                        self.limit.succeeded()
+                        if kwargs.get('stream'):
+                            self.release_on_close(resp)
+                            release = False
+                        return resp
+                    # Error bodies are never read; a streamed one would hold its connection
+                    resp.close()
+                    if resp.status_code not in RetryPolicy.RETRY_STATUSES or last_try:
+                        raise UpstreamError(
+                            f"GET {url} answered {resp.status_code} after {retry + 1} attempts", response=resp)
+                    retry_after = RetryPolicy.parse_retry_after(resp.headers.get('Retry-After'))
+                    if resp.status_code in RetryPolicy.THROTTLE_STATUSES:
+                        self.limit.throttled(retry_after)
+                    reason = str(resp.status_code)
+            finally:
+                if release:
+                    self.limit.release()
+            wait = self.retry.delay(retry, retry_after)
+            metrics.UPSTREAM_RETRIES.inc(reason=reason)
+            logging.warning(f"GET {url} failed ({reason}); retrying in {wait:.1f}s...")
+            time.sleep(wait)
+
+    def release_on_close(self, resp):
+        """
+        Release the concurrency slot of streamed `resp` when it is closed, once.
+        """
+        close = resp.close
+        released = threading.Event()
+
+        def closing():
+            try:
+                close()
+            finally:
+                if not released.is_set():
+                    released.set()
+                    self.limit.release()
+
+        resp.close = closing
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+class TestUpstreamClient(unittest.TestCase):
+    FAST = RetryPolicy(attempts=3, base_delay=0.001, max_delay=0.01)
+
+    def test_retries_then_succeeds(self):
+        session = FakeSession([requests.exceptions.ConnectionError("reset"), FakeResponse(502), FakeResponse(200)])
+        resp = UpstreamClient(session, retry=self.FAST).get("https://example.com/cardlist")
+        self.assertEqual((resp.status_code, session.calls), (200, 3))
+
+    def test_gives_up_and_raises(self):
+        session = FakeSession([FakeResponse(503)] * 3)
+        with self.assertRaises(UpstreamError):
+            UpstreamClient(session, retry=self.FAST).get("https://example.com/cardlist")
+        with self.assertRaises(UpstreamError):
+            UpstreamClient(FakeSession([FakeResponse(404)]), retry=self.FAST).get("https://example.com/cardlist")
+
+    def test_not_modified_is_returned(self):
+        resp = UpstreamClient(FakeSession([FakeResponse(304)]), retry=self.FAST).get("https://example.com/cardlist")
+        self.assertEqual(resp.status_code, 304)
+
+    def test_throttling_halves_limit(self):
+        limit = AdaptiveLimit(maximum=8)
+        session = FakeSession([FakeResponse(429, {'Retry-After': '0'}), FakeResponse(429), FakeResponse(200)])
+        UpstreamClient(session, limit=limit, retry=self.FAST).get("https://example.com/cardlist")
+        self.assertEqual(int(limit.limit), 4)
+        for _ in range(40):
+            limit.succeeded()
+        self.assertEqual(limit.limit, 8)
+
+    def test_streamed_body_holds_slot(self):
+        limit = AdaptiveLimit(maximum=1)
+        failed = FakeResponse(502)
+        session = FakeSession([failed, FakeResponse(200)])
+        resp = UpstreamClient(session, limit=limit, retry=self.FAST).get("https://example.com/cardlist", stream=True)
+        self.assertTrue(failed.closed)
+        self.assertEqual(limit._active, 1)
+        resp.close()
+        resp.close()
+        self.assertTrue(resp.closed)
+        self.assertEqual(limit._active, 0)
+        UpstreamClient(FakeSession([FakeResponse(200)]), limit=limit, retry=self.FAST).get("https://example.com/cardlist")
+        self.assertEqual(limit._active, 0)
+
+    def test_retry_after(self):
+        self.assertEqual(RetryPolicy.parse_retry_after("3"), 3.0)
+        self.assertIsNone(RetryPolicy.parse_retry_after("soon"))
+        self.assertGreaterEqual(RetryPolicy(max_delay=60).delay(0, retry_after=5), 5)
+
+    def test_call_retries_retryable_errors(self):
+        answers = [IOError("short read"), "ok"]
+
+        def flaky():
+            answer = answers.pop(0)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+        self.assertEqual(self.FAST.call(flaky, "download", retry_on=(IOError,)), "ok")
+        with self.assertRaises(ValueError):
+            self.FAST.call(lambda: int("x"), "parse")
+
+
+if __name__ == "__main__":
+    unittest.main()